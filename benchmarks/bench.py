@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""wanstatus benchmark harness, using local fakes (see fakes.py) in place of real DNS servers, modem,
+router and external WAN IP page.
+
+Reports, with CPU time and RSS per cycle:
+    get_data    device.get_data() latency for each device profile
+    engines     Shared DNS query and ping engine, and concurrent DNS connection probe, latency for a
+                healthy site while other sites' probes stall.  Fails if the healthy probes wait on the
+                stalled ones (see bench_engines())
+    main        Interactive mode main() cycle latency
+    service     service() check latency, and outage and recovery detection latency, with the fake DNS
+                server toggled between up and blackhole (or down) modes
+
+The fakes run in a child process, so the CPU and RSS numbers are for wanstatus alone.
+
+Usage (from the repo root, with wanstatus installed or importable from src/):
+    python benchmarks/bench.py
+    python benchmarks/bench.py --latency 0.05 --size 200000 --failure-rate 0.1 --modem cox --router pfsense
+    python benchmarks/bench.py --benchmarks get_data --stall-rate 0.05 --latency 0.02 --device-timeout 15s
+"""
+
+import argparse
+import json
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import logging as _logging
+from pathlib import Path
+
+try:
+    import wanstatus.wanstatus as ws
+except ImportError:
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+    import wanstatus.wanstatus as ws
+
+from cjnfuncs.core import set_toolname
+from cjnfuncs.configman import config_item
+from wanstatus.settings import config_snapshot
+
+from fakes import fake_site, device_config_lines
+
+
+def rss_mb():
+    """Current resident set size in MB (peak RSS where /proc is not available).
+    """
+    try:
+        with open("/proc/self/statm") as ifile:
+            return int(ifile.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class sampler:
+    """ Collect per-cycle wall time and CPU time samples.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.wall = []
+        self.cpu = []
+
+    def time(self, func, *args):
+        wall, cpu = time.perf_counter(), time.process_time()
+        result = func(*args)
+        self.wall.append(time.perf_counter() - wall)
+        self.cpu.append(time.process_time() - cpu)
+        return result
+
+    def summary(self):
+        if not self.wall:
+            return {"name": self.name, "cycles": 0}
+        wall = sorted(self.wall)
+        return {"name":         self.name,
+                "cycles":       len(wall),
+                "mean_ms":      statistics.mean(wall) * 1000,
+                "p50_ms":       wall[len(wall) // 2] * 1000,
+                "p95_ms":       wall[min(len(wall) - 1, int(len(wall) * 0.95))] * 1000,
+                "max_ms":       wall[-1] * 1000,
+                "cpu_ms":       statistics.mean(self.cpu) * 1000  if self.cpu  else None,
+                "rss_mb":       rss_mb()}
+
+
+def write_config(tmpdir, addrs, args):
+    lines = [
+        "LogLevel                  40",
+        "ConsoleLogFormat          {levelname:>8}:  {message}",
+        "nRetries                  2",
+        f"StatusRecheckPeriod       {args.period}",
+        f"OutageRecheckPeriod       {args.outage_period}",
+        f"RecoveryDelay             {args.recovery_delay}",
+        "ExternalWANRecheckPeriod  1h",
+        "ConfigWatchMode           poll",
+        "ConfigRecheckPeriod       1h",
+        f"IACheckMethod             {args.ia_method}",
+        f"IADNSAddrs                {addrs['dns']}",
+        f"IADNSTimeout              {args.probe_timeout}",
+        f"WANIPFile                 {tmpdir}/WANIP.txt",
+        "DeviceSessionFile         None",
+        "LatencyStoreFile          None",
+        f"EventStoreFile            {tmpdir}/events.db",
+        f"ControlSocket             {tmpdir}/wanstatus.sock",
+        f"ModemTimeout              {args.device_timeout}",
+        f"RouterTimeout             {args.device_timeout}",
+        "WANIPWebpage              " + "  ".join(f"{url}/ip" for name, url in addrs.items() if name.startswith("external")),
+        "WANIPProviderRate         100000/1h",
+        "WANIPBudgetFile           None",
+        r"WANIPWebpageRE            ([\d]+\.[\d]+\.[\d]+\.[\d]+)",
+        "WANIPWebpageTimeout       5s",
+        ]
+    lines += device_config_lines("Modem", args.modem, addrs['modem'], channels=bool(args.channels))
+    lines += device_config_lines("Router", args.router, addrs['router'])
+    lines += ["[SMTP]", "DontEmail True", "DontNotif True"]
+    path = Path(tmpdir) / "bench.cfg"
+    path.write_text("\n".join(lines) + "\n")
+    return path
+
+
+def load_wanstatus(config_path):
+    """Set up the wanstatus module globals, as cli() does.
+    """
+    set_toolname("wanstatus_bench")
+    ws.config = config_item(str(config_path))
+    ws.config.loadconfig(call_logfile_wins=True)
+    ws.logfile_override = True
+    ws.cfg = config_snapshot(ws.config)
+    ws.set_stores()
+    for handler in _logging.getLogger().handlers:   # main() forces info level logging.  Keep the console quiet.
+        handler.setLevel(_logging.ERROR)
+
+
+def bench_get_data(fakes, args):
+    results = []
+    for device_name in ("Modem", "Router"):
+        _device = ws.device(device_name, ws.cfg)
+        stats = sampler(f"get_data {device_name} ({getattr(args, device_name.lower())})")
+        fails = 0
+        for _ in range(args.iterations):
+            status, _, _ = stats.time(_device.get_data)
+            fails += not status
+            if status  and  device_name == "Modem"  and  args.channels  and  len(_device.record["rows"]) != args.channels:
+                raise RuntimeError(f"Modem record has {len(_device.record['rows'])} rows, expected {args.channels}")
+        _device.close()
+        summary = stats.summary()
+        summary["fails"] = fails
+        summary["logins"] = fakes.get(device_name.lower(), "logins")["logins"]
+        summary["hedges"] = _device.hedges
+        results.append(summary)
+    return results
+
+
+def bench_external(fakes, args):
+    stats = sampler(f"get_external_WANIP ({args.providers} providers)")
+    fails = 0
+    for _ in range(args.iterations):
+        status, _, _ = stats.time(ws.get_external_WANIP)
+        fails += not status
+    summary = stats.summary()
+    summary["fails"] = fails
+    return [summary]
+
+
+def bench_engines(fakes, args):
+    """Shared DNS query and native ping engine check, and concurrent (IAConcurrent) DNS connection
+    probes, as for a fleet with --stalled-sites stalled sites and one healthy site:  a thread per
+    stalled site keeps probing targets that never answer, with a --stall-timeout timeout, while the
+    healthy site's probes run.  The healthy probes must neither wait for the stalled ones nor report a
+    response time short of their wall time.  Raises RuntimeError if they do.
+    """
+    snap = ws.cfg
+    stalled_dns = fakes.addrs["stalled_dns"]
+    pairs = [("dnsquery", ws._dnsquery_probe, stalled_dns, fakes.addrs["dns"]),
+             ("dns concurrent", _concurrent_dns, (stalled_dns, stalled_dns), (fakes.addrs["dns"],))]
+    if ws.get_pinger(snap):
+        pairs.append(("ping", ws._ping_probe, args.stalled_ping_addr, "127.0.0.1"))
+    results = []
+    for name, probe, stalled_addr, healthy_addr in pairs:
+        stop = threading.Event()
+        stalls = []
+
+        def stalled_site():
+            while not stop.is_set():
+                try:
+                    probe(snap, stalled_addr, args.stall_timeout)
+                except Exception:
+                    stalls.append(1)
+
+        threads = [threading.Thread(target=stalled_site, name="stalled_site", daemon=True) for _ in range(args.stalled_sites)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        stats = sampler(f"{name}, with stalled sites")
+        fails = 0
+        max_gap = 0.0
+        for _ in range(args.iterations):
+            try:
+                _, _, rtt = stats.time(probe, snap, healthy_addr, args.stall_timeout)
+                max_gap = max(max_gap, stats.wall[-1] * 1000 - rtt)
+            except Exception:
+                fails += 1
+            if stats.wall  and  stats.wall[-1] > args.stall_timeout / 2:
+                break                           # Waited on the stalled site.  No need to wait for more.
+        stop.set()
+        for thread in threads:
+            thread.join(args.stall_timeout * snap.nRetries + 1)
+        summary = stats.summary()
+        summary["fails"] = fails
+        summary["stalls"] = len(stalls)
+        summary["rttgap_ms"] = max_gap
+        results.append(summary)
+        if not stalls:
+            print (f"{name}:  stalled target <{stalled_addr}> answered.  Nothing to check.", file=sys.stderr)
+        elif fails  or  summary["max_ms"] > args.stall_timeout * 1000 / 2  or  max_gap > ENGINE_RTT_GAP_MS:
+            raise RuntimeError(f"{name}:  healthy site probes held up by the stalled site, or response time under-reported:  "
+                               f"{fails} fails, max {summary['max_ms']:.1f} ms, max (wall - reported) {max_gap:.1f} ms")
+    return results
+
+ENGINE_RTT_GAP_MS = 50                          # Max allowed (wall time - reported response time) per probe
+
+
+def _concurrent_dns(snap, addrs, timeout):
+    """DNS connection probe of addrs as have_internet() does with IAConcurrent.  Raises if all fail.
+    """
+    status, msg, rtt, _ = ws._race_probes(snap, ws._dns_probe, addrs, timeout, time.time() + timeout)
+    if not status:
+        raise TimeoutError(msg)
+    return status, msg, rtt
+
+
+def bench_main(fakes, args):
+    stats = sampler("main cycle")
+    for _ in range(args.iterations):
+        stats.time(ws.main)
+        for _device in ws.interactive_devices:
+            _device.close()
+        ws.interactive_devices.clear()
+    return [stats.summary()]
+
+
+def bench_service(fakes, args):
+    """Run service() on a thread, and toggle the fake DNS server to cause outages and recoveries.
+    """
+    checks = {name: sampler(f"service {name} check") for name in ("internet", "modem", "router", "external")}
+    originals = {}
+    for name, stats in checks.items():                          # Time each check
+        method = f"check_{name}"
+        originals[method] = getattr(ws.wan_monitor, method)
+        def timed(self, _method=originals[method], _stats=stats):
+            return _stats.time(_method, self)
+        setattr(ws.wan_monitor, method, timed)
+
+    thread = threading.Thread(target=ws.service, name="service", daemon=True)
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    thread.start()
+    while not ws.monitors:
+        time.sleep(0.01)
+    monitor = ws.monitors['']
+
+    outage_detect = sampler("outage detection")
+    recovery_detect = sampler("recovery detection")
+    try:
+        for _ in range(args.outages):
+            time.sleep(args.settle)
+            fakes.set("dns", mode=args.outage_mode)
+            fault_time = time.time()
+            if not wait_for(lambda: monitor.outage_timestamp is not None, args.detect_timeout):
+                print ("Outage not detected", file=sys.stderr)
+                break
+            outage_detect.wall.append(time.time() - fault_time)
+
+            time.sleep(args.settle)
+            fakes.set("dns", mode='up')
+            restore_time = time.time()
+            if not wait_for(lambda: monitor.recovered_timestamp is not None, args.detect_timeout):
+                print ("Recovery not detected", file=sys.stderr)
+                break
+            recovery_detect.wall.append(time.time() - restore_time)
+            wait_for(lambda: monitor.outage_timestamp is None, args.detect_timeout)
+    finally:
+        ws.sched.stop()
+        thread.join(5)
+        ws.sched.wait_idle(5)
+        for _monitor in ws.monitors.values():
+            _monitor.close()
+        ws.monitors.clear()
+        ws.watcher.close()
+        if ws.events:
+            ws.events.close()
+        if ws.control_socket:
+            ws.control_socket.close()
+            ws.control_socket = None
+        for method, func in originals.items():
+            setattr(ws.wan_monitor, method, func)
+
+    cpu, wall = time.process_time() - cpu_start, time.perf_counter() - wall_start
+    ncycles = len(checks["internet"].wall)
+    results = [stats.summary() for stats in checks.values()]
+    for stats in (outage_detect, recovery_detect):
+        results.append(stats.summary())
+    results.append({"name": "service totals", "cycles": ncycles, "wall_s": wall, "cpu_s": cpu,
+                    "cpu_ms_per_cycle": cpu / ncycles * 1000  if ncycles  else None, "rss_mb": rss_mb()})
+    return results
+
+
+def wait_for(condition, timeout):
+    end_time = time.time() + timeout
+    while not condition():
+        if time.time() > end_time:
+            return False
+        time.sleep(0.001)
+    return True
+
+
+def print_results(results):
+    columns = ("cycles", "fails", "logins", "hedges", "mean_ms", "p50_ms", "p95_ms", "max_ms", "rttgap_ms", "cpu_ms", "rss_mb")
+    print (f"{'':30}" + "".join(f"{column:>10}" for column in columns))
+    for result in results:
+        if "wall_s" in result:
+            print (f"{result['name']:30} {result['cycles']:>9} cycles in {result['wall_s']:.1f} s, "
+                   f"CPU {result['cpu_s']:.3f} s ({result['cpu_ms_per_cycle'] or 0:.2f} ms per internet check cycle), "
+                   f"RSS {result['rss_mb']:.1f} MB")
+            continue
+        line = f"{result['name']:30}"
+        for column in columns:
+            value = result.get(column)
+            line += f"{'':>10}"  if value is None  else  f"{value:>10.2f}"  if isinstance(value, float)  else  f"{value:>10}"
+        print (line)
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--benchmarks', default="get_data,external,engines,main,service",
+                        help="Comma separated list of benchmarks to run (default get_data,external,engines,main,service)")
+    parser.add_argument('--iterations', type=int, default=50, help="get_data and main cycles (default 50)")
+    parser.add_argument('--modem', default='cox', choices=['ddwrt', 'pfsense', 'cox'], help="Modem profile (default cox)")
+    parser.add_argument('--router', default='pfsense', choices=['ddwrt', 'pfsense', 'cox'], help="Router profile (default pfsense)")
+    parser.add_argument('--latency', type=float, default=0.0, help="Fake device response latency, seconds")
+    parser.add_argument('--size', type=int, default=0, help="Fake device page size, bytes")
+    parser.add_argument('--pad-at', default='start', choices=['start', 'end'], help="Page padding before or after the status data")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="Fake device HTTP 500 rate, 0 to 1")
+    parser.add_argument('--stall-rate', type=float, default=0.0, help="Fake device stalled (never answered) request rate, 0 to 1")
+    parser.add_argument('--providers', type=int, default=1, help="Number of fake external WANIP providers (default 1)")
+    parser.add_argument('--channels', type=int, default=0, help="Cox modem channel table rows, extracted with ModemFieldsRE/ModemRowRE (default 0, none)")
+    parser.add_argument('--session-ttl', type=float, default=None, help="Fake device login session lifetime, seconds")
+    parser.add_argument('--outages', type=int, default=3, help="Service mode outage/recovery cycles (default 3)")
+    parser.add_argument('--outage-mode', default='blackhole', choices=['blackhole', 'down'],
+                        help="Fake DNS outage behavior:  timeouts (default) or connection refused")
+    parser.add_argument('--settle', type=float, default=2.0, help="Service mode time between faults, seconds")
+    parser.add_argument('--detect-timeout', type=float, default=30.0, help="Max wait for outage/recovery detection, seconds")
+    parser.add_argument('--period', default='1s', help="Service mode StatusRecheckPeriod (default 1s)")
+    parser.add_argument('--outage-period', default='0.2s', help="Service mode OutageRecheckPeriod (default 0.2s)")
+    parser.add_argument('--recovery-delay', default='0.5s', help="Service mode RecoveryDelay (default 0.5s)")
+    parser.add_argument('--ia-method', default='dns', choices=['dns', 'dnsquery'], help="IACheckMethod (default dns)")
+    parser.add_argument('--probe-timeout', default='0.5s', help="IADNSTimeout (default 0.5s)")
+    parser.add_argument('--device-timeout', default='3s', help="Modem and Router Timeout (default 3s)")
+    parser.add_argument('--stall-timeout', type=float, default=3.0, help="Engines stalled site probe timeout, seconds (default 3)")
+    parser.add_argument('--stalled-sites', type=int, default=4, help="Engines stalled sites (default 4)")
+    parser.add_argument('--stalled-ping-addr', default='192.0.2.1', help="Engines stalled site ping target (default 192.0.2.1, TEST-NET-1)")
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    knobs = {"latency": args.latency, "size": args.size, "pad_at": args.pad_at,
+             "failure_rate": args.failure_rate, "stall_rate": args.stall_rate, "session_ttl": args.session_ttl}
+    if args.channels  and  args.modem != 'cox':
+        parser.error("--channels requires --modem cox")
+    fakes = fake_site({"dns":      ("dns", {}),
+                       "stalled_dns": ("dns", {"mode": 'blackhole'}),
+                       "modem":    (args.modem, {**knobs, "channels": args.channels}),
+                       "router":   (args.router, knobs),
+                       "external": ("external", {}),
+                       **{f"external{i}": ("external", {}) for i in range(2, args.providers + 1)}})
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            load_wanstatus(write_config(tmpdir, fakes.addrs, args))
+            for name in args.benchmarks.split(","):
+                results += globals()[f"bench_{name.strip()}"](fakes, args)
+    finally:
+        fakes.close()
+
+    if args.json:
+        print (json.dumps(results, indent=2))
+    else:
+        print_results(results)
+
+
+if __name__ == '__main__':
+    sys.exit(cli())
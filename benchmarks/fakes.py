@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+"""Local stand-in servers for benchmarking wanstatus without real hardware.
+
+fake_dns        TCP listener for have_internet() DNS mode, and UDP DNS server (answering any A query
+                with WANIP) for DNSquery mode.  mode is 'up', 'down' (connection refused, queries
+                unanswered) or 'blackhole' (connections and queries time out).  Knobs rcode (answer
+                with this DNS error code, eg 2 for SERVFAIL) and truncate (answer UDP queries with
+                the TC flag, and the full answer over TCP).
+fake_device     HTTP server emulating one of:
+                    'ddwrt'     dd-wrt router Info.live.htm, no login
+                    'pfsense'   pfSense index.php with the __csrf_magic token / CSRF Error login flow
+                    'cox'       Cox/Technicolor gateway check.jst session login, with network_setup.jst
+                                (modem Lock Status) and connection_status.jst (WAN IP) status pages
+                    'external'  External WAN IP web page (httpbin.org/ip style)
+
+fake_device knobs, changeable while running:
+    latency         Seconds of delay before each response
+    size            Pad each page to this many bytes.  The status data is placed at pad_at
+                    ('start' or 'end') of the page.
+    failure_rate    Fraction of requests answered with a 500 error
+    blackhole       If True, requests are read but never answered (the client times out)
+    stall_rate      Fraction of requests read but never answered, as with a stalled connection
+    session_ttl     Seconds before a pfsense or cox login session expires (None for never)
+    wanip           WAN IP address reported by the 'external' page (default WANIP)
+    channels        Number of rows in a Motorola style downstream channel table (plus a System Up
+                    Time field) added to the cox network_setup.jst page, with random power, SNR
+                    and error counts.  0 (default) for none.
+
+fake_site runs a set of fakes in a child process, so that their CPU time and memory aren't counted
+against wanstatus, and changes their knobs on request.
+"""
+
+import multiprocessing
+import random
+import secrets
+import select
+import socket
+import struct
+import threading
+import time
+import http.server
+import urllib.parse
+
+
+WANIP           = "203.0.113.45"
+USERNAME        = "admin"
+PASSWORD        = "password"
+
+
+class fake_dns:
+    """ TCP listener and UDP DNS server on address:port.  Set .mode to 'up', 'down' or 'blackhole'.
+    """
+
+    def __init__(self, address="127.0.0.1", port=0, mode='up', rcode=0, truncate=False):
+        self.address = address
+        self.mode = mode
+        self.rcode = rcode
+        self.truncate = truncate
+        self.connects = 0
+        self.queries = 0
+        self.listener = None
+        self.filler = None
+        self.stop_flag = False
+        self._listen(port)
+        self.port = self.listener.getsockname()[1]
+        self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp.bind((self.address, self.port))
+        threading.Thread(target=self._serve, name="fake_dns", daemon=True).start()
+        threading.Thread(target=self._serve_udp, name="fake_dns_udp", daemon=True).start()
+
+    @property
+    def addr(self):
+        return f"{self.address}:{self.port}"
+
+    def _listen(self, port, backlog=16):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((self.address, port))
+        self.listener.listen(backlog)
+        self.backlog = backlog
+
+    def _serve(self):
+        while not self.stop_flag:
+            mode = self.mode
+            if mode == 'down':
+                if self.listener:
+                    self._close_listener()
+                time.sleep(0.02)
+                continue
+            if self.listener  and  (mode == 'blackhole') != (self.backlog == 0):
+                self._close_listener()
+            if not self.listener:
+                # A backlog of 0 (1 on Linux) when blackholed, so that the accept queue is easy to fill.
+                # Up, a backlog of 0 drops the occasional SYN (a 1s connect), so a normal backlog is used.
+                self._listen(self.port, 0  if mode == 'blackhole'  else 16)
+            if mode == 'blackhole':
+                if not self.filler:             # Fill the accept queue.  Further SYNs are dropped.
+                    self.filler = socket.create_connection((self.address, self.port), timeout=1)
+                time.sleep(0.02)
+                continue
+            if self.filler:
+                self.filler.close()
+                self.filler = None
+            readable, _, _ = select.select([self.listener], [], [], 0.02)
+            if readable:
+                conn, _ = self.listener.accept()
+                self.connects += 1
+                if self.truncate:               # Answer the TCP retry of a truncated query
+                    try:
+                        conn.settimeout(1)
+                        length = struct.unpack("!H", conn.recv(2))[0]
+                        reply = self._answer(conn.recv(length), truncated=False)
+                        conn.sendall(struct.pack("!H", len(reply)) + reply)
+                    except (OSError, struct.error):
+                        pass
+                conn.close()
+
+    def _serve_udp(self):
+        while not self.stop_flag:
+            readable, _, _ = select.select([self.udp], [], [], 0.02)
+            if not readable:
+                continue
+            try:
+                query, client = self.udp.recvfrom(512)
+            except OSError:
+                continue
+            self.queries += 1
+            if self.mode != 'up':
+                continue
+            self.udp.sendto(self._answer(query, self.truncate), client)
+
+    def _answer(self, query, truncated):
+        """Return the response to query:  an A record with WANIP for the question name.
+        """
+        txid = query[:2]
+        question = query[12:]
+        flags = 0x8180 | self.rcode | (0x0200  if truncated  else 0)
+        ancount = 1  if not self.rcode  and  not truncated  else 0
+        reply = txid + struct.pack("!HHHHH", flags, 1, ancount, 0, 0) + question
+        if ancount:
+            reply += struct.pack("!HHHIH", 0xc00c, 1, 1, 60, 4) + socket.inet_aton(WANIP)
+        return reply
+
+    def _close_listener(self):
+        if self.filler:
+            self.filler.close()
+            self.filler = None
+        self.listener.close()
+        self.listener = None
+
+    def close(self):
+        self.stop_flag = True
+        time.sleep(0.05)
+        if self.listener:
+            self._close_listener()
+        self.udp.close()
+
+
+class fake_device:
+    """ HTTP server emulating a device profile on address:port (port 0 picks a free port).
+    """
+
+    def __init__(self, profile, address="127.0.0.1", port=0, latency=0.0, size=0, pad_at='start',
+                 failure_rate=0.0, blackhole=False, stall_rate=0.0, session_ttl=None, channels=0, wanip=WANIP):
+        self.profile = profile
+        self.latency = latency
+        self.size = size
+        self.pad_at = pad_at
+        self.failure_rate = failure_rate
+        self.blackhole = blackhole
+        self.stall_rate = stall_rate
+        self.session_ttl = session_ttl
+        self.channels = channels
+        self.wanip = wanip
+        self.requests = 0
+        self.logins = 0
+        self.sessions = {}                      # session id: [login time or None, csrf token]
+        self.lock = threading.Lock()
+
+        fake = self
+        class handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"       # Keep-alive, as real devices do
+            disable_nagle_algorithm = True      # Else headers and body writes add a delayed-ACK stall
+            def do_GET(self):
+                fake._handle(self, {})
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                form = urllib.parse.parse_qs(self.rfile.read(length).decode())
+                fake._handle(self, {key: values[0] for key, values in form.items()})
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = http.server.ThreadingHTTPServer((address, port), handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.url = f"http://{address}:{self.port}"
+        threading.Thread(target=self.httpd.serve_forever, name=f"fake_{profile}", daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+    # --------------  Request handling  --------------
+
+    def _handle(self, request, form):
+        with self.lock:
+            self.requests += 1
+        if self.blackhole  or  random.random() < self.stall_rate:
+            time.sleep(60)
+            return
+        if self.latency:
+            time.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            self._send(request, 500, "<html>Internal Server Error</html>")
+            return
+        path = urllib.parse.urlparse(request.path).path
+        getattr(self, f"_{self.profile}")(request, path, form)
+
+    def _send(self, request, code, body, cookie=None):
+        body = body.encode()
+        if self.size > len(body):
+            padding = b"<!-- " + b"x" * (self.size - len(body) - 9) + b" -->\n"
+            body = padding + body  if self.pad_at == 'start'  else body + padding
+        request.send_response(code)
+        request.send_header("Content-Type", "text/html; charset=utf-8")
+        request.send_header("Content-Length", str(len(body)))
+        if cookie:
+            request.send_header("Set-Cookie", cookie)
+        request.end_headers()
+        request.wfile.write(body)
+
+    def _session(self, request):
+        """Return the request's session id and state, creating a new session if needed.
+        """
+        cookie = request.headers.get('Cookie', '')
+        sid = dict(item.strip().split('=', 1) for item in cookie.split(';') if '=' in item).get('SID')
+        with self.lock:
+            if sid not in self.sessions:
+                sid = secrets.token_hex(8)
+                self.sessions[sid] = [None, secrets.token_hex(16)]
+            state = self.sessions[sid]
+            if state[0] is not None  and  self.session_ttl is not None  and  time.time() - state[0] > self.session_ttl:
+                state[0] = None                 # Expired
+        return sid, state
+
+    def _login(self, state):
+        with self.lock:
+            state[0] = time.time()
+            self.logins += 1
+
+    def _ddwrt(self, request, path, form):
+        if path != "/Info.live.htm":
+            self._send(request, 404, "Not found")
+            return
+        self._send(request, 200, "{lan_mac::00:11:22:33:44:55}\n{wan_proto::dhcp}\n"
+                                 f"{{wan_ipaddr::{WANIP}/24}}\n{{wan_gateway::203.0.113.1}}\n")
+
+    def _external(self, request, path, form):
+        self._send(request, 200, f'{{\n  "origin": "{self.wanip}"\n}}\n')
+
+    def _pfsense(self, request, path, form):
+        sid, state = self._session(request)
+        cookie = f"SID={sid}; path=/"
+        if request.command == 'POST'  and  form.get('__csrf_magic') != f"sid:{state[1]}":
+            state[1] = secrets.token_hex(16)
+            self._send(request, 403, "<html><head><title>CSRF Error</title></head><body>"
+                                     f'<script>var csrfMagicToken = "sid:{state[1]}";var csrfMagicName = "__csrf_magic";</script>'
+                                     "</body></html>", cookie)
+            return
+        if state[0] is None:
+            if form.get('usernamefld') == USERNAME  and  form.get('passwordfld') == PASSWORD:
+                self._login(state)
+            else:
+                self._send(request, 200, "<html><head><title>Login</title></head>"
+                                         f'<script>var csrfMagicToken = "sid:{state[1]}";var csrfMagicName = "__csrf_magic";</script></html>', cookie)
+                return
+        state[1] = secrets.token_hex(16)
+        self._send(request, 200, "<html><head><title>pfSense - Status: Dashboard</title></head><body>"
+                                 f'<script>var csrfMagicToken = "sid:{state[1]}";var csrfMagicName = "__csrf_magic";</script>'
+                                 '<table><tr><td class="col" title="via dhcp">\n'
+                                 f"    {WANIP}\n</td></tr></table></body></html>", cookie)
+
+    def _cox(self, request, path, form):
+        sid, state = self._session(request)
+        cookie = f"SID={sid}; path=/"
+        if path == "/check.jst":
+            if form.get('username') == USERNAME  and  form.get('password') == PASSWORD:
+                self._login(state)
+                self._send(request, 200, "<html>at_a_glance</html>", cookie)
+            else:
+                self._send(request, 200, "<html>home_loggedout</html>", cookie)
+            return
+        if state[0] is None:
+            self._send(request, 200, '<script type="text/javascript">alertLoc("Please Login First!"); '
+                                     'location.href="home_loggedout.jst";</script>', cookie)
+            return
+        if path == "/network_setup.jst":
+            self._send(request, 200, '<table><tr><td class="row-label acs-th"><div style="width: 100px">Downstream</div></td>\n'
+                                     '<th class="row-label ">Lock Status</td>\n'
+                                     '<td><div style="width: 100px">Locked</div></td><td><div style="width: 100px">Locked</div>\n'
+                                     '</tr></table>' + self._channel_table(), cookie)
+        elif path == "/connection_status.jst":
+            self._send(request, 200, '<span class="readonlyLabel" id="waniploc">WAN IP Address:</span> '
+                                     f'<span class="value">\n  {WANIP}\n</span>', cookie)
+        else:
+            self._send(request, 404, "Not found", cookie)
+
+    def _channel_table(self):
+        if not self.channels:
+            return ""
+        cell = "<td class='moto-param-value'>{}</td>"
+        rows = [f"<tr><td class='moto-param-name'>&nbsp;&nbsp;&nbsp;System Up Time</td>{cell.format('3 days 04h:05m:06s')}</tr>"]
+        for channel in range(1, self.channels + 1):
+            values = (channel, "Locked", "QAM256", channel + 16, f"{477.0 + 6 * channel:.1f}", f"{random.uniform(-5, 8):.1f}",
+                      f"{random.uniform(35, 42):.1f}", random.randint(0, 5000), random.randint(0, 50))
+            rows.append("<tr>" + "\n  ".join(cell.format(value) for value in values) + "</tr>")
+        return "\n<table class='moto-table-content'>\n" + "\n".join(rows) + "\n</table>\n"
+
+
+# Config params for wanstatus to use each device profile, as 'Modem' or 'Router'.  {url} is the fake's url.
+DEVICE_CONFIGS = {
+    'ddwrt': {
+        "StatusPage":           "{url}/Info.live.htm",
+        "StatusRE":             r"{{wan_ipaddr::([\d]+\.[\d]+\.[\d]+\.[\d]+)\/\d+}}",
+        },
+    'pfsense': {
+        "LoginRequiredText":    "<title>CSRF Error</title>",
+        "LoginUsernameField":   "usernamefld",
+        "LoginPasswordField":   "passwordfld",
+        "LoginAdditionalKeys":  "login : Login, '__csrf_magic' : \"None\"",
+        "CsrfRE":               'csrfMagicToken = "(.*)";var',
+        "StatusPage":           "{url}/index.php",
+        "StatusRE":             r'<td.+title="via.dhcp">\s+([\d]+\.[\d]+\.[\d]+\.[\d]+)',
+        "_USER":                USERNAME,
+        "_PASS":                PASSWORD,
+        },
+    'cox': {
+        "LoginPage":            "{url}/check.jst",
+        "LoginRequiredText":    '<script type="text/javascript">alertLoc("Please Login First!"); location.href="home_loggedout.jst";</script>',
+        "LoginUsernameField":   "username",
+        "LoginPasswordField":   "password",
+        "StatusPage":           "{url}/network_setup.jst",
+        "StatusRE":             r'Downstream</div></td>(?:(?!Lock Status)[\s\S])*?Lock Status<\/td>\s+<td><div style="width: 100px">([ \w]+)<\/div>',
+        "_USER":                USERNAME,
+        "_PASS":                PASSWORD,
+        },
+    }
+
+
+# Config params to extract the channel table (see the channels knob)
+CHANNEL_CONFIG = {
+    "FieldsRE":     r"System Up Time</td>\s*<td class='moto-param-value'>(?P<uptime>[^<]+)</td>",
+    "RowRE":        r"<tr><td class='moto-param-value'>(?P<channel>\d+)</td>\s*<td class='moto-param-value'>(?P<lock>[\w ]+)</td>"
+                    r"\s*<td class='moto-param-value'>(?P<modulation>\w+)</td>\s*<td class='moto-param-value'>(?P<channel_id>\d+)</td>"
+                    r"\s*<td class='moto-param-value'>(?P<freq>[\d.]+)</td>\s*<td class='moto-param-value'>(?P<power>[-\d.]+)</td>"
+                    r"\s*<td class='moto-param-value'>(?P<snr>[\d.]+)</td>\s*<td class='moto-param-value'>(?P<corrected>\d+)</td>"
+                    r"\s*<td class='moto-param-value'>(?P<uncorrected>\d+)</td></tr>",
+    }
+
+
+def device_config_lines(device_name, profile, url, channels=False):
+    """Return wanstatus config file lines for device_name ('Modem' or 'Router') using the fake at url.
+    If channels, also the lines to extract the channel table.
+    """
+    lines = [f"{device_name}{key:24} {value.format(url=url)}" for key, value in DEVICE_CONFIGS[profile].items()]
+    if channels:
+        lines += [f"{device_name}{key:24} {value}" for key, value in CHANNEL_CONFIG.items()]
+    return lines
+
+
+def _run_fakes(conn, specs):
+    fakes = {}
+    for name, (profile, kwargs) in specs.items():
+        fakes[name] = fake_dns(**kwargs)  if profile == 'dns'  else fake_device(profile, **kwargs)
+    conn.send({name: fake.addr  if profile == 'dns'  else fake.url
+               for (name, fake), (profile, _) in zip(fakes.items(), specs.values())})
+    while True:
+        cmd, name, args = conn.recv()
+        if cmd == 'stop':
+            break
+        if cmd == 'set':
+            for key, value in args.items():
+                setattr(fakes[name], key, value)
+            conn.send(None)
+        elif cmd == 'get':
+            conn.send({key: getattr(fakes[name], key) for key in args})
+    for fake in fakes.values():
+        fake.close()
+
+
+class fake_site:
+    """ Run the fakes in specs in a child process.
+
+    specs is a dict of name: (profile, kwargs), with profile 'dns' for a fake_dns, else a fake_device
+    profile.  addrs is a dict of name: 'address:port' (fake_dns) or url (fake_device).
+    """
+
+    def __init__(self, specs):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.lock = threading.Lock()
+        self.process = multiprocessing.Process(target=_run_fakes, args=(child_conn, specs), name="fakes", daemon=True)
+        self.process.start()
+        self.addrs = self.conn.recv()
+
+    def set(self, name, **knobs):
+        """Set knobs (eg, latency=0.5, or mode='blackhole' for a fake_dns) on fake name.
+        """
+        with self.lock:
+            self.conn.send(('set', name, knobs))
+            self.conn.recv()
+
+    def get(self, name, *attrs):
+        """Return a dict of the attrs (eg, 'requests', 'logins', 'connects') of fake name.
+        """
+        with self.lock:
+            self.conn.send(('get', name, attrs))
+            return self.conn.recv()
+
+    def close(self):
+        with self.lock:
+            self.conn.send(('stop', None, None))
+        self.process.join(5)
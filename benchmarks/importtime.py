@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""wanstatus startup time benchmark and lazy import check.
+
+Runs each scenario in a fresh interpreter several times, and reports the median and min wall time.
+Also reports any modules loaded by the scenario that it should not need (eg, requests or the SMTP
+stack for --print-log), and exits with status 1 if there are any, or if the import scenario's median
+exceeds --max-ms.
+
+Scenarios:
+    python          Bare interpreter startup, for reference
+    import          import wanstatus.wanstatus
+    version         wanstatus -V
+    print-log       wanstatus --print-log
+    interactive     wanstatus, with only a DNS internet access check configured (a local fake_dns), and
+                    no control socket
+    defaults        As interactive, but with the device session, latency and event stores and the control
+                    socket enabled as in the default config (in a temp dir).  The control socket module
+                    is needed here to look for a running service.
+
+Usage (from the repo root, with wanstatus installed or importable from src/):
+    python benchmarks/importtime.py
+    python benchmarks/importtime.py --runs 20 --max-ms 150
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from fakes import fake_dns
+
+
+SRC_DIR = Path(__file__).resolve().parent.parent / "src"
+
+# Modules that none of the scenarios need
+HEAVY = ("requests", "urllib3", "cjnfuncs.SMTP", "cjnfuncs.deployfiles", "smtplib", "http.server", "sqlite3",
+         "wanstatus.icmp", "wanstatus.dnsquery", "wanstatus.notify", "wanstatus.metrics",
+         "wanstatus.events", "wanstatus.cfgwatch", "wanstatus.scheduler", "wanstatus.control",
+         "wanstatus.wanip", "wanstatus.resources")
+
+RUNNER = """
+import json, sys
+sys.argv = ['wanstatus'] + json.loads(sys.argv[1])
+import wanstatus.wanstatus as ws
+if {run_cli}:
+    try:
+        ws.cli()
+    except SystemExit:
+        pass
+sys.stderr.write('\\nMODULES ' + json.dumps(sorted(sys.modules)) + '\\n')
+"""
+
+
+def write_config(tmpdir, dns_addr, defaults=False):
+    """Write the scenario config.  If defaults then the stores and control socket are left enabled, as
+    in the default config, but placed in tmpdir.
+    """
+    lines = [
+        "LogLevel                  30",
+        f"LogFile                   {tmpdir}/log_wanstatus.txt",
+        "nRetries                  1",
+        "StatusRecheckPeriod       5m",
+        "OutageRecheckPeriod       5s",
+        "RecoveryDelay             30s",
+        "ExternalWANRecheckPeriod  1h",
+        "IACheckMethod             dns",
+        f"IADNSAddrs                {dns_addr}",
+        "IADNSTimeout              1s",
+        f"WANIPFile                 {tmpdir}/WANIP.txt",
+        ]
+    if defaults:
+        lines += [f"DeviceSessionFile         {tmpdir}/device_sessions.json",
+                  f"LatencyStoreFile          {tmpdir}/latency.dat",
+                  f"EventStoreFile            {tmpdir}/events.db",
+                  f"WANIPBudgetFile           {tmpdir}/wanip_budgets.json",
+                  f"ControlSocket             {tmpdir}/wanstatus.sock"]
+    else:
+        lines += ["DeviceSessionFile         None",
+                  "LatencyStoreFile          None",
+                  "EventStoreFile            None",
+                  "WANIPBudgetFile           None",
+                  "ControlSocket             None"]
+    path = Path(tmpdir) / ("importtime_defaults.cfg"  if defaults  else "importtime.cfg")
+    path.write_text("\n".join(lines) + "\n")
+    Path(tmpdir, "log_wanstatus.txt").write_text("".join(f"2024-01-01 00:00:{i % 60:02} wanstatus.main    INFO:  line {i}\n" for i in range(100000)))
+    return path
+
+
+def run(argv, run_cli, env):
+    """Run a scenario once.  Returns the wall time (s) and the list of loaded modules.
+    """
+    if argv is None:
+        command = [sys.executable, "-c", "pass"]
+    else:
+        command = [sys.executable, "-c", RUNNER.format(run_cli=run_cli), json.dumps(argv)]
+    start = time.perf_counter()
+    result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, env=env)
+    wall = time.perf_counter() - start
+    modules = []
+    for line in result.stderr.splitlines():
+        if line.startswith("MODULES "):
+            modules = json.loads(line[len("MODULES "):])
+    if argv is not None  and  not modules:
+        raise RuntimeError(f"Scenario {argv} failed:\n{result.stderr}")
+    return wall, modules
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10, help="Runs per scenario (default 10)")
+    parser.add_argument('--max-ms', type=float, default=None, help="Fail if the import scenario median exceeds this")
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(SRC_DIR), os.environ.get("PYTHONPATH")])))
+    dns = fake_dns()
+    results = []
+    failed = False
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            config = str(write_config(tmpdir, dns.addr))
+            defaults_config = str(write_config(tmpdir, dns.addr, defaults=True))
+            scenarios = {"python":      (None, False, ()),              # argv, run cli(), needed HEAVY modules
+                         "import":      ([], False, ()),
+                         "version":     (["-V"], True, ()),
+                         "print-log":   (["-c", config, "--print-log"], True, ()),
+                         "interactive": (["-c", config], True, ()),
+                         "defaults":    (["-c", defaults_config], True, ("wanstatus.control",))}
+            for name, (argv, run_cli, needed) in scenarios.items():
+                walls = []
+                modules = []
+                for _ in range(args.runs):
+                    wall, modules = run(argv, run_cli, env)
+                    walls.append(wall)
+                unneeded = [module for module in HEAVY if module in modules  and  module not in needed]
+                results.append({"name": name, "runs": args.runs, "median_ms": statistics.median(walls) * 1000,
+                                "min_ms": min(walls) * 1000, "modules": len(modules), "unneeded": unneeded})
+                failed |= bool(unneeded)
+                if name == "import"  and  args.max_ms  and  statistics.median(walls) * 1000 > args.max_ms:
+                    failed = True
+    finally:
+        dns.close()
+
+    if args.json:
+        print (json.dumps(results, indent=2))
+    else:
+        print (f"{'':14}{'runs':>6}{'median_ms':>11}{'min_ms':>9}{'modules':>9}  unneeded modules loaded")
+        for result in results:
+            print (f"{result['name']:14}{result['runs']:>6}{result['median_ms']:>11.1f}{result['min_ms']:>9.1f}"
+                   f"{result['modules']:>9}  {' '.join(result['unneeded']) or '-'}")
+    return 1  if failed  else 0
+
+
+if __name__ == '__main__':
+    sys.exit(cli())
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""wanstatus service mode soak test, with fd, socket, thread and memory accounting.
+
+Runs service() against local fakes (see fakes.py) at accelerated check periods, for --cycles internet
+access checks.  Faults are injected in rotation every --fault-every cycles, each lasting --fault-cycles
+cycles, so that the error, retry, outage, login and reload paths run throughout:
+    outage      Fake DNS server refusing connections (outage and recovery)
+    errors      Devices answering half of the requests with HTTP 500
+    stalls      Devices never answering a fifth of the requests (timeouts and hedged requests)
+    sessions    Device login sessions expiring on every request (relogin, csrf token updates)
+    reload      Device timeouts changed and the config reloaded via the control socket (devices
+                recreated)
+The control socket status and resources commands and the metrics exporter are exercised at each sample.
+
+Every --sample-every cycles the process resource usage is sampled via the control socket resources
+command.  After the --warmup cycles, any resource that keeps growing per cycle is flagged (see
+wanstatus.resources.growth_tracker), and the top traced allocation growth by source line is listed.
+Exits with status 1 if any resource is flagged.
+
+Usage (from the repo root, with wanstatus installed or importable from src/):
+    python benchmarks/soak.py
+    python benchmarks/soak.py --cycles 1000000 --sample-every 10000 --warmup 50000 --tracemalloc 0
+"""
+
+import argparse
+import json
+import re
+import socket
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.request
+from pathlib import Path
+
+from bench import ws, write_config, load_wanstatus, wait_for
+from fakes import fake_site
+
+from wanstatus.control import control_request
+from wanstatus.resources import growth_tracker, allocation_growth
+
+
+FAULTS = ("outage", "errors", "stalls", "sessions", "reload")
+
+
+def set_param(config_path, name, value):
+    """Replace the value of config param name in the config file, or add it before the first section.
+    """
+    text = config_path.read_text()
+    text, count = re.subn(rf"^{name}\s.*$", f"{name:25} {value}", text, flags=re.MULTILINE)
+    if not count:
+        section = re.search(r"^\[", text, flags=re.MULTILINE)
+        at = section.start()  if section  else len(text)
+        text = text[:at] + f"{name:25} {value}\n" + text[at:]
+    config_path.write_text(text)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class fault_injector:
+    """ Start and end the FAULTS in rotation.
+    """
+    def __init__(self, fakes, config_path, args):
+        self.fakes = fakes
+        self.config_path = config_path
+        self.args = args
+        self.next = 0
+        self.active = None
+        self.counts = dict.fromkeys(FAULTS, 0)
+
+    def start(self):
+        fault = self.active = FAULTS[self.next % len(FAULTS)]
+        self.next += 1
+        self.counts[fault] += 1
+        if fault == "outage":
+            self.fakes.set("dns", mode='down')
+        elif fault == "errors":
+            self._set_devices(failure_rate=0.5)
+        elif fault == "stalls":
+            self._set_devices(stall_rate=0.2)
+        elif fault == "sessions":
+            self._set_devices(session_ttl=0)
+        elif fault == "reload":
+            self._reload(self.args.reload_timeout)
+
+    def end(self):
+        fault, self.active = self.active, None
+        if fault == "outage":
+            self.fakes.set("dns", mode='up')
+        elif fault == "errors":
+            self._set_devices(failure_rate=0.0)
+        elif fault == "stalls":
+            self._set_devices(stall_rate=0.0)
+        elif fault == "sessions":
+            self._set_devices(session_ttl=None)
+        elif fault == "reload":
+            self._reload(self.args.device_timeout)
+
+    def _set_devices(self, **knobs):
+        self.fakes.set("modem", **knobs)
+        self.fakes.set("router", **knobs)
+
+    def _reload(self, timeout):
+        set_param(self.config_path, "ModemTimeout", timeout)
+        set_param(self.config_path, "RouterTimeout", timeout)
+        response = control_request(self.args.control_socket, "reload", timeout=30)
+        if not response["ok"]:
+            raise RuntimeError(f"Reload failed:  {response['error']}")
+
+
+def soak(fakes, config_path, args):
+    """Run service() on a thread for args.cycles internet access checks, injecting faults and sampling
+    the resource usage.  Returns the growth_tracker, the fault counts and the allocation growth list.
+    """
+    tracker = growth_tracker(args.warmup)
+    injector = fault_injector(fakes, config_path, args)
+    metrics_url = f"http://127.0.0.1:{args.metrics_port}/metrics"
+    thread = threading.Thread(target=ws.service, name="service", daemon=True)
+    thread.start()
+    if not wait_for(lambda: ws.monitors  and  ws.control_socket  and  ws.exporter, 30):
+        raise RuntimeError("Service didn't start")
+    monitor = ws.monitors['']
+
+    snapshots = []
+    next_sample = 0
+    next_fault = args.fault_every
+    fault_end = None
+    start_time = time.perf_counter()
+    try:
+        while monitor.checks < args.cycles:
+            if args.duration  and  time.perf_counter() - start_time > args.duration:
+                break
+            time.sleep(0.005)
+            cycles = monitor.checks
+            if fault_end is not None  and  cycles >= fault_end:
+                injector.end()
+                fault_end = None
+            if fault_end is None  and  args.fault_every  and  cycles >= next_fault:
+                injector.start()
+                fault_end = cycles + args.fault_cycles
+                next_fault = cycles + args.fault_every
+            if cycles >= next_sample  and  fault_end is None:
+                with urllib.request.urlopen(metrics_url, timeout=5) as response:
+                    response.read()
+                control_request(args.control_socket, "status")
+                usage = control_request(args.control_socket, "resources")
+                tracker.add(usage["checks"], usage)
+                if args.tracemalloc  and  (usage["checks"] >= args.warmup  and  not snapshots):
+                    snapshots.append(tracemalloc.take_snapshot())
+                if not args.json:
+                    print (f"{usage['checks']:>10} cycles  {time.perf_counter() - start_time:8.1f} s  fds {usage['fds']:>4}  "
+                           f"sockets {usage['sockets']:>4}  threads {usage['threads']:>3}  rss {usage['rss_bytes'] / 2**20:7.1f} MB"
+                           + (f"  traced {usage['traced_bytes'] / 2**20:7.2f} MB"  if usage["traced_bytes"] is not None  else ""),
+                           flush=True)
+                next_sample = cycles - cycles % args.sample_every + args.sample_every
+        if fault_end is not None:
+            injector.end()
+        time.sleep(args.settle)
+        usage = control_request(args.control_socket, "resources")
+        tracker.add(usage["checks"], usage)
+        if snapshots:
+            snapshots.append(tracemalloc.take_snapshot())
+    finally:
+        ws.sched.stop()
+        thread.join(5)
+        ws.sched.wait_idle(5)
+        for _monitor in ws.monitors.values():
+            _monitor.close()
+        ws.monitors.clear()
+        ws.watcher.close()
+        for item in (ws.events, ws.control_socket, ws.exporter):
+            if item:
+                item.close()
+        ws.control_socket = ws.exporter = None
+
+    growth = allocation_growth(*snapshots)  if len(snapshots) == 2  else []
+    return tracker, injector.counts, growth, time.perf_counter() - start_time
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cycles', type=int, default=30000, help="Internet access check cycles to run (default 30000)")
+    parser.add_argument('--duration', type=float, default=None, help="Stop after this many seconds, if sooner")
+    parser.add_argument('--warmup', type=int, default=5000, help="Cycles excluded from the growth check (default 5000)")
+    parser.add_argument('--sample-every', type=int, default=1000, help="Cycles between resource samples (default 1000)")
+    parser.add_argument('--fault-every', type=int, default=200, help="Cycles between fault starts, 0 for none (default 200)")
+    parser.add_argument('--fault-cycles', type=int, default=40, help="Cycles each fault lasts (default 40)")
+    parser.add_argument('--tracemalloc', type=int, default=1, help="tracemalloc traceback frames, 0 to disable (default 1)")
+    parser.add_argument('--modem', default='cox', choices=['ddwrt', 'pfsense', 'cox'], help="Modem profile (default cox)")
+    parser.add_argument('--router', default='pfsense', choices=['ddwrt', 'pfsense', 'cox'], help="Router profile (default pfsense)")
+    parser.add_argument('--period', default='0.01s', help="StatusRecheckPeriod (default 0.01s)")
+    parser.add_argument('--outage-period', default='0.01s', help="OutageRecheckPeriod (default 0.01s)")
+    parser.add_argument('--recovery-delay', default='0.05s', help="RecoveryDelay (default 0.05s)")
+    parser.add_argument('--external-period', default='0.1s', help="ExternalWANRecheckPeriod (default 0.1s)")
+    parser.add_argument('--ia-method', default='dns', choices=['dns', 'dnsquery'], help="IACheckMethod (default dns)")
+    parser.add_argument('--probe-timeout', default='0.2s', help="IADNSTimeout (default 0.2s)")
+    parser.add_argument('--device-timeout', default='3s', help="Modem and Router Timeout (default 3s)")
+    parser.add_argument('--reload-timeout', default='4s', help="Modem and Router Timeout during the reload fault (default 4s)")
+    parser.add_argument('--settle', type=float, default=1.0, help="Wait before the final sample, seconds (default 1)")
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+    args.channels, args.providers = 0, 2
+
+    if args.tracemalloc:
+        tracemalloc.start(args.tracemalloc)
+    fakes = fake_site({"dns":       ("dns", {}),
+                       "modem":     (args.modem, {}),
+                       "router":    (args.router, {}),
+                       "external":  ("external", {}),
+                       "external2": ("external", {})})
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            config_path = write_config(tmpdir, fakes.addrs, args)
+            args.control_socket = Path(tmpdir) / "wanstatus.sock"
+            args.metrics_port = free_port()
+            for name, value in (("ExternalWANRecheckPeriod", args.external_period), ("MetricsPort", args.metrics_port),
+                                ("OutageMaxRecheckPeriod", args.outage_period), ("CycleDeadline", "30s"), ("LatencyStoreFile", f"{tmpdir}/latency.dat"),
+                                ("LatencyMaxSize", 1048576), ("DeviceSessionFile", f"{tmpdir}/device_sessions.json"),
+                                ("NotifQueueFile", "None")):
+                set_param(config_path, name, value)
+            load_wanstatus(config_path)
+            tracker, faults, growth, wall = soak(fakes, config_path, args)
+    finally:
+        fakes.close()
+
+    report = tracker.report()
+    flagged = [result["name"] for result in report if result["flagged"]]
+    cycles = tracker.samples[-1][0]  if tracker.samples  else 0
+    if args.json:
+        print (json.dumps({"cycles": cycles, "wall_s": wall, "faults": faults, "resources": report,
+                           "allocation_growth": growth, "flagged": flagged}, indent=2))
+    else:
+        print (f"\n{cycles} cycles in {wall:.1f} s.  Faults injected:  " + ", ".join(f"{name} {count}" for name, count in faults.items()))
+        if not report:
+            print ("Too few samples after the warmup for a growth check.  Use more --cycles or a smaller --sample-every.")
+        else:
+            print (f"{'':14}{'first':>14}{'last':>14}{'growth':>14}{'per_cycle':>12}")
+            for result in report:
+                print (f"{result['name']:14}{result['first']:>14}{result['last']:>14}{result['growth']:>14.0f}"
+                       f"{result['per_cycle']:>12.3f}{'  GROWING'  if result['flagged']  else ''}")
+        if growth:
+            print ("\nTop traced allocation growth since the warmup:")
+            for size, count, where in growth:
+                print (f"{size:>12} B {count:>8} blocks  {where}")
+        print ("\nFLAGGED:  " + ", ".join(flagged)  if flagged  else "\nNo per-cycle resource growth")
+    return 1  if flagged  else 0
+
+
+if __name__ == '__main__':
+    sys.exit(cli())
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""Watch the config file and its imported files for changes.
+
+On Linux, inotify watches are placed on the directories holding the files (so that editors that
+save by rename-replace are seen), and a background thread calls back on each change.  Elsewhere, or
+if inotify is unavailable, changed() compares file stats (mtime, size, inode) when polled.
+"""
+
+import os
+import re
+import select
+import struct
+import threading
+import time
+import ctypes
+import ctypes.util
+from pathlib import Path
+
+from cjnfuncs.core import logging
+
+
+IN_MODIFY       = 0x00000002
+IN_ATTRIB       = 0x00000004
+IN_CLOSE_WRITE  = 0x00000008
+IN_MOVED_FROM   = 0x00000040
+IN_MOVED_TO     = 0x00000080
+IN_CREATE       = 0x00000100
+IN_DELETE       = 0x00000200
+IN_NONBLOCK     = 0o4000
+IN_CLOEXEC      = 0o2000000
+WATCH_MASK      = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER    = struct.Struct("iIII")         # wd, mask, cookie, len
+SETTLE_TIME     = 0.2                           # Wait for an editor's burst of events to finish
+
+
+IMPORT_RE = re.compile(r"^\s*import[\s=:]+(.+)", re.IGNORECASE)
+
+def config_files(config_path):
+    """Return a list of the config file Path and all of its (nested) import file Paths.
+    Import paths are relative to the importing file's directory, per cjnfuncs.configman.
+    """
+    files = []
+    pending = [Path(os.path.abspath(config_path))]
+    while pending:
+        path = pending.pop(0)
+        if path in files:
+            continue
+        files.append(path)
+        try:
+            text = path.read_text()
+        except OSError:
+            continue
+        for line in text.split('\n'):
+            out = IMPORT_RE.match(line.split('#')[0])
+            if out  and  out.group(1).strip():
+                target = Path(os.path.expandvars(os.path.expanduser(out.group(1).strip().strip("'\""))))
+                pending.append(target  if target.is_absolute()  else Path(os.path.abspath(path.parent / target)))
+    return files
+
+
+def _stat_sig(path):
+    try:
+        st = path.stat()
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+    except OSError:
+        return None
+
+
+class config_watcher:
+    """ Track changes to config_path and its imported files.
+
+    mode is 'inotify' (falls back to polling if not available) or 'poll'.
+    If inotify is active then callback is called (from the watcher thread) on each change.
+
+    changed() returns True if any file differs from when mark_loaded() was last called.
+    mark_loaded() also re-reads the import list, and moves the inotify watches to match.
+    """
+
+    def __init__(self, config_path, mode='inotify', callback=None):
+        self.config_path = Path(config_path)
+        self.mode = mode
+        self.callback = callback
+        self.inotify = None
+        self.files = []
+        self.loaded_sigs = {}
+        self.lock = threading.Lock()
+
+        if mode == 'inotify':
+            try:
+                self._init_inotify()
+            except Exception as e:
+                logging.info (f"inotify config watching not available, using stat polling:  {e}")
+                self.inotify = None
+        self.mark_loaded()
+
+        if self.inotify is not None:
+            threading.Thread(target=self._watch, name="cfgwatch", daemon=True).start()
+
+    def _init_inotify(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        self.libc = libc
+        self.inotify = fd
+        self.wds = {}                           # watch descriptor: directory
+
+    def _update_watches(self):
+        """Watch the directories of the current file list.  Called with the lock held.
+        """
+        if self.inotify is None:
+            return
+        dirs = {path.parent for path in self.files}
+        for wd, _dir in list(self.wds.items()):
+            if _dir not in dirs:
+                self.libc.inotify_rm_watch(self.inotify, wd)
+                del self.wds[wd]
+        for _dir in dirs - set(self.wds.values()):
+            wd = self.libc.inotify_add_watch(self.inotify, os.fsencode(_dir), WATCH_MASK)
+            if wd < 0:
+                logging.warning (f"Can't watch <{_dir}> for config changes:  {os.strerror(ctypes.get_errno())}")
+            else:
+                self.wds[wd] = _dir
+
+    def mark_loaded(self):
+        """Record the current state of the config file and its imports as loaded.
+        Call after each successful config (re)load.
+        """
+        with self.lock:
+            self.files = config_files(self.config_path)
+            self.loaded_sigs = {path: _stat_sig(path) for path in self.files}
+            self._update_watches()
+
+    def changed(self):
+        """Return True if the config file or any of its imports changed since mark_loaded().
+        """
+        with self.lock:
+            return any(_stat_sig(path) != sig for path, sig in self.loaded_sigs.items())
+
+    def _watch(self):
+        fd = self.inotify
+        while True:
+            try:
+                select.select([fd], [], [])
+                if self.inotify != fd:
+                    return                      # Closed, and fd possibly reused by another watcher
+                time.sleep(SETTLE_TIME)
+                data = os.read(fd, 65536)
+            except (OSError, ValueError):
+                return                          # Closed
+            names = set()
+            while data:
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(data)
+                name = data[EVENT_HEADER.size:EVENT_HEADER.size + length].rstrip(b"\0")
+                if wd in self.wds:
+                    names.add(self.wds[wd] / os.fsdecode(name))
+                data = data[EVENT_HEADER.size + length:]
+            with self.lock:
+                relevant = bool(names & set(self.files))
+            if relevant  and  self.callback  and  self.changed():
+                self.callback()
+
+    def close(self):
+        if self.inotify is not None:
+            fd, self.inotify = self.inotify, None
+            os.close(fd)
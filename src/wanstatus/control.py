@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""Unix domain control socket for wanstatus service mode.
+
+The service answers requests from the results it already has, so a client (eg an interactive
+wanstatus run) gets the current status in milliseconds without probing the network or logging into
+the devices again.
+
+Protocol:  one request per connection.  The client sends a JSON object with a "command" key plus any
+command params, on one line.  The server replies with a JSON object on one line, with "ok" true or
+false, and "error" set when false.
+"""
+
+import json
+import os
+import socket
+import socketserver
+import stat
+import threading
+from pathlib import Path
+
+from cjnfuncs.core import logging
+
+
+MAX_REQUEST     = 65536                         # Max request line length
+REQUEST_TIMEOUT = 5                             # Max wait for a client to send its request
+SOCKET_MODE     = 0o660
+
+
+def _remove_stale(path):
+    """Remove the socket file at path if it is left over from a prior service run.
+    Raises OSError if another server is listening on it, or if path is not a socket.
+    """
+    try:
+        mode = path.lstat().st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise OSError(f"<{path}> exists and is not a socket")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(str(path))
+        except (ConnectionRefusedError, FileNotFoundError):
+            path.unlink(missing_ok=True)
+            return
+    raise OSError(f"Another process is serving <{path}>")
+
+
+class control_server:
+    """ Serve control requests on the Unix domain socket at path from a background thread.
+
+    handler is called with each request dict (from a per-connection thread) and returns the
+    response dict.  If handler raises an exception the response is ok false with the error.
+    """
+
+    def __init__(self, path, handler):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        _remove_stale(self.path)
+
+        class request_handler(socketserver.StreamRequestHandler):
+            timeout = REQUEST_TIMEOUT
+
+            def handle(self):
+                try:
+                    line = self.rfile.readline(MAX_REQUEST)
+                    if not line:
+                        return
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("Request is not a JSON object")
+                    response = handler(request)
+                except Exception as e:
+                    response = {"ok": False, "error": f"{type(e).__name__}:  {e}"}
+                try:
+                    self.wfile.write(json.dumps(response).encode() + b"\n")
+                except OSError:
+                    pass                                            # Client gave up
+
+        self.server = socketserver.ThreadingUnixStreamServer(str(self.path), request_handler)
+        self.server.daemon_threads = True
+        self.inode = self.path.stat().st_ino
+        os.chmod(self.path, SOCKET_MODE)
+        threading.Thread(target=self.server.serve_forever, name="control", daemon=True).start()
+        logging.info (f"Control socket listening at <{self.path}>")
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+        try:
+            if self.path.stat().st_ino == self.inode:               # Not replaced by another service
+                self.path.unlink()
+        except OSError:
+            pass
+
+
+def control_request(path, command, timeout=5, **params):
+    """Send command (with any params) to the control socket at path, and return the response dict.
+    Raises FileNotFoundError or ConnectionRefusedError if no service is listening, other OSErrors
+    (including socket.timeout) on communication failures, or ValueError on an invalid response.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(str(path))
+        sock.sendall(json.dumps({"command": command, **params}).encode() + b"\n")
+        data = b""
+        while not data.endswith(b"\n"):
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    response = json.loads(data)
+    if not isinstance(response, dict):
+        raise ValueError("Response is not a JSON object")
+    return response
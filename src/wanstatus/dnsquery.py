@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""In-process DNS query engine for wanstatus.
+
+A minimal DNS query (A record, recursion desired) is sent to any number of servers from a single,
+reused UDP socket shared by all threads, and a receiver thread hands each response to the waiting
+call by server address and transaction id.  A response counts only if it is a valid answer to the
+question asked - NOERROR with at least one A record - so a success shows that the resolver path works
+end to end, not just that port 53 is reachable.
+A truncated UDP response is retried over TCP.
+"""
+
+import queue
+import secrets
+import socket
+import struct
+import time
+
+from .icmp import resolve, reply_dispatcher
+
+
+HEADER          = struct.Struct("!HHHHHH")      # id, flags, qdcount, ancount, nscount, arcount
+QTYPE_A         = 1
+QCLASS_IN       = 1
+FLAG_QR         = 0x8000
+FLAG_TC         = 0x0200
+FLAG_RD         = 0x0100
+RCODES          = {0: "NOERROR", 1: "FORMERR", 2: "SERVFAIL", 3: "NXDOMAIN", 4: "NOTIMP", 5: "REFUSED"}
+MAX_UDP_SIZE    = 4096
+
+
+def server_address(addr):
+    """Return the (ip, port) for addr, an IP address or hostname, optionally with :port (default 53).
+    """
+    host, _, port = addr.partition(":")
+    return resolve(host), int(port or 53)
+
+
+def encode_name(name):
+    labels = [label.encode('idna') for label in name.rstrip('.').split('.') if label]
+    return b"".join(bytes([len(label)]) + label for label in labels) + b"\0"
+
+
+def build_query(txid, name):
+    """Return a DNS query message for the A record of name.
+    """
+    return HEADER.pack(txid, FLAG_RD, 1, 0, 0, 0) + encode_name(name) + struct.pack("!HH", QTYPE_A, QCLASS_IN)
+
+
+def _skip_name(data, offset):
+    """Return the offset just past the (possibly compressed) name at offset.
+    """
+    while True:
+        length = data[offset]
+        if length & 0xc0 == 0xc0:               # Compression pointer ends the name
+            return offset + 2
+        offset += 1 + length
+        if length == 0:
+            return offset
+
+
+def parse_response(data, txid, question):
+    """Check that data is a valid response to the query with txid and question (the encoded question
+    section).  Returns (ok, detail, truncated).  detail is the first A record address, or the
+    failure reason.
+    """
+    if len(data) < HEADER.size:
+        return False, "Short response", False
+    rxid, flags, qdcount, ancount, _, _ = HEADER.unpack_from(data)
+    if rxid != txid  or  not flags & FLAG_QR:
+        return False, "Not a response to the query", False
+    if flags & FLAG_TC:
+        return False, "Truncated", True
+    rcode = flags & 0x000f
+    if rcode:
+        return False, RCODES.get(rcode, f"RCODE {rcode}"), False
+    offset = HEADER.size
+    if qdcount != 1  or  data[offset:offset + len(question)].lower() != question.lower():
+        return False, "Question mismatch", False
+    offset += len(question)
+    try:
+        for _ in range(ancount):
+            offset = _skip_name(data, offset)
+            rtype, rclass, _, rdlength = struct.unpack_from("!HHIH", data, offset)
+            offset += 10
+            if rtype == QTYPE_A  and  rclass == QCLASS_IN  and  rdlength == 4:
+                return True, socket.inet_ntoa(data[offset:offset + 4]), False
+            offset += rdlength
+    except (IndexError, struct.error):
+        return False, "Malformed answer", False
+    return False, "No A record in the answer", False
+
+
+class dns_prober(reply_dispatcher):
+    """ Send DNS queries and collect the responses, all from one UDP socket.
+
+    A single instance may be shared by multiple threads, and calls to query() run concurrently.
+    Responses are matched to calls by server address and transaction id.
+    """
+
+    BUFSIZE = MAX_UDP_SIZE
+
+    def __init__(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        super().__init__(sock, "dns_receiver")
+
+    def query(self, addrs, name, timeout, first_only=True):
+        """Query each of the DNS server addrs for the A record of name, and wait up to timeout seconds
+        for valid answers.
+
+        Returns a list of (addr, rtt_ms, answer) tuples for the valid answers in arrival order, and a
+        dict of addr: failure reason for the servers that answered with an error.  If first_only,
+        returns as soon as the first valid answer arrives.
+        rtt_ms is measured from the start of the call (after the server hostname lookups), so any wait
+        for the shared socket counts.
+        Addrs that cannot be resolved or sent to are skipped.  If none of the addrs can be sent to
+        then the last OSError (including socket.gaierror) is raised.
+        """
+        question = encode_name(name) + struct.pack("!HH", QTYPE_A, QCLASS_IN)
+        servers = []
+        send_error = None
+        for addr in addrs:
+            try:
+                servers.append((addr, server_address(addr)))
+            except OSError as e:
+                send_error = e
+        start_time = time.perf_counter()
+        replies = queue.SimpleQueue()
+        outstanding = {}                        # (server, txid): (addr, query)
+        with self.lock:
+            for addr, server in servers:
+                txid = secrets.randbits(16)
+                while (server, txid) in self.waiters:
+                    txid = secrets.randbits(16)
+                key = (server, txid)
+                query = build_query(txid, name)
+                self.waiters[key] = replies
+                try:
+                    self.sock.sendto(query, server)
+                    outstanding[key] = (addr, query)
+                except OSError as e:
+                    del self.waiters[key]
+                    send_error = e
+        if not outstanding  and  send_error:
+            raise send_error
+
+        answers = []
+        errors = {}
+        pending = set(outstanding)
+        end_time = time.perf_counter() + timeout
+        try:
+            while pending:
+                reply = self._next_reply(replies, pending, end_time)
+                if reply is None:
+                    break
+                key, data, recv_time = reply
+                (server, txid), (addr, query) = key, outstanding[key]
+                ok, detail, truncated = parse_response(data, txid, question)
+                if truncated:
+                    try:
+                        data = self._tcp_query(server, query, max(0.01, end_time - time.perf_counter()))
+                        recv_time = time.perf_counter()
+                        ok, detail, _ = parse_response(data, txid, question)
+                    except OSError as e:
+                        ok, detail = False, f"TCP retry failed:  {e}"
+                pending.discard(key)
+                if not ok:
+                    errors[addr] = detail
+                    continue
+                answers.append((addr, (recv_time - start_time) * 1000, detail))
+                if first_only:
+                    break
+        finally:
+            self._unregister(outstanding)
+        return answers, errors
+
+    def _reply_key(self, data, from_addr):
+        if len(data) < HEADER.size:
+            return None
+        rxid, flags = struct.unpack_from("!HH", data)
+        if not flags & FLAG_QR:
+            return None                         # Stray packet.  Keep waiting.
+        return (from_addr, rxid)
+
+    def _tcp_query(self, server, query, timeout):
+        """Send query to server over TCP and return the response message.
+        """
+        with socket.create_connection(server, timeout=timeout) as sock:
+            sock.sendall(struct.pack("!H", len(query)) + query)
+            length = struct.unpack("!H", _recv_exactly(sock, 2))[0]
+            return _recv_exactly(sock, length)
+
+
+def _recv_exactly(sock, nbytes):
+    data = b""
+    while len(data) < nbytes:
+        chunk = sock.recv(nbytes - len(data))
+        if not chunk:
+            raise ConnectionError("Connection closed by the server")
+        data += chunk
+    return data
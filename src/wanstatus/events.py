@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""Event history store for outages, WAN IP changes and modem state changes.
+
+Events are kept in an SQLite database (WAL mode), one row per event, indexed by time and by event
+type, so that reports over years of history read only the rows they need.  record() only queues the
+event.  A writer thread commits the queued events in batches, so the checks never wait on the disk.
+
+Event types and their columns:
+    outage      start, end, duration (seconds), flaps
+    wanip       old, new, source ('router' or 'external')
+    modem       old, new (modem state)
+    service     new ('start' or 'stop') - service mode monitoring of the site started or stopped
+Each event also has a time (time.time() value) and the fleet mode site ('' when not in fleet mode).
+"""
+
+import datetime
+import queue
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from cjnfuncs.core import logging
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id          INTEGER PRIMARY KEY,
+    time        REAL NOT NULL,
+    type        TEXT NOT NULL,
+    site        TEXT NOT NULL DEFAULT '',
+    start       REAL,
+    end         REAL,
+    duration    REAL,
+    flaps       INTEGER,
+    old         TEXT,
+    new         TEXT,
+    source      TEXT
+);
+CREATE INDEX IF NOT EXISTS events_time ON events (time);
+CREATE INDEX IF NOT EXISTS events_type_time ON events (type, time);
+CREATE INDEX IF NOT EXISTS events_type_duration ON events (type, duration);
+"""
+COLUMNS         = ("time", "type", "site", "start", "end", "duration", "flaps", "old", "new", "source")
+FLUSH_PERIOD    = 2.0                           # Max seconds an event waits to be written
+BATCH_MAX       = 500                           # Max events per commit
+
+
+def connect(path):
+    """Open the database at path, creating it if needed.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    db = sqlite3.connect(str(path), timeout=10, check_same_thread=False)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.executescript(SCHEMA)
+    return db
+
+
+class event_store:
+    """ Queue events and write them in batches to the database at path from a writer thread.
+    The database is opened, and the writer started, on the first record().
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.queue = queue.SimpleQueue()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def record(self, type, when, site='', **columns):
+        """Queue an event at when (a time.time() value).  columns are per the event type (see the module docs).
+        """
+        self.queue.put({"time": when, "type": type, "site": site, **columns})
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._writer, name="events", daemon=True)
+                self.thread.start()
+
+    def _writer(self):
+        try:
+            db = connect(self.path)
+        except Exception as e:
+            logging.warning (f"Failed opening event store <{self.path}>:  {e}")
+            return
+        stop = False
+        while not stop:
+            batch = [self.queue.get()]                              # Wait for an event, then collect more for up to FLUSH_PERIOD
+            deadline = time.monotonic() + FLUSH_PERIOD
+            while batch[-1] is not None  and  len(batch) < BATCH_MAX:
+                try:
+                    batch.append(self.queue.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            if batch[-1] is None:                                   # close() called
+                stop = True
+                batch.pop()
+            if batch:
+                self._write(db, batch)
+        db.close()
+
+    def _write(self, db, batch):
+        try:
+            with db:
+                db.executemany(f"INSERT INTO events ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                               [tuple(event.get(column) for column in COLUMNS) for event in batch])
+        except Exception as e:
+            logging.warning (f"Failed writing {len(batch)} event(s) to event store <{self.path}>:  {e}")
+
+    def close(self, timeout=5):
+        """Write any queued events and stop the writer.
+        """
+        with self.lock:
+            if self.thread:
+                self.queue.put(None)
+                self.thread.join(timeout)
+                self.thread = None
+
+
+def report(path, longest=10):
+    """Return the event history report for the database at path, as a list of lines.
+    """
+    if not Path(path).exists():
+        return [f"No event store at <{path}>"]
+    db = connect(Path(path))
+    try:
+        return _report(db, longest)
+    finally:
+        db.close()
+
+
+def _month_seconds(month, first_time, now):
+    """Return the seconds of month ('YYYY-MM') that were monitored - after first_time and before now.
+    """
+    start = datetime.datetime.strptime(month, "%Y-%m")
+    end = (start + datetime.timedelta(days=32)).replace(day=1)
+    return max(0, min(end.timestamp(), now) - max(start.timestamp(), first_time))
+
+
+def _report(db, longest):
+    lines = []
+    now = time.time()
+    first_time = db.execute("SELECT min(time) FROM events").fetchone()[0]
+    if first_time is None:
+        return ["No events recorded"]
+    first_time = min(first_time, db.execute("SELECT min(start) FROM events WHERE type = 'outage'").fetchone()[0] or first_time)
+    site_first = {site: min(first, first_start or first)                # Each site's first event or outage start
+                  for site, first, first_start in db.execute("SELECT site, min(time), min(start) FROM events GROUP BY site")}
+    timestamp = lambda value: datetime.datetime.fromtimestamp(value).strftime("%Y-%m-%d %H:%M:%S")
+    span = lambda seconds: str(datetime.timedelta(seconds=int(seconds)))
+
+    lines.append(f"Monthly availability (since {timestamp(first_time)}):")
+    lines.append(f"  {'Site':16} {'Month':8} {'Outages':>8} {'Flaps':>6} {'Outage time':>12} {'Available %':>12}")
+    rows = db.execute("""SELECT site, strftime('%Y-%m', start, 'unixepoch', 'localtime') AS month,
+                            count(*), sum(duration), sum(flaps)
+                         FROM events WHERE type = 'outage' GROUP BY site, month ORDER BY site, month""").fetchall()
+    outages = {(site, month): (count, duration, flaps) for site, month, count, duration, flaps in rows}
+    for site in sorted(site_first):                                   # Every site with any events, every month since
+        month = datetime.datetime.fromtimestamp(site_first[site]).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        while month.timestamp() <= now:
+            month_str = month.strftime("%Y-%m")
+            month = (month + datetime.timedelta(days=32)).replace(day=1)
+            count, duration, flaps = outages.get((site, month_str), (0, 0, 0))
+            monitored = _month_seconds(month_str, site_first[site], now)
+            available = 100 * (1 - duration / monitored)  if monitored  else 100
+            lines.append(f"  {site or '-':16} {month_str:8} {count:>8} {flaps or 0:>6} {span(duration):>12} {max(0, available):>12.3f}")
+
+    lines.append(f"\nLongest outages:")
+    lines.append(f"  {'Site':16} {'Start':19}  {'End':19}  {'Duration':>10} {'Flaps':>6}")
+    for site, start, end, duration, flaps in db.execute(
+            "SELECT site, start, end, duration, flaps FROM events WHERE type = 'outage' ORDER BY duration DESC LIMIT ?", (longest,)):
+        lines.append(f"  {site or '-':16} {timestamp(start)}  {timestamp(end)}  {span(duration):>10} {flaps or 0:>6}")
+
+    lines.append(f"\nWAN IP changes per month:")
+    lines.append(f"  {'Site':16} {'Month':8} {'Router':>8} {'External':>9}  Last change")
+    for site, month, router, external, last in db.execute(
+            """SELECT site, strftime('%Y-%m', time, 'unixepoch', 'localtime') AS month,
+                  sum(source = 'router'), sum(source = 'external'), max(time)
+               FROM events WHERE type = 'wanip' GROUP BY site, month ORDER BY site, month"""):
+        lines.append(f"  {site or '-':16} {month:8} {router:>8} {external:>9}  {timestamp(last)}")
+
+    lines.append(f"\nModem state changes per month:")
+    lines.append(f"  {'Site':16} {'Month':8} {'Changes':>8}  Last change")
+    for site, month, count, last in db.execute(
+            """SELECT site, strftime('%Y-%m', time, 'unixepoch', 'localtime') AS month, count(*), max(time)
+               FROM events WHERE type = 'modem' GROUP BY site, month ORDER BY site, month"""):
+        lines.append(f"  {site or '-':16} {month:8} {count:>8}  {timestamp(last)}")
+    return lines
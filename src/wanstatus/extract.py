@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""Streaming extraction of data from device status pages.
+
+The page is read in chunks and decoded incrementally.  The login-required marker, the csrf token RE
+and the status RE are checked over a bounded sliding window as the page arrives, and the connection is
+closed as soon as everything needed has been found.  Only the window, not the whole page, is held in
+memory.
+
+Optionally, multiple named fields (one fields RE with named groups, matched once) and repeating rows
+(a row RE with named groups, matched as many times as it occurs, eg once per modem channel) are
+extracted in the same pass.  Each row is taken as soon as it has fully arrived, so the whole table
+never needs to be in the window at once.
+
+An RE with an unbounded greedy repeat of '.' (eg, '<td.+title=...' or '"(.*)";var') may match
+differently once more of the page has arrived, since the repeat extends to the last place where the
+rest of the RE matches.  Without DOTALL the repeat can't pass a newline, so such a match is accepted
+once a newline has arrived after the match end.  With DOTALL the repeat can extend over the rest of the
+page, so such REs are matched only once the whole page has been read, over the whole page (up to
+max_size), so that they give the same result as a search of the full page.
+"""
+
+import codecs
+
+try:
+    from re import _parser as sre_parse         # Python 3.11+
+except ImportError:
+    import sre_parse
+
+
+CHUNK_SIZE = 16384
+
+
+class page_scan:
+    """ Results of page_scanner.scan().
+
+    login_required  True if the login_text was found (the status RE result is then not meaningful)
+    csrf            The csrf RE group(1) match, or None
+    status          The status RE group(1) match, or None
+    fields          Dict of the fields RE named group values, or {} if not matched
+    rows            List of row RE matches, each a tuple of the named group values in group order
+    size            Number of bytes read
+    Field and row values that are numbers are converted to int or float.
+    """
+    def __init__(self):
+        self.login_required = False
+        self.csrf = None
+        self.status = None
+        self.fields = {}
+        self.rows = []
+        self.size = 0
+
+
+def _value(text):
+    """Return text as an int or float if it is a number, else stripped, or None for an unmatched group.
+    """
+    if text is None:
+        return None
+    text = text.strip()
+    for _type in (int, float):
+        try:
+            return _type(text)
+        except ValueError:
+            pass
+    return text
+
+
+def _greedy_dots(RE):
+    """Return the set of DOTALL states (True/False) of the unbounded greedy '.' repeats (eg, .* or .+)
+    in compiled RE, taking account of inline and scoped (?s) flags.
+    """
+    found = set()
+    def walk(items, dotall):
+        for op, av in items:
+            if op is sre_parse.MAX_REPEAT:
+                _, _max, item = av
+                if _max == sre_parse.MAXREPEAT  and  len(item) == 1  and  item[0][0] is sre_parse.ANY:
+                    found.add(dotall)
+            if op is sre_parse.SUBPATTERN:
+                _, add_flags, del_flags, sub = av
+                walk(sub, (dotall  or  bool(add_flags & sre_parse.SRE_FLAG_DOTALL))  and  not del_flags & sre_parse.SRE_FLAG_DOTALL)
+                continue
+            for value in (av  if isinstance(av, (list, tuple))  else (av,)):
+                if isinstance(value, sre_parse.SubPattern):
+                    walk(value, dotall)
+                elif isinstance(value, (list, tuple)):
+                    for sub in value:
+                        if isinstance(sub, sre_parse.SubPattern):
+                            walk(sub, dotall)
+    parsed = sre_parse.parse(RE.pattern, RE.flags)
+    walk(parsed, bool(parsed.state.flags & sre_parse.SRE_FLAG_DOTALL))
+    return found
+
+
+def full_page_RE(RE):
+    """Return True if compiled RE has an unbounded greedy repeat of '.' with DOTALL (eg, (?s).*), which
+    can extend over the rest of the page, so that a match within part of the page may differ from a
+    match over the whole page.
+    """
+    return True in _greedy_dots(RE)
+
+
+def line_RE(RE):
+    """Return True if compiled RE has an unbounded greedy repeat of '.' without DOTALL (eg, .* or .+),
+    which can extend to the end of its line, so that a match is only settled once its line has fully
+    arrived.
+    """
+    return False in _greedy_dots(RE)
+
+
+def group_names(RE):
+    """Return the named groups of compiled RE, in group order.
+    """
+    return tuple(sorted(RE.groupindex, key=RE.groupindex.get))
+
+
+class page_scanner:
+    """ Scan streamed responses for the login marker text, a csrf token and the status data.
+
+    status_RE and csrf_RE are compiled REs, each with one capture group, or None if not needed.
+    fields_RE and row_RE are compiled REs with named groups, or None if not needed.  The fields_RE is
+    matched once.  The row_RE is matched repeatedly, and the whole page is read to find all the rows.
+    login_text is the login-required marker string, or None.
+    A match is only accepted once it ends before the end of the data received so far (or at the end
+    of the page), so that a greedy RE can't match a partial value at a chunk boundary.
+    REs with an unbounded greedy '.' repeat without DOTALL (see line_RE()) are accepted once a newline
+    has arrived after the match end.  REs with a DOTALL one (see full_page_RE()) are only matched at
+    the end of the page, and then over the whole page, which is kept in memory for them.
+    window is the number of characters kept for matching.  An RE match must fit within the window.
+    max_size is the maximum number of page bytes read.  Larger pages raise ValueError.
+    """
+
+    def __init__(self, status_RE=None, csrf_RE=None, login_text=None, window=65536, max_size=4194304, fields_RE=None, row_RE=None):
+        self.status_RE = status_RE
+        self.csrf_RE = csrf_RE
+        self.fields_RE = fields_RE
+        self.row_RE = row_RE
+        self.columns = group_names(row_RE)  if row_RE  else ()
+        self.login_text = login_text
+        self.window = max(window, len(login_text or '') * 2)
+        self.max_size = max_size
+        REs = [RE for RE in (status_RE, csrf_RE, fields_RE, row_RE) if RE is not None]
+        self.full_page = {RE for RE in REs if full_page_RE(RE)}
+        self.to_eol = {RE for RE in REs if RE not in self.full_page  and  line_RE(RE)}
+
+    def scan(self, response):
+        """Read and scan a requests response opened with stream=True.  The response is closed on return.
+        Returns a page_scan.
+        """
+        result = page_scan()
+        decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')(errors='replace')
+        buf = ''
+        row_pos = 0                                                 # buf index past the last row taken
+        try:
+            chunks = response.iter_content(CHUNK_SIZE)
+            final = False
+            while not final:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    final = True
+                    buf += decoder.decode(b'', final=True)
+                else:
+                    result.size += len(chunk)
+                    if result.size > self.max_size:
+                        raise ValueError(f"Page exceeds max size {self.max_size} bytes")
+                    buf += decoder.decode(chunk)
+
+                if self.login_text  and  self.login_text in buf:
+                    result.login_required = True
+                if self.csrf_RE  and  result.csrf is None:
+                    result.csrf = self._search(self.csrf_RE, buf, final)
+                if self.status_RE  and  result.status is None  and  not result.login_required:
+                    result.status = self._search(self.status_RE, buf, final)
+                if self.fields_RE  and  not result.fields  and  not result.login_required:
+                    out = self._match(self.fields_RE, buf, final)
+                    if out:
+                        result.fields = {name: _value(value) for name, value in out.groupdict().items()}
+                if self.row_RE  and  not result.login_required  and  (final  or  self.row_RE not in self.full_page):
+                    for out in self.row_RE.finditer(buf, row_pos):
+                        if not final  and  not self._settled(self.row_RE, buf, out):
+                            break                                   # Possibly partial.  Retaken with more data.
+                        result.rows.append(tuple(_value(out.group(name)) for name in self.columns))
+                        row_pos = out.end()
+
+                if self._done(result):
+                    break
+                if len(buf) > self.window  and  not self.full_page:
+                    row_pos = max(0, row_pos - (len(buf) - self.window))
+                    buf = buf[-self.window:]
+        finally:
+            response.close()
+        return result
+
+    def _match(self, RE, buf, final):
+        if not final  and  RE in self.full_page:
+            return None
+        out = RE.search(buf)
+        if out  and  (final  or  self._settled(RE, buf, out)):
+            return out
+        return None
+
+    def _settled(self, RE, buf, out):
+        """Return True if match out can't change with more of the page.
+        """
+        if RE in self.to_eol:
+            return buf.find('\n', out.end()) >= 0
+        return out.end() < len(buf)
+
+    def _search(self, RE, buf, final):
+        out = self._match(RE, buf, final)
+        return out.group(1)  if out  else None
+
+    def _done(self, result):
+        if self.csrf_RE  and  result.csrf is None:
+            return False
+        if result.login_required:
+            return True
+        if self.row_RE  or  (self.fields_RE  and  not result.fields):
+            return False
+        return result.status is not None  or  not self.status_RE
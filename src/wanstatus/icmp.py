@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""In-process ICMP echo (ping) engine for wanstatus.
+
+Echo requests to any number of targets are sent from a single socket, shared by all threads, and a
+receiver thread hands each reply to the waiting call by source address and id/seq.  An unprivileged ICMP datagram socket is used when the OS allows it (Linux
+net.ipv4.ping_group_range), else a raw socket (requires root / CAP_NET_RAW).  If neither can be
+opened then icmp_pinger() raises OSError and the caller should fall back to the system ping command.
+"""
+
+import os
+import queue
+import socket
+import struct
+import select
+import threading
+import time
+
+
+ICMP_ECHO_REPLY    = 0
+ICMP_ECHO_REQUEST  = 8
+PAYLOAD            = b"wanstatus" + bytes(range(47))     # 56 byte payload, same as the ping command
+RESOLVE_TTL        = 600                                 # Seconds to cache hostname lookups
+RECEIVE_POLL       = 0.5                                 # Receiver thread check for close(), seconds
+
+
+_resolved = {}
+
+def resolve(addr):
+    """Return the IPv4 address for hostname or IP addr, using the cached lookup if not expired.
+    Raises socket.gaierror if addr cannot be resolved.
+    """
+    ip, expires = _resolved.get(addr, (None, 0))
+    if time.time() > expires:
+        ip = socket.getaddrinfo(addr, None, socket.AF_INET)[0][4][0]
+        _resolved[addr] = (ip, time.time() + RESOLVE_TTL)
+    return ip
+
+
+def _checksum(data):
+    if len(data) % 2:
+        data += b"\x00"
+    total = sum(struct.unpack(f"!{len(data)//2}H", data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+class reply_dispatcher:
+    """ One socket shared by any number of threads, with a receiver thread that hands each reply to the
+    call waiting for it.
+
+    self.lock covers only the sends and the waiters table, so a call waiting on an unanswered target
+    doesn't hold up the others.  A call registers a queue in self.waiters for each key it sends, takes
+    the replies with _next_reply(), and then calls _unregister().  Subclasses implement
+    _reply_key(data, from_addr) to return the key of a received reply, or None to discard it.
+    """
+
+    BUFSIZE = 2048
+
+    def __init__(self, sock, name):
+        self.sock = sock
+        self.lock = threading.Lock()
+        self.waiters = {}                       # key: queue.SimpleQueue of the waiting call
+        self.closed = False
+        self.receiver = threading.Thread(target=self._receive, name=name, daemon=True)
+        self.receiver.start()
+
+    def close(self):
+        self.closed = True
+        self.receiver.join(RECEIVE_POLL * 2)
+        self.sock.close()
+
+    def _receive(self):
+        while not self.closed:
+            try:
+                readable, _, _ = select.select([self.sock], [], [], RECEIVE_POLL)
+                if not readable:
+                    continue
+                recv_time = time.perf_counter()
+                data, from_addr = self.sock.recvfrom(self.BUFSIZE)
+            except (OSError, ValueError):
+                continue                        # ValueError if closed.  The loop then ends.
+            key = self._reply_key(data, from_addr)
+            with self.lock:
+                replies = self.waiters.get(key)
+            if replies is not None:
+                replies.put((key, data, recv_time))
+
+    def _next_reply(self, replies, pending, end_time):
+        """Return the next (key, data, recv_time) from the replies queue whose key is in pending, or
+        None if there is none by end_time (a time.perf_counter() value).
+        """
+        while True:
+            remaining = end_time - time.perf_counter()
+            if remaining <= 0:
+                return None
+            try:
+                reply = replies.get(timeout=remaining)
+            except queue.Empty:
+                return None
+            if reply[0] in pending:
+                return reply
+
+    def _unregister(self, keys):
+        with self.lock:
+            for key in keys:
+                self.waiters.pop(key, None)
+
+
+class icmp_pinger(reply_dispatcher):
+    """ Send ICMP echo requests and collect the replies, all from one socket.
+
+    A single instance may be shared by multiple threads, and calls to ping() run concurrently.
+    Replies are matched to calls by source address and sequence number.
+
+    Hostname targets are resolved once and cached for RESOLVE_TTL seconds.
+    """
+
+    def __init__(self):
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+            self.raw = False
+        except OSError:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)   # Raises PermissionError if not root
+            self.raw = True
+        sock.setblocking(False)
+        self.ident = os.getpid() & 0xffff      # For datagram sockets the kernel replaces this with the socket's port
+        self.seq = 0
+        super().__init__(sock, "icmp_receiver")
+
+    def ping(self, addrs, timeout, first_only=True):
+        """Send one echo request to each of addrs and wait up to timeout seconds for the replies.
+
+        Returns a list of (addr, rtt_ms) tuples in arrival order.  If first_only, returns as soon
+        as the first reply arrives.  An empty list is returned if there are no replies.
+        rtt_ms is measured from the start of the call (after the hostname lookups), so any wait for
+        the shared socket counts.
+        Addrs that cannot be resolved or sent to are skipped.  If none of the addrs can be sent to 
+        then the last OSError (including socket.gaierror) is raised.
+        """
+        targets = []
+        send_error = None
+        for addr in addrs:
+            try:
+                targets.append((addr, resolve(addr)))
+            except OSError as e:
+                send_error = e
+        start_time = time.perf_counter()
+        replies = queue.SimpleQueue()
+        outstanding = {}                        # (ip, seq): addr
+        with self.lock:
+            for addr, ip in targets:
+                self.seq = (self.seq + 1) & 0xffff
+                header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, 0, self.ident, self.seq)
+                packet = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, _checksum(header + PAYLOAD), self.ident, self.seq) + PAYLOAD
+                key = (ip, self.seq)
+                self.waiters[key] = replies
+                try:
+                    self.sock.sendto(packet, (ip, 0))
+                    outstanding[key] = addr
+                except OSError as e:
+                    del self.waiters[key]
+                    send_error = e
+            if not self.raw:
+                self.ident = self.sock.getsockname()[1]     # Bound on the first send
+        if not outstanding  and  send_error:
+            raise send_error
+
+        results = []
+        pending = set(outstanding)
+        end_time = time.perf_counter() + timeout
+        try:
+            while pending:
+                reply = self._next_reply(replies, pending, end_time)
+                if reply is None:
+                    break
+                key, _, recv_time = reply
+                pending.discard(key)
+                results.append((outstanding[key], (recv_time - start_time) * 1000))
+                if first_only:
+                    break
+        finally:
+            self._unregister(outstanding)
+        return results
+
+    def _reply_key(self, data, from_addr):
+        if self.raw:
+            data = data[(data[0] & 0x0f) * 4:]  # Strip the IP header
+        if len(data) < 8:
+            return None
+        icmp_type, _, _, reply_ident, reply_seq = struct.unpack("!BBHHH", data[:8])
+        if icmp_type != ICMP_ECHO_REPLY  or  reply_ident != self.ident:
+            return None
+        return (from_addr[0], reply_seq)
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""Compact on-disk time-series store for probe latencies.
+
+Each probe result is appended as a fixed-width binary record:  timestamp, target id, latency (ms, NaN
+on failure), probe type and status.  Target names are kept in a side file (<store>.targets), keyed by
+the crc32 of the name, so that several processes (eg, the service and interactive runs) may append to
+the same store.  Appends and trims hold an exclusive flock on the store file, and reads a shared one
+(where fcntl is available, ie not on Windows).
+
+Appended timestamps never go backwards (a record is given at least the time of the record before it),
+so the records are in time order even across processes and clock steps.  Reads memory-map the store
+and binary search for the time window, so a query only touches the records it needs, and then also
+check each record's timestamp, so that any records out of order (eg, in a store written by an older
+version) are never returned outside the window.
+
+Retention is by age and by size.  When exceeded the store is trimmed in place, keeping only the newer
+records.  The file is not replaced, so the other processes' open store files stay valid.  Only a store
+opened with trim (the service's) enforces the retention, so that interactive runs and --stats don't
+take the exclusive lock to trim.
+
+An rtt_window keeps the recent response times of one target in memory, for latency-aware request
+timeouts and hedging.
+"""
+
+import collections
+import contextlib
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from pathlib import Path
+
+from cjnfuncs.core import logging
+
+try:
+    import fcntl
+except ImportError:                             # Windows.  No cross-process locking.
+    fcntl = None
+
+
+RECORD          = struct.Struct("<dIfBB2x")     # timestamp, target id, latency ms, probe, status, pad
+HEADER          = b"WSLAT1\n".ljust(RECORD.size, b"\0")
+PROBES          = ("dns", "ping", "modem", "router", "external")
+CHECK_EVERY     = 1024                          # Appends between retention checks
+TRIM_TO         = 0.9                           # Fraction of max_size kept when trimming by size
+RTT_SAMPLES     = 50                            # rtt_window size
+RTT_MIN_SAMPLES = 5                             # Samples needed before the rtt_window percentiles are used
+TIMEOUT_FACTOR  = 4                             # Adaptive timeout is this times the p99 response time,
+MIN_TIMEOUT     = 2.0                           #   but at least this many seconds
+MIN_HEDGE_DELAY = 0.01                          # Seconds
+
+
+@contextlib.contextmanager
+def _exclusive(fd):
+    """Hold an exclusive flock on fd, where fcntl is available.
+    """
+    if fcntl:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+    try:
+        yield
+    finally:
+        if fcntl:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+def target_id(name):
+    return zlib.crc32(name.encode())
+
+
+def percentile(values, p):
+    """Nearest-rank percentile p (0-100) of the sorted list values.
+    """
+    if not values:
+        return math.nan
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+class latency_stat:
+    """ Latency summary for one probe/target over a time window, as returned by latency_store.stats().
+    Latency values are in ms, over the successful samples only.  availability is the fraction of
+    samples that succeeded.
+    """
+    def __init__(self, probe, target, latencies, nsamples):
+        latencies.sort()
+        self.probe =        probe
+        self.target =       target
+        self.nsamples =     nsamples
+        self.availability = len(latencies) / nsamples  if nsamples  else math.nan
+        self.min =          latencies[0]  if latencies  else math.nan
+        self.p50 =          percentile(latencies, 50)
+        self.p95 =          percentile(latencies, 95)
+        self.p99 =          percentile(latencies, 99)
+        self.max =          latencies[-1]  if latencies  else math.nan
+
+
+class rtt_window:
+    """ The last RTT_SAMPLES successful response times (ms) of one target, and the request timeout and
+    hedge delay derived from them.  Until there are RTT_MIN_SAMPLES samples the timeout is the static
+    max timeout and there is no hedging.
+    """
+    def __init__(self):
+        self.samples = collections.deque(maxlen=RTT_SAMPLES)
+
+    def add(self, latency_ms):
+        self.samples.append(latency_ms)
+
+    def seed(self, store, probe, target, start):
+        """Add the successful samples of probe/target recorded in the latency_store since start.
+        """
+        for _, _probe, _target, latency, ok in store.read(start):
+            if ok  and  _probe == probe  and  _target == target  and  not math.isnan(latency):
+                self.samples.append(latency)
+
+    def percentile(self, p):
+        """Return the percentile p (0-100) of the samples in ms, or None if there are too few samples.
+        """
+        if len(self.samples) < RTT_MIN_SAMPLES:
+            return None
+        return percentile(sorted(self.samples), p)
+
+    def timeout(self, max_timeout):
+        """Return the request timeout in seconds:  TIMEOUT_FACTOR times the p99 response time, within
+        MIN_TIMEOUT to max_timeout.
+        """
+        p99 = self.percentile(99)
+        if p99 is None:
+            return max_timeout
+        return min(max_timeout, max(MIN_TIMEOUT, TIMEOUT_FACTOR * p99 / 1000))
+
+    def hedge_delay(self):
+        """Return the seconds to wait for a response before sending a hedged request (the p95 response
+        time), or None if not enough samples.
+        """
+        p95 = self.percentile(95)
+        return max(MIN_HEDGE_DELAY, p95 / 1000)  if p95 is not None  else None
+
+
+class latency_store:
+    """ Append probe latency records to, and query, the store file at path.
+
+    retention is the max record age in seconds, and max_size the max store file size in bytes.
+    Either may be None for no limit.
+    If trim, the retention is enforced when opened and every CHECK_EVERY appends.
+    If readonly, the store is only read (under a shared flock), and record() does nothing.
+    """
+
+    def __init__(self, path, retention=None, max_size=None, trim=True, readonly=False):
+        self.path = Path(path)
+        self.targets_path = self.path.with_name(self.path.name + ".targets")
+        self.retention = retention
+        self.max_size = max_size
+        self.trim = trim  and  not readonly
+        self.readonly = readonly
+        self.lock = threading.Lock()
+        self.fd = None
+        self.known_targets = {}                 # target id: name
+        self.appends = 0
+        self._load_targets()
+        if self.trim  and  self.path.exists():
+            with self.lock:
+                fd = self._open()
+                with _exclusive(fd):
+                    self._enforce_retention(fd)
+
+    def _open(self):
+        if self.fd is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.fd = os.open(self.path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        return self.fd
+
+    def _load_targets(self):
+        try:
+            with self.targets_path.open() as ifile:
+                for line in ifile:
+                    _id, _, name = line.rstrip('\n').partition(' ')
+                    self.known_targets[int(_id, 16)] = name
+        except FileNotFoundError:
+            pass
+
+    def _add_target(self, name):
+        _id = target_id(name)
+        if _id not in self.known_targets:
+            with self.targets_path.open('a') as ofile:
+                ofile.write(f"{_id:08x} {name}\n")
+            self.known_targets[_id] = name
+        return _id
+
+    def record(self, probe, target, latency_ms, ok):
+        """Append a sample.  probe is one of PROBES.  latency_ms is None if not measured.
+        """
+        if self.readonly:
+            return
+        try:
+            with self.lock:
+                fd = self._open()
+                with _exclusive(fd):
+                    nrecords = os.fstat(fd).st_size // RECORD.size - 1
+                    if nrecords < 0:
+                        os.write(fd, HEADER)
+                    _id = self._add_target(target)
+                    latency = latency_ms  if latency_ms is not None  else math.nan
+                    timestamp = time.time()
+                    if nrecords > 0:            # Keep the records in time order
+                        os.lseek(fd, nrecords * RECORD.size, os.SEEK_SET)
+                        timestamp = max(timestamp, RECORD.unpack(os.read(fd, RECORD.size))[0])
+                    os.write(fd, RECORD.pack(timestamp, _id, latency, PROBES.index(probe), bool(ok)))
+                    self.appends += 1
+                    if self.trim  and  self.appends % CHECK_EVERY == 0:
+                        self._enforce_retention(fd)
+        except Exception as e:
+            logging.warning (f"Failed recording to latency store <{self.path}>:  {e}")
+
+    def _enforce_retention(self, fd):
+        """Trim the store in place to the records within the retention age and max size.  Called with
+        the exclusive flock held on fd, the open store file.
+        """
+        size = os.fstat(fd).st_size
+        nrecords = size // RECORD.size - 1
+        if nrecords <= 0:
+            return
+        keep_from = 0
+        with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mm:
+            if mm[:len(HEADER)] != HEADER:
+                raise ValueError(f"<{self.path}> is not a wanstatus latency store")
+            if self.retention:
+                keep_from = self._bisect(mm, nrecords, time.time() - self.retention)
+            if self.max_size  and  size > self.max_size:
+                keep_from = max(keep_from, nrecords - int(self.max_size * TRIM_TO) // RECORD.size + 1)
+            if keep_from == 0:
+                return
+            data = mm[(keep_from + 1) * RECORD.size : (nrecords + 1) * RECORD.size]
+        wfd = os.open(self.path, os.O_WRONLY)   # Without O_APPEND, to write from the start
+        try:
+            os.write(wfd, HEADER + data)
+            os.ftruncate(wfd, len(HEADER) + len(data))
+        finally:
+            os.close(wfd)
+        logging.debug (f"Latency store trimmed to {len(data) // RECORD.size} records")
+
+    def _map(self):
+        return _mapped(self.path)
+
+    def _bisect(self, mm, nrecords, timestamp):
+        """Return the index of the first record at or after timestamp.  Records are in time order.
+        """
+        lo, hi = 0, nrecords
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if RECORD.unpack_from(mm, (mid + 1) * RECORD.size)[0] < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def read(self, start=0, end=None):
+        """Yield (timestamp, probe, target, latency_ms, ok) for the records from start to end (time.time() values).
+        latency_ms is NaN if not measured.
+        """
+        self._load_targets()
+        with self._map() as mm:
+            if mm is None:
+                return
+            nrecords = len(mm) // RECORD.size - 1
+            first = self._bisect(mm, nrecords, start)
+            last = self._bisect(mm, nrecords, end)  if end is not None  else nrecords
+            window = mm[(first + 1) * RECORD.size : (last + 1) * RECORD.size]      # Only the window is paged in
+        for timestamp, _id, latency, probe, ok in RECORD.iter_unpack(window):
+            if timestamp < start  or  (end is not None  and  timestamp >= end):
+                continue                        # Out of order
+            yield timestamp, PROBES[probe], self.known_targets.get(_id, f"<{_id:08x}>"), latency, bool(ok)
+
+    def stats(self, start=0, end=None):
+        """Return a list of latency_stat, one per probe/target with samples from start to end.
+        """
+        latencies = {}
+        counts = {}
+        for _, probe, target, latency, ok in self.read(start, end):
+            key = (probe, target)
+            counts[key] = counts.get(key, 0) + 1
+            samples = latencies.setdefault(key, [])
+            if ok  and  not math.isnan(latency):
+                samples.append(latency)
+        return [latency_stat(probe, target, latencies[(probe, target)], counts[(probe, target)]) for probe, target in sorted(counts)]
+
+    def close(self):
+        with self.lock:
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+
+
+class _mapped:
+    """ Context manager giving a read-only mmap of path, or None if the store is empty or missing.
+    A shared flock is held while mapped, so that the store is not trimmed under the map.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.mm = None
+
+    def __enter__(self):
+        try:
+            self.file = self.path.open('rb')
+        except FileNotFoundError:
+            return None
+        if fcntl:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_SH)
+        if os.fstat(self.file.fileno()).st_size <= RECORD.size:
+            return None                         # __exit__ still runs, closing the file
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(HEADER)] != HEADER:
+            self.__exit__()
+            raise ValueError(f"<{self.path}> is not a wanstatus latency store")
+        return self.mm
+
+    def __exit__(self, *exc):
+        if self.mm is not None:
+            self.mm.close()
+        if self.file is not None:
+            self.file.close()                   # Releases the flock
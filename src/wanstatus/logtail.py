@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""Fast, filtered tail of the log file, for --print-log.
+
+The log is read backwards from the end in blocks, so the cost is proportional to the lines shown,
+not to the log size.  Filtering (by level, time range and regex) is done during the backwards scan,
+which stops once enough records are found or the scan passes the start of the time range.  Rotated
+log files (<LogFile>.1, <LogFile>.2.gz, <LogFile>-20240101, ...) are read after the current file,
+newest first.
+
+A log record is a line with a level name (eg 'WARNING:  '), plus any following lines without one
+(eg a multi-line error message).
+"""
+
+import datetime
+import gzip
+import os
+import re
+from pathlib import Path
+
+
+BLOCK_SIZE      = 65536
+LEVELS          = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40, "CRITICAL": 50}
+LEVEL_RE        = re.compile(r"\b(DEBUG|INFO|WARNING|ERROR|CRITICAL):  ")
+TIME_RE         = re.compile(r"\d{4}-\d\d-\d\d \d\d:\d\d:\d\d")         # FileLogFormat {asctime} at the start of line
+EVENTS_RE       = r"INTERNET ACCESS LOST|OUTAGE ENDED|WAN IP CHANGED"
+
+
+def reverse_lines(path, block_size=BLOCK_SIZE):
+    """Yield the lines of the file at path, last line first, without line endings.
+    Gzipped (.gz) rotated files are decompressed in full, as they cannot be read backwards.
+    """
+    if path.suffix == ".gz":
+        with gzip.open(path, 'rb') as ifile:
+            data = ifile.read()
+        for line in reversed(data.splitlines()):
+            yield line.decode(errors='replace')
+        return
+
+    with path.open('rb') as ifile:
+        position = os.fstat(ifile.fileno()).st_size
+        carry = b""
+        first_block = True
+        while position > 0:
+            size = min(block_size, position)
+            position -= size
+            ifile.seek(position)
+            block = ifile.read(size) + carry
+            split_at = block.find(b"\n") + 1
+            carry, block = block[:split_at - 1]  if split_at  else block, block[split_at:]     # carry is possibly partial - completed by the next (earlier) block
+            if not split_at:
+                continue
+            lines = block.decode(errors='replace').split("\n")   # Decoded a block at a time, split on whole lines
+            if first_block  and  lines[-1] == "":
+                lines.pop()                                         # Trailing newline
+            first_block = False
+            for line in reversed(lines):
+                yield line.rstrip("\r")
+        if carry  or  not first_block:
+            yield carry.decode(errors='replace').rstrip("\r")
+
+
+def log_files(path):
+    """Return the log file path plus its rotated files, newest first.
+    """
+    path = Path(path)
+    rotated = [_path for _path in path.parent.glob(path.name + "*")
+               if _path != path  and  _path.name[len(path.name)] in ".-_"  and  not _path.name.endswith(".tmp")]
+    rotated.sort(key=lambda _path: _path.stat().st_mtime, reverse=True)
+    return ([path]  if path.exists()  else [])  +  rotated
+
+
+def _time_str(when):
+    """Return when (a time.time() value) as a local time string comparable to the {asctime} log field.
+    """
+    return datetime.datetime.fromtimestamp(when).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def reverse_records(path):
+    """Yield (level name, timestamp string, record text) for each log record in the log file and its
+    rotated files, newest first.  level name and timestamp string are None if not found.
+    """
+    for _path in log_files(path):
+        continuation = []
+        for line in reverse_lines(_path):
+            match = LEVEL_RE.search(line)  if ":  " in line  else None
+            if not match:
+                continuation.append(line)
+                continue
+            time_match = TIME_RE.match(line)
+            yield match.group(1), time_match.group(0)  if time_match  else None, "\n".join([line] + continuation[::-1])
+            continuation = []
+        if continuation:                                            # Lines before the first record in the file
+            yield None, None, "\n".join(continuation[::-1])
+
+
+def tail(path, count, level=None, since=None, until=None, pattern=None):
+    """Return up to the last count log records (as text) in time order, for records that are
+    at or above level (eg 'WARNING'), between since and until (time.time() values), and match the
+    regex pattern.  Any of the filters may be None.
+    """
+    min_level = LEVELS[level.upper()]  if level  else None
+    since_str = _time_str(since)  if since is not None  else None
+    until_str = _time_str(until)  if until is not None  else None
+    regex = re.compile(pattern)  if pattern  else None
+
+    records = []
+    for level_name, timestamp, text in reverse_records(path):
+        if len(records) >= count:
+            break
+        if timestamp:
+            if since_str  and  timestamp < since_str:
+                break                                               # Older records are all out of range
+            if until_str  and  timestamp > until_str:
+                continue
+        if min_level  and  LEVELS.get(level_name, 0) < min_level:
+            continue
+        if regex  and  not regex.search(text):
+            continue
+        records.append(text)
+    return records[::-1]
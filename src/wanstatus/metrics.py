@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""In-memory metrics and a Prometheus text format HTTP exporter for service mode.
+
+The checks update the metrics_registry as they run.  A scrape only renders the registry (the rendered
+text is cached until the next update), so scrapes never trigger probes and scrape load does not affect
+the checks.  Cheap collectors (eg, the process resource usage) may be added to update gauges on each
+scrape.  Their metric families are declared volatile, and are rendered on each scrape and appended to
+the cached text, so that they don't invalidate the cache.
+"""
+
+import threading
+import http.server
+
+from cjnfuncs.core import logging
+
+
+CONTENT_TYPE    = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_str(labels):
+    """Render a dict of labels as {a="x",b="y"}, or '' for no labels.
+    """
+    if not labels:
+        return ""
+    escape = lambda value: str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _num(value):
+    return repr(float(value))  if value == value  else "NaN"
+
+
+class _family:
+    def __init__(self, name, mtype, help, buckets, volatile):
+        self.name =     name
+        self.mtype =    mtype
+        self.help =     help
+        self.buckets =  buckets
+        self.volatile = volatile
+        self.series =   {}              # label key tuple: [label_str, value]  (histogram value: [bucket counts, sum, count])
+
+
+class metrics_registry:
+    """ Gauges, counters and histograms, keyed by name and a labels dict.
+
+    Metric families are declared with describe() before use.  All methods are thread safe.
+    """
+
+    def __init__(self):
+        self.families = {}
+        self.lock = threading.Lock()
+        self.version = 0
+        self.rendered_version = -1
+        self.rendered = b""
+        self.collectors = []
+
+    def add_collector(self, func):
+        """Call func() (which may set metrics) before each render().  The metrics it sets should be
+        declared volatile.
+        """
+        self.collectors.append(func)
+
+    def describe(self, name, mtype, help, buckets=LATENCY_BUCKETS, volatile=False):
+        """Declare metric family name of mtype 'gauge', 'counter' or 'histogram'.
+        A volatile family (eg, set by a collector on each scrape) is rendered on each render(), outside
+        of the cached text, so that its updates don't invalidate the cache.
+        """
+        with self.lock:
+            self.families[name] = _family(name, mtype, help, buckets, volatile)
+            self.version += 1
+
+    def _series(self, name, labels):
+        family = self.families[name]
+        key = tuple(labels.items())
+        if key not in family.series:
+            initial = [[0] * len(family.buckets), 0.0, 0]  if family.mtype == 'histogram'  else 0.0
+            family.series[key] = [_label_str(labels), initial]
+        if not family.volatile:
+            self.version += 1
+        return family.series[key]
+
+    def set(self, name, labels, value):
+        with self.lock:
+            self._series(name, labels)[1] = value
+
+    def inc(self, name, labels, amount=1):
+        with self.lock:
+            self._series(name, labels)[1] += amount
+
+    def observe(self, name, labels, value):
+        with self.lock:
+            counts, _, _ = series = self._series(name, labels)[1]
+            for i, bound in enumerate(self.families[name].buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def set_info(self, name, key_labels, info_labels):
+        """Set an info style gauge (value 1) with key_labels plus info_labels, replacing any prior
+        series with the same key_labels (eg, the prior WANIP).
+        """
+        with self.lock:
+            family = self.families[name]
+            key = tuple(key_labels.items())
+            for series_key in [_key for _key in family.series if _key[:len(key)] == key]:
+                del family.series[series_key]
+            self._series(name, {**key_labels, **info_labels})[1] = 1
+
+    def replace(self, name, key_labels, series):
+        """Replace all series of name having key_labels with series, a list of (labels, value).
+        The key_labels are added to each series' labels.
+        """
+        with self.lock:
+            family = self.families[name]
+            key = tuple(key_labels.items())
+            for series_key in [_key for _key in family.series if _key[:len(key)] == key]:
+                del family.series[series_key]
+            for labels, value in series:
+                self._series(name, {**key_labels, **labels})[1] = value
+            if not family.volatile:
+                self.version += 1                                   # Removals alone change the text
+
+    def render(self):
+        """Return the Prometheus text exposition of all metrics, as bytes.
+        """
+        for collector in self.collectors:
+            try:
+                collector()
+            except Exception as e:
+                logging.warning (f"Metrics collector {collector.__name__} failed:  {e}")
+        with self.lock:
+            if self.rendered_version != self.version:
+                lines = []
+                for family in self.families.values():
+                    if not family.volatile:
+                        self._render_family(family, lines)
+                self.rendered = ("\n".join(lines) + "\n").encode()
+                self.rendered_version = self.version
+            lines = []
+            for family in self.families.values():
+                if family.volatile:
+                    self._render_family(family, lines)
+            return self.rendered + ("\n".join(lines) + "\n").encode()  if lines  else self.rendered
+
+    def _render_family(self, family, lines):
+        """Append the text lines of family to lines.  Called with the lock held.
+        """
+        lines.append(f"# HELP {family.name} {family.help}")
+        lines.append(f"# TYPE {family.name} {family.mtype}")
+        for label_str, value in family.series.values():
+            if family.mtype != 'histogram':
+                lines.append(f"{family.name}{label_str} {_num(value)}")
+                continue
+            counts, total, count = value
+            prefix = label_str[:-1] + ","  if label_str  else "{"
+            cumulative = 0
+            for bound, bucket_count in zip(family.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{family.name}_bucket{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f'{family.name}_bucket{prefix}le="+Inf"}} {count}')
+            lines.append(f"{family.name}_sum{label_str} {_num(total)}")
+            lines.append(f"{family.name}_count{label_str} {count}")
+
+
+class metrics_server:
+    """ Serve registry.render() at http://address:port/metrics from a background thread.
+    """
+
+    def __init__(self, registry, address, port):
+        self.address = address
+        self.port = port
+
+        class handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/metrics', '/'):
+                    self.send_error(404)
+                    return
+                body = registry.render()
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = http.server.ThreadingHTTPServer((address, port), handler)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, name="metrics", daemon=True).start()
+        logging.info (f"Metrics exporter listening at <http://{address}:{port}/metrics>")
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
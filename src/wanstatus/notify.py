@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""Background notification dispatcher.
+
+Notices are put on a bounded queue that is saved to disk (so that unsent notices survive a restart),
+and sent by a worker thread, so the checks never wait on mail delivery.  Notices arriving within the
+coalescing window are sent as one message.  Each batch is sent over one SMTP connection, to both the
+NotifList and EmailTo addresses.  Failed sends are retried with exponential backoff.  Each notice
+records which of the two it has been delivered to, so a retry after a partial failure resends only to
+the addresses that failed.
+"""
+
+import datetime
+import json
+import os
+import smtplib
+import threading
+import time
+from email.mime.text import MIMEText
+from email.utils import formatdate
+from pathlib import Path
+
+from cjnfuncs.core import logging
+from cjnfuncs.SMTP import snd_email, snd_notif, list_to, SERVER_TIMEOUT
+from cjnfuncs.timevalue import timevalue
+
+
+class notifier:
+    """ Queue notices and send them from a worker thread.
+
+    path            Queue file, or None for a memory-only queue
+    smtp_config     config_item with the [SMTP] section (read at send time, so reloads are honored)
+    window          Coalescing window, seconds.  Notices within the window of the first are sent together.
+    max_queue       Max queued notices.  The oldest are dropped when full.
+    backoff         First retry wait, seconds.  Doubled on each failed try, up to max_backoff.
+    """
+
+    def __init__(self, path, smtp_config, window=10, max_queue=100, backoff=30, max_backoff=1800):
+        self.path = Path(path)  if path  else None
+        self.smtp_config = smtp_config
+        self.window = window
+        self.max_queue = max_queue
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stop_flag = False
+        self.queue = self._load()
+        if self.queue:
+            logging.warning (f"{len(self.queue)} unsent notice(s) loaded from <{self.path}>")
+            self.wake.set()
+        self.thread = threading.Thread(target=self._worker, name="notifier", daemon=True)
+        self.thread.start()
+
+    def _load(self):
+        if not self.path:
+            return []
+        try:
+            with self.path.open() as ifile:
+                return json.load(ifile)
+        except FileNotFoundError:
+            return []
+        except Exception as e:
+            logging.warning (f"Ignoring unreadable notice queue file <{self.path}>:  {e}")
+            return []
+
+    def _save(self):
+        """Save the queue.  Called with the lock held.
+        """
+        if not self.path:
+            return
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with tmp.open('w') as ofile:
+                json.dump(self.queue, ofile)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            logging.warning (f"Failed saving notice queue file <{self.path}>:  {e}")
+
+    def submit(self, subject, message):
+        """Queue a notice and return immediately.
+        """
+        with self.lock:
+            self.queue.append({"subject": subject, "message": message, "time": time.time()})
+            if len(self.queue) > self.max_queue:
+                dropped = self.queue[:-self.max_queue]
+                del self.queue[:-self.max_queue]
+                logging.warning (f"Notice queue full.  Dropped {len(dropped)} oldest notice(s):  {[item['subject'] for item in dropped]}")
+            self._save()
+        self.wake.set()
+
+    def _worker(self):
+        retry_wait = self.backoff
+        while not self.stop_flag:
+            self.wake.wait()
+            self.wake.clear()
+            if self.stop_flag:
+                break
+            with self.lock:
+                if not self.queue:
+                    continue
+                first_time = self.queue[0]["time"]
+            delay = first_time + self.window - time.time()              # Coalesce notices within the window
+            if delay > 0  and  self._sleep(delay):
+                break
+
+            with self.lock:
+                batch = list(self.queue)
+            try:
+                self.send(batch)
+            except Exception as e:
+                logging.warning (f"Notice send failed for {[item['subject'] for item in batch]}.  Retry in {retry_wait} sec.\n  {e}")
+                self.wake.set()
+                if self._sleep(retry_wait):
+                    break
+                retry_wait = min(retry_wait * 2, self.max_backoff)
+                continue
+            retry_wait = self.backoff
+            with self.lock:
+                sent = {id(item) for item in batch}                     # Notices added during the send remain,
+                self.queue[:] = [item for item in self.queue if id(item) not in sent]   # and any dropped are gone
+                self._save()
+                if self.queue:
+                    self.wake.set()
+
+    def _sleep(self, seconds):
+        """Sleep, returning True if stopped meanwhile.
+        """
+        end_time = time.time() + seconds
+        while not self.stop_flag  and  time.time() < end_time:
+            time.sleep(min(0.25, end_time - time.time()))
+        return self.stop_flag
+
+    def send(self, batch):
+        """Send the batch as one message to the NotifList addresses (the Notification) and one to the
+        EmailTo addresses (the Email).  Each kind sent is added to the notices' 'sent' list (and the
+        queue saved), and only the notices not yet sent are included for each kind, so a retry of a
+        partly failed batch doesn't send duplicates.  Raises if either kind failed.
+        """
+        smtp = self.smtp_config
+        get = lambda param, fallback=None: smtp.getcfg(param, fallback, section='SMTP')
+        server = connect_error = None
+        errors = []
+        try:
+            for kind, param in (("Notification", 'NotifList'), ("Email", 'EmailTo')):
+                items = [item for item in batch if kind not in item.get("sent", [])]
+                if not items  or  not get(param):
+                    continue
+                subject, message = coalesce(items)
+                try:
+                    if get('Msg_Handler')  or  get('EmailDKIMDomain'):    # Not handled here.  Use cjnfuncs.SMTP.
+                        if kind == "Notification":
+                            snd_notif (subj=subject, msg=message, log=True, smtp_config=smtp)
+                        else:
+                            snd_email (subj=subject, body=message, to='EmailTo', log=True, smtp_config=smtp)
+                    elif get('DontEmail', False)  or  (kind == "Notification"  and  get('DontNotif', False)):
+                        logging.warning (f"{kind} NOT sent <{subject}>" + (f" <{message}>"  if kind == "Notification"  else ""))
+                    else:
+                        if connect_error:
+                            raise connect_error
+                        if server is None:
+                            try:
+                                server = smtp_connect(smtp)
+                            except Exception as e:
+                                connect_error = e
+                                raise
+                        to = list_to(param, 'emails', subject, smtp_config=smtp)
+                        email_from = get('EmailFrom')
+                        msg = MIMEText(message + '\n' + datetime.datetime.now().astimezone().strftime("%a %b %d %Y - %H:%M:%S"))
+                        msg['Subject'] = subject
+                        msg['From']    = email_from
+                        msg['To']      = ", ".join(to)
+                        msg['Date']    = formatdate(localtime=True)
+                        server.sendmail(email_from, to, msg.as_string())
+                        logging.warning (f"{kind} sent <{subject}>" + (f" <{message}>"  if kind == "Notification"  else ""))
+                except Exception as e:
+                    errors.append(f"{kind}:  {e}")
+                    continue
+                with self.lock:
+                    for item in items:
+                        item.setdefault("sent", []).append(kind)
+                    self._save()
+        finally:
+            if server is not None:
+                try:
+                    server.quit()
+                except Exception:
+                    server.close()
+        if errors:
+            raise RuntimeError("\n  ".join(errors))
+
+    def close(self, timeout=2):
+        """Stop the worker.  Unsent notices remain in the queue file.
+        """
+        self.stop_flag = True
+        self.wake.set()
+        self.thread.join(timeout)
+
+
+def coalesce(batch):
+    """Return one subject and message for a batch of notices.
+    """
+    if len(batch) == 1:
+        return batch[0]["subject"], batch[0]["message"]
+    subjects = []
+    for item in batch:
+        subject = item["subject"].replace("NOTICE:  ", "")
+        if subject not in subjects:
+            subjects.append(subject)
+    lines = []
+    for item in batch:
+        timestamp = datetime.datetime.fromtimestamp(item["time"]).strftime("%Y-%m-%d %H:%M:%S")
+        lines.append(f"{timestamp}  {item['subject']}\n  {item['message']}")
+    return "NOTICE:  " + "; ".join(subjects), "\n".join(lines)
+
+
+def smtp_connect(smtp):
+    """Open and log into the SMTP server per the [SMTP] params, as cjnfuncs.SMTP.snd_email does.
+
+    cjnfuncs.SMTP has no connection-level helper.  snd_email() opens, logs into and quits a new
+    connection for each message, and retries internally with blocking sleeps (EmailNTries, EmailRetryWait).
+    Here both kinds of a batch are sent over one connection, and retries are left to the notifier's
+    backoff, so the connection is made here.  The DKIM and Msg_Handler cases still go through
+    snd_email() / snd_notif().
+    """
+    get = lambda param, fallback='_nofallback': smtp.getcfg(param, fallback, section='SMTP')
+    port = str(get('EmailServerPort')).lower()
+    if port not in ['p25', 'p465', 'p587', 'p587tls']:
+        raise ValueError (f"Config EmailServerPort <{port}> is invalid")
+    server_name = get('EmailServer')
+    timeout = timevalue(get('EmailServerTimeout', SERVER_TIMEOUT)).seconds
+    if port == "p25":
+        server = smtplib.SMTP(server_name, 25, timeout=timeout)
+    elif port == "p465":
+        server = smtplib.SMTP_SSL(server_name, 465, timeout=timeout)
+    else:
+        server = smtplib.SMTP(server_name, 587, timeout=timeout)
+    try:
+        if get('EmailVerbose', False):
+            server.set_debuglevel(1)
+        if port == "p587tls":
+            server.starttls()
+        if port.startswith('p587'):
+            server.login(str(get('EmailUser')), str(get('EmailPass')))
+    except Exception:
+        server.close()
+        raise
+    return server
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""Adaptive internet access check controller for service mode.
+
+A probe_controller is fed each have_internet() result and decides the outage state and the wait
+until the next check:
+    - Loss and recovery are each confirmed by k of the last n results (hysteresis), so a single
+      dropped probe is not an outage and a single lucky probe is not a recovery.
+    - While up, checks come faster when the signal degrades (RTT well above its running baseline,
+      or some of the targets failing), so that a real outage is confirmed sooner.
+    - During an outage the check period backs off exponentially, cutting probe traffic during long
+      outages.
+    - A loss confirmed during the RecoveryDelay hold after a recovery continues the same outage,
+      so a flapping link is reported as one outage, with a count of the flaps.
+    - The outage start and end times are backdated to the first and last failed check.
+"""
+
+import collections
+
+
+RTT_ALPHA       = 0.1                           # RTT baseline moving average weight of each new sample
+RTT_FLOOR_MS    = 10                            # RTT rises of less than this over the baseline are not degraded
+
+
+class probe_controller:
+    """ Outage state and check period for one site's internet access checks.
+
+    snap is the site's config_snapshot, and may be replaced on a config reload without losing state.
+
+    States:
+        up          Internet access working.  Checked every StatusRecheckPeriod, or DegradedRecheckPeriod
+                    if the last check was degraded.
+        suspect     Some recent checks failed, loss not yet confirmed.  Checked every OutageRecheckPeriod.
+        down        Loss confirmed.  Checked every OutageRecheckPeriod, backing off by OutageBackoff on
+                    each failed check, up to OutageMaxRecheckPeriod.
+        recovering  Checks succeeding during an outage, recovery not yet confirmed.  Checked every
+                    OutageRecheckPeriod.
+        hold        Recovery confirmed.  Checked every OutageRecheckPeriod until RecoveryDelay has passed,
+                    then the outage is ended.
+
+    update() returns the event caused by a check result, if any:
+        'lost'      Loss confirmed.  outage_start is set.
+        'flap'      Loss confirmed during the hold.  The outage continues.
+        'recovered' Recovery confirmed.  recovered_time is set.
+        'ended'     RecoveryDelay passed.  outage_start, outage_end and flaps are valid until the next update().
+    """
+
+    def __init__(self, snap):
+        self.snap = snap
+        self.state = 'up'
+        self.results = collections.deque(maxlen=self._window_size())     # (time, ok) of the recent checks
+        self.degraded = False
+        self.rtt_baseline = None
+        self.outage_start = None
+        self.outage_end = None
+        self.recovered_time = None
+        self.flaps = 0
+        self.outage_period = snap.OutageRecheckPeriod
+
+    def _window_size(self):
+        return max(self.snap.OutageConfirm[1], self.snap.RecoveryConfirm[1])
+
+    def _count(self, ok, n):
+        """Return the number of the last n results equal to ok.
+        """
+        return sum(1 for _, _ok in list(self.results)[-n:] if _ok == ok)
+
+    def _confirmed(self, ok):
+        k, n = self.snap.RecoveryConfirm  if ok  else self.snap.OutageConfirm
+        return self._count(ok, n) >= k
+
+    def _restart(self, state):
+        """Enter state with a clear results window, so the next confirmation counts only new results.
+        """
+        self.state = state
+        self.results = collections.deque(maxlen=self._window_size())
+
+    def _check_degraded(self, rtt, failed):
+        """Return True if some targets failed, or the RTT (ms) is well over the baseline.  Updates the baseline.
+        """
+        degraded = bool(failed)
+        if rtt is not None:
+            if self.rtt_baseline is None:
+                self.rtt_baseline = rtt
+            elif rtt > self.rtt_baseline * self.snap.DegradedRTTFactor + RTT_FLOOR_MS:
+                degraded = True
+            self.rtt_baseline += RTT_ALPHA * (rtt - self.rtt_baseline)
+        return degraded
+
+    def update(self, ok, now, rtt=None, failed=0):
+        """Account a have_internet() result.  now is the check start time (time.time()), rtt the
+        response time in ms (or None), and failed the number of failed target tries before the result.
+        Returns the event caused, or None.
+        """
+        if self.results.maxlen != self._window_size():
+            self.results = collections.deque(self.results, maxlen=self._window_size())
+        if self.state == 'up'  and  self.outage_end is not None:                    # Prior outage fully reported
+            self.outage_start = self.outage_end = None
+            self.flaps = 0
+        self.results.append((now, ok))
+        if not ok  and  self.state != 'up':
+            self.outage_end = now
+        self.degraded = False
+
+        if self.state in ('up', 'suspect'):
+            if not ok  and  self._confirmed(False):
+                k, n = self.snap.OutageConfirm
+                self.outage_start = min(_time for _time, _ok in list(self.results)[-n:] if not _ok)
+                self.outage_end = now
+                self.outage_period = self.snap.OutageRecheckPeriod
+                self._restart('down')
+                return 'lost'
+            if ok:
+                self.degraded = self._check_degraded(rtt, failed)
+            self.state = 'suspect'  if self._count(False, self.snap.OutageConfirm[1])  else 'up'
+            return None
+
+        if self.state in ('down', 'recovering'):
+            if ok:
+                self.outage_period = self.snap.OutageRecheckPeriod
+                if self._confirmed(True):
+                    self.recovered_time = now
+                    self._restart('hold')
+                    return 'recovered'
+                self.state = 'recovering'
+            else:
+                if self.state == 'down':
+                    self.outage_period = min(self.outage_period * self.snap.OutageBackoff, self.snap.OutageMaxRecheckPeriod)
+                self.state = 'down'
+            return None
+
+        # hold
+        if not ok  and  self._confirmed(False):
+            self.flaps += 1
+            self.recovered_time = None
+            self.outage_period = self.snap.OutageRecheckPeriod
+            self._restart('down')
+            return 'flap'
+        if ok  and  now - self.recovered_time >= self.snap.RecoveryDelay  and  not self._count(False, self.snap.OutageConfirm[1]):
+            self.recovered_time = None
+            self._restart('up')
+            return 'ended'
+        return None
+
+    def period(self, now):
+        """Return the wait, in seconds, until the next check.
+        """
+        snap = self.snap
+        if self.state == 'up':
+            return min(snap.DegradedRecheckPeriod, snap.StatusRecheckPeriod)  if self.degraded  else snap.StatusRecheckPeriod
+        if self.state == 'down':
+            return self.outage_period
+        if self.state == 'hold':
+            remaining = self.recovered_time + snap.RecoveryDelay - now
+            if remaining > 0:
+                return min(snap.OutageRecheckPeriod, remaining)
+        return snap.OutageRecheckPeriod
+
+    def in_outage(self):
+        return self.state in ('down', 'recovering', 'hold')
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""Process resource accounting, for spotting leaks in a long-running service.
+
+resource_usage() samples the open file descriptors, sockets, threads, RSS and (if tracemalloc is
+tracing) the traced Python allocations.  A growth_tracker is fed a sample per N cycles of some
+repeated work, and reports the per-cycle growth of each resource over the steady-state part of the
+run, flagging any that keep growing.
+"""
+
+import os
+import statistics
+import threading
+import tracemalloc
+
+
+RESOURCES       = ("fds", "sockets", "threads", "rss_bytes", "traced_bytes")
+# Growth allowed over the steady-state samples before a resource is flagged:  (total, per cycle).
+# Counts must not grow at all.  Memory may grow by a fixed amount (eg, caches filling, allocator
+# fragmentation) but not steadily per cycle.
+TOLERANCE       = {"fds":           (0, 0),
+                   "sockets":       (0, 0),
+                   "threads":       (0, 0),
+                   "rss_bytes":     (4 * 2**20, 64),
+                   "traced_bytes":  (1 * 2**20, 16)}
+
+
+def resource_usage():
+    """Return a dict of the current process resource usage.  Values not available on this platform
+    (fds and sockets need /proc/self/fd) are None, as is traced_bytes if tracemalloc is not tracing.
+    """
+    usage = {"fds": None, "sockets": None, "threads": threading.active_count(), "rss_bytes": None,
+             "traced_bytes": None, "traced_peak_bytes": None}
+    try:
+        fds = os.listdir("/proc/self/fd")
+        usage["fds"] = len(fds)
+        sockets = 0
+        for fd in fds:
+            try:
+                sockets += os.readlink(f"/proc/self/fd/{fd}").startswith("socket:")
+            except OSError:
+                pass                            # Closed since listed (eg, the listdir fd)
+        usage["sockets"] = sockets
+    except OSError:
+        pass
+    try:
+        with open("/proc/self/statm") as ifile:
+            usage["rss_bytes"] = int(ifile.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        try:
+            import resource
+            usage["rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024     # Peak, on macOS bytes already
+        except ImportError:
+            pass
+    if tracemalloc.is_tracing():
+        usage["traced_bytes"], usage["traced_peak_bytes"] = tracemalloc.get_traced_memory()
+    return usage
+
+
+class growth_tracker:
+    """ Collect (cycle, resource_usage()) samples and report the resource growth per cycle.
+
+    The first warmup cycles are excluded (startup, first logins, caches filling).  Growth is measured
+    between the medians of the first and last thirds of the remaining samples, so that transient
+    spikes (eg, a request thread that is still finishing) don't count.
+    """
+
+    def __init__(self, warmup, tolerance=None):
+        self.warmup = warmup
+        self.tolerance = {**TOLERANCE, **(tolerance or {})}
+        self.samples = []                       # (cycle, usage)
+
+    def add(self, cycle, usage=None):
+        self.samples.append((cycle, usage  if usage is not None  else resource_usage()))
+
+    def report(self):
+        """Return a list of dicts, one per resource with data:  name, first (value at the first
+        steady-state sample), last, growth (between the thirds medians), per_cycle, and flagged.
+        Empty if there are fewer than 3 steady-state samples.
+        """
+        steady = [(cycle, usage) for cycle, usage in self.samples if cycle >= self.warmup]
+        if len(steady) < 3:
+            return []
+        third = len(steady) // 3
+        head, tail = steady[:third], steady[-third:]
+        cycles = statistics.median(cycle for cycle, _ in tail) - statistics.median(cycle for cycle, _ in head)
+        results = []
+        for name in RESOURCES:
+            if steady[0][1].get(name) is None:
+                continue
+            growth = statistics.median(usage[name] for _, usage in tail) - statistics.median(usage[name] for _, usage in head)
+            per_cycle = growth / cycles  if cycles  else 0
+            total_limit, cycle_limit = self.tolerance[name]
+            results.append({"name":      name,
+                            "first":     steady[0][1][name],
+                            "last":      steady[-1][1][name],
+                            "growth":    growth,
+                            "per_cycle": per_cycle,
+                            "flagged":   growth > total_limit  and  per_cycle > cycle_limit})
+        return results
+
+
+def allocation_growth(before, after, limit=10):
+    """Return the limit source lines with the most traced allocation growth between two
+    tracemalloc snapshots, as (size_diff_bytes, count_diff, "file:line") tuples.
+    """
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    stats = after.filter_traces(filters).compare_to(before.filter_traces(filters), 'lineno')
+    return [(stat.size_diff, stat.count_diff, f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}")
+            for stat in stats[:limit] if stat.size_diff > 0]
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""Timer-heap job scheduler for wanstatus service mode.
+
+Each job has its own period and is rescheduled drift-free from its prior due time (not from when it
+happened to finish).  Optional jitter spreads jobs so they don't all fire at once.  The run() loop
+sleeps until the next due job, and may be woken early by run_now().
+"""
+
+import heapq
+import math
+import random
+import threading
+import time
+
+from cjnfuncs.core import logging
+
+
+class job:
+    """ A scheduled job.  See scheduler.add().
+    """
+    def __init__(self, name, func, period, jitter, inline):
+        self.name =     name
+        self.func =     func
+        self.period =   period
+        self.jitter =   jitter
+        self.inline =   inline
+        self.base_due = 0           # Drift-free schedule, without jitter
+        self.due =      0           # Actual fire time, with jitter
+        self.future =   None
+        self.version =  0           # Heap entries with an old version are stale
+
+
+class scheduler:
+    """ Run jobs at their own periods.
+
+    pool is a concurrent.futures executor.  Non-inline jobs are run on the pool so that a slow job
+    does not delay other jobs.  A job is not restarted while its prior run is still in progress.
+    Inline jobs run in the run() loop thread, with no other inline job running.
+
+    All times are time.monotonic() values.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.jobs = {}
+        self.heap = []
+        self.seq = 0                # Heap tie breaker
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stop_flag = False
+
+    def add(self, name, func, period, jitter=0.0, inline=False, delay=0):
+        """Add (or replace) job name, first due after delay seconds.
+
+        period is either a number of seconds or a function returning the number of seconds,
+        evaluated each time the job fires so that the period may track state changes (eg, outage mode).
+        A period of None makes a one-shot job.
+        jitter is a fraction of the period, eg 0.05 fires each run up to +/-5% of the period off the
+        drift-free schedule.
+        """
+        with self.lock:
+            _job = job(name, func, period, jitter, inline)
+            if name in self.jobs:
+                _job.future = self.jobs[name].future
+            self.jobs[name] = _job
+            self._schedule(_job, time.monotonic() + delay, jitter=False)
+        self.wake.set()
+
+    def remove(self, name):
+        with self.lock:
+            self.jobs.pop(name, None)
+
+    def run_now(self, *names):
+        """Fire the named jobs as soon as possible, and restart their schedules from now.
+        """
+        with self.lock:
+            for name in names:
+                if name in self.jobs:
+                    self._schedule(self.jobs[name], time.monotonic(), jitter=False)
+        self.wake.set()
+
+    def reschedule(self, name, delay):
+        """Restart the named job's schedule, next due after delay seconds.
+        """
+        with self.lock:
+            if name in self.jobs:
+                self._schedule(self.jobs[name], time.monotonic() + delay)
+        self.wake.set()
+
+    def stop(self):
+        self.stop_flag = True
+        self.wake.set()
+
+    def busy(self):
+        """Return True if any non-inline job is running.
+        """
+        return any(_job.future and not _job.future.done() for _job in list(self.jobs.values()))
+
+    def wait_idle(self, timeout=None):
+        """Wait for running non-inline jobs to finish.  Returns False if timeout expires first.
+        """
+        end_time = time.monotonic() + timeout  if timeout is not None  else None
+        while self.busy():
+            if end_time is not None  and  time.monotonic() > end_time:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def _period(self, _job):
+        return _job.period()  if callable(_job.period)  else _job.period
+
+    def _schedule(self, _job, base_due, jitter=True):
+        _job.base_due = base_due
+        _job.due = base_due
+        if jitter  and  _job.jitter:
+            period = self._period(_job) or 0
+            _job.due += random.uniform(-_job.jitter, _job.jitter) * period
+        _job.version += 1
+        self.seq += 1
+        heapq.heappush(self.heap, (_job.due, self.seq, _job.version, _job))
+
+    def _next_due(self, _job, now):
+        """Advance the drift-free schedule past now, skipping any missed runs.
+        """
+        period = self._period(_job)
+        if period is None:
+            return None
+        period = max(period, 0.01)
+        next_due = _job.base_due + period
+        if next_due <= now:
+            next_due += math.ceil((now - next_due) / period) * period
+        return next_due
+
+    def run(self):
+        """Run jobs until stop() is called.
+        """
+        while not self.stop_flag:
+            with self.lock:
+                while self.heap  and  (self.heap[0][3].name not in self.jobs
+                        or  self.jobs[self.heap[0][3].name] is not self.heap[0][3]
+                        or  self.heap[0][2] != self.heap[0][3].version):
+                    heapq.heappop(self.heap)                        # Discard stale entries
+                now = time.monotonic()
+                due_job = None
+                if self.heap  and  self.heap[0][0] <= now:
+                    due_job = heapq.heappop(self.heap)[3]
+                    next_due = self._next_due(due_job, now)
+                    if next_due is None:
+                        del self.jobs[due_job.name]
+                    else:
+                        self._schedule(due_job, next_due)
+                sleep_time = self.heap[0][0] - now  if self.heap  else None
+                self.wake.clear()
+
+            if due_job is None:
+                self.wake.wait(sleep_time)
+                continue
+
+            if due_job.inline:
+                try:
+                    due_job.func()
+                except Exception as e:
+                    logging.error (f"Scheduled job <{due_job.name}> errored:  {repr(e)}")
+            elif due_job.future  and  not due_job.future.done():
+                logging.debug (f"Scheduled job <{due_job.name}> still running from prior run.  Skipped.")
+            else:
+                due_job.future = self.pool.submit(self._run_job, due_job)
+
+    def _run_job(self, _job):
+        try:
+            _job.func()
+        except Exception as e:
+            logging.error (f"Scheduled job <{_job.name}> errored:  {repr(e)}")
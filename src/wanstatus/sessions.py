@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""Persist device login sessions across config reloads and restarts.
+
+The cookies and current csrf token of each device's requests session are saved to a user-only
+readable (0600) JSON file, keyed by device name and login page.  A restored session is used as-is,
+and is only found to be stale when the device responds with its login-required text, at which point
+the normal login is done.
+"""
+
+import json
+import os
+import threading
+from pathlib import Path
+
+from cjnfuncs.core import logging
+
+
+class session_store:
+    """ Load and save device session states in the JSON file at path.
+
+    Also used for other small per-key states (eg, the WAN IP provider rate budgets), with what
+    naming the file in log messages.
+    """
+
+    def __init__(self, path, what="device session"):
+        self.path = Path(path)
+        self.what = what
+        self.lock = threading.Lock()
+
+    def _read(self):
+        try:
+            with self.path.open() as ifile:
+                return json.load(ifile)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logging.info (f"Ignoring unreadable {self.what} file <{self.path}>:  {e}")
+            return {}
+
+    def load(self, key):
+        """Return the saved state dict for key, or None.
+        """
+        with self.lock:
+            return self._read().get(key)
+
+    def save(self, key, state):
+        """Save (or with state None, remove) the state dict for key.  The file is replaced atomically.
+        """
+        with self.lock:
+            states = self._read()
+            if state is None:
+                states.pop(key, None)
+            else:
+                states[key] = state
+            tmp = self.path.with_name(self.path.name + ".tmp")
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+                with os.fdopen(fd, 'w') as ofile:
+                    json.dump(states, ofile)
+                os.chmod(tmp, 0o600)
+                os.replace(tmp, self.path)
+            except Exception as e:
+                logging.warning (f"Failed saving {self.what} file <{self.path}>:  {e}")
+
+
+def get_session_state(session, csrf=None):
+    """Return a JSON-able dict of the session's cookies and the csrf token.
+    """
+    cookies = [{"name": c.name, "value": c.value, "domain": c.domain, "path": c.path,
+                "secure": c.secure, "expires": c.expires} for c in session.cookies]
+    return {"cookies": cookies, "csrf": csrf}
+
+
+def set_session_state(session, state):
+    """Load the saved cookies into session.  Returns the saved csrf token, or None.
+    """
+    for c in state.get("cookies", []):
+        session.cookies.set(c["name"], c["value"], domain=c["domain"], path=c["path"], secure=c["secure"], expires=c["expires"])
+    return state.get("csrf")
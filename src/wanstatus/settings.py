@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""Read-only, pre-parsed snapshot of the wanstatus config.
+
+A config_snapshot is built once per config (re)load.  Time values are converted to seconds, address
+lists are split, and regular expressions are compiled, so that the checks do no repeated parsing.
+A new snapshot replaces the prior one by reference, so a check in progress keeps using the snapshot
+it started with.
+
+In fleet mode (the Sites param is defined) each site has its own snapshot, built from the site's
+[section] params with the top-level params as defaults.
+"""
+
+import re
+from pathlib import Path
+
+from cjnfuncs.timevalue import timevalue
+
+from .extract import group_names
+
+
+# Params that identify a site's devices.  In fleet mode these are not inherited from the top-level.
+SITE_ONLY_PARAMS = ('ModemStatusPage', 'RouterStatusPage', 'WANIPWebpage')
+
+def _getter(config, site):
+    """Return a getcfg-like function for the site's section, with the top-level params as defaults.
+    """
+    if not site:
+        return config.getcfg
+    if site not in config.sections():
+        raise ValueError(f"Site <{site}> has no [{site}] section in the config")
+    section = config.cfg[site]
+    def get(param, fallback='_nofallback'):
+        if param in section:
+            return section[param]
+        if param in SITE_ONLY_PARAMS:
+            return None  if fallback == '_nofallback'  else fallback
+        return config.getcfg(param, fallback)
+    return get
+
+
+def _named_RE(value, param):
+    """Compile a multi-field extraction RE param value, or return None if not defined.
+    The RE must have named groups (?P<name>...).
+    """
+    if not value:
+        return None
+    RE = re.compile(value, re.DOTALL)
+    if not RE.groupindex:
+        raise ValueError(f"{param} <{value}> has no named groups")
+    return RE
+
+
+def _k_of_n(value):
+    """Parse a 'k/n' param value, eg '2/3', to a (k, n) tuple.
+    """
+    k, _, n = str(value).partition('/')
+    k, n = int(k), int(n or k)
+    if not 1 <= k <= n:
+        raise ValueError(f"<{value}> is not a valid k/n value")
+    return k, n
+
+
+def _rate(value):
+    """Parse an 'n/period' rate param value, eg '6/1h', to an (n, period seconds) tuple.
+    None (or 'None') for no rate limit is returned as None.
+    """
+    if value is None  or  str(value).lower() == 'none':
+        return None
+    n, _, period = str(value).partition('/')
+    n, seconds = int(n), timevalue(period or '1h').seconds
+    if n < 1  or  seconds <= 0:
+        raise ValueError(f"<{value}> is not a valid n/period rate")
+    return n, seconds
+
+
+def _wanip_providers(webpage, default_RE, default_rate):
+    """Return a tuple of (url, compiled RE, rate) for each WANIPWebpage provider.
+    webpage is a URL, a whitespace separated list of URLs (each using default_RE), or a dict of
+    URL: RE, or of URL: {'RE': RE, 'rate': 'n/period'}, with either key optional.
+    """
+    if not webpage:
+        return ()
+    if not isinstance(webpage, dict):
+        webpage = {url: None for url in str(webpage).split()}
+    providers = []
+    for url, spec in webpage.items():
+        spec = spec  if isinstance(spec, dict)  else {'RE': spec}
+        providers.append((url, re.compile(spec.get('RE') or default_RE), _rate(spec['rate'])  if spec.get('rate')  else default_rate))
+    return tuple(providers)
+
+
+class _frozen:
+    """ Attributes may only be set in __init__, before _freeze() is called.
+    """
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError(f"{type(self).__name__} is read-only")
+        super().__setattr__(name, value)
+
+    def _freeze(self):
+        self._frozen = True
+
+    def __eq__(self, other):
+        return type(self) is type(other)  and  self.__dict__ == other.__dict__
+
+    def __hash__(self):
+        return id(self)
+
+
+class device_settings(_frozen):
+    """ Params for one device ('Modem' or 'Router').  See the device class for the config params.
+    """
+    def __init__(self, config, device_name, site=''):
+        get = _getter(config, site)
+        self.device_name           = device_name
+        self.status_page           = get(device_name + "StatusPage", "")
+        self.status_RE             = re.compile(get(device_name + "StatusRE", ""), re.DOTALL)
+        self.login_page            = get(device_name + "LoginPage", None)
+        self.login_required_text   = get(device_name + "LoginRequiredText", "nosuchtext")
+        self.login_username_field  = get(device_name + "LoginUsernameField", False)
+        self.login_username        = get(device_name + "_USER", "")
+        self.login_password_field  = get(device_name + "LoginPasswordField", "")
+        self.login_password        = get(device_name + "_PASS", "")
+        self.login_additional_keys = get(device_name + "LoginAdditionalKeys", "")
+        self.csrf_RE               = re.compile(get(device_name + "CsrfRE", ""))
+        self.fields_RE             = _named_RE(get(device_name + "FieldsRE", None), device_name + "FieldsRE")
+        self.row_RE                = _named_RE(get(device_name + "RowRE", None), device_name + "RowRE")
+        self.row_key               = get(device_name + "RowKey", None)
+        if self.row_RE:
+            self.row_key = self.row_key or group_names(self.row_RE)[0]
+            if self.row_key not in self.row_RE.groupindex:
+                raise ValueError(f"{device_name}RowKey <{self.row_key}> is not a {device_name}RowRE group")
+        self.timeout               = timevalue(get(device_name + "Timeout", 1)).seconds
+        self.hedge                 = bool(get(device_name + "Hedge", True))
+        self.scan_window           = int(get(device_name + "ScanWindow", 65536))
+        self.max_page_size         = int(get(device_name + "MaxPageSize", 4194304))
+        self._freeze()
+
+
+class config_snapshot(_frozen):
+    """ Pre-parsed config params used by the checks.
+
+    Time value params are in seconds.  Address lists are tuples.  RE params are compiled.
+    Device params are device_settings instances, or None if the device's xxxStatusPage is not defined.
+
+    site is the fleet mode site name, or '' for the top-level snapshot.  sites holds the per-site
+    snapshots of the top-level snapshot.  In fleet mode a site's WANIPFile defaults to the top-level
+    WANIPFile name with _<site> added, eg WANIP_site1.txt.
+    """
+    def __init__(self, config, site=''):
+        get = _getter(config, site)
+        seconds = lambda param, fallback='_nofallback': timevalue(get(param, fallback)).seconds
+
+        self.nRetries =                 int(get('nRetries'))
+        self.StatusRecheckPeriod =      seconds('StatusRecheckPeriod')
+        self.OutageRecheckPeriod =      seconds('OutageRecheckPeriod')
+        self.RecoveryDelay =            seconds('RecoveryDelay')
+        self.RecoveryDelay_str =        str(get('RecoveryDelay'))
+        self.OutageConfirm =            _k_of_n(get('OutageConfirm', '2/3'))
+        self.RecoveryConfirm =          _k_of_n(get('RecoveryConfirm', '2/3'))
+        self.OutageBackoff =            float(get('OutageBackoff', 1.5))
+        self.OutageMaxRecheckPeriod =   max(self.OutageRecheckPeriod, seconds('OutageMaxRecheckPeriod', '1m'))
+        self.DegradedRecheckPeriod =    seconds('DegradedRecheckPeriod', '30s')
+        self.DegradedRTTFactor =        float(get('DegradedRTTFactor', 2.0))
+        self.ExternalWANRecheckPeriod = seconds('ExternalWANRecheckPeriod')
+        self.ConfigRecheckPeriod =      seconds('ConfigRecheckPeriod', '10s')
+        self.ConfigWatchMode =          str(get('ConfigWatchMode', 'inotify')).lower()
+        self.RecheckJitter =            float(get('RecheckJitter', 0.05))
+        self.CycleDeadline =            seconds('CycleDeadline', '1m')
+        self.CycleDeadline_str =        str(get('CycleDeadline', '1m'))
+
+        self.IACheckMethod =            str(get('IACheckMethod', 'none'))
+        self.IAPingAddrs =              tuple(str(get('IAPingAddrs', '')).split())
+        self.IAPingMaxTime =            float(get('IAPingMaxTime', 200))
+        self.IAPingTimeout =            seconds('IAPingTimeout', 5)
+        self.IAPingEngine =             str(get('IAPingEngine', 'native')).lower()
+        self.IADNSAddrs =               tuple(str(get('IADNSAddrs', '')).split())
+        self.IADNSTimeout =             seconds('IADNSTimeout', 3)
+        self.IADNSQueryName =           str(get('IADNSQueryName', 'www.google.com'))
+        self.IAConcurrent =             bool(get('IAConcurrent', False))
+        self.IADeadline =               seconds('IADeadline')  if get('IADeadline', None) is not None  else None
+
+        self.WANIPFile =                get('WANIPFile', None)
+        if site  and  self.WANIPFile  and  'WANIPFile' not in config.cfg[site]:
+            _path = Path(self.WANIPFile)
+            self.WANIPFile =            str(_path.with_name(f"{_path.stem}_{site}{_path.suffix}"))
+        self.DeviceSessionFile =        get('DeviceSessionFile', 'device_sessions.json')
+        self.LatencyStoreFile =         get('LatencyStoreFile', 'latency.dat')
+        self.LatencyRetention =         seconds('LatencyRetention', '30d')
+        self.LatencyMaxSize =           int(get('LatencyMaxSize', 16777216))
+        self.EventStoreFile =           get('EventStoreFile', 'events.db')
+        self.WANIPBudgetFile =          get('WANIPBudgetFile', 'wanip_budgets.json')
+        self.Modem =                    device_settings(config, 'Modem', site)   if get('ModemStatusPage', False)   else None
+        self.Router =                   device_settings(config, 'Router', site)  if get('RouterStatusPage', False)  else None
+        self.devices =                  {'Modem': self.Modem, 'Router': self.Router}
+
+        self.WANIPWebpage =             get('WANIPWebpage', None)
+        self.WANIPWebpageTimeout =      seconds('WANIPWebpageTimeout', 5)
+        self.WANIPProviderRate =        _rate(get('WANIPProviderRate', None))
+        self.WANIPProviders =           _wanip_providers(self.WANIPWebpage, get('WANIPWebpageRE', ''), self.WANIPProviderRate)
+        self.WANIPQuorum =              max(1, min(int(get('WANIPQuorum', 2)), len(self.WANIPProviders)))
+
+        self.NotifList =                config.getcfg('NotifList', False, section='SMTP')  if 'SMTP' in config.sections()  else False
+        self.EmailTo =                  config.getcfg('EmailTo', False, section='SMTP')    if 'SMTP' in config.sections()  else False
+        self.NotifQueueFile =           get('NotifQueueFile', 'notif_queue.json')
+        self.NotifCoalesceWindow =      seconds('NotifCoalesceWindow', '10s')
+        self.NotifQueueMax =            int(get('NotifQueueMax', 100))
+        self.NotifRetryBackoff =        seconds('NotifRetryBackoff', '30s')
+        self.NotifMaxBackoff =          seconds('NotifMaxBackoff', '30m')
+
+        self.site =                     site
+        self.MaxConcurrentChecks =      int(get('MaxConcurrentChecks', 6))
+        self.MetricsPort =              get('MetricsPort', None)
+        self.MetricsAddress =           str(get('MetricsAddress', '127.0.0.1'))
+        self.ControlSocket =            get('ControlSocket', 'wanstatus.sock')
+        self.Sites =                    tuple(str(get('Sites', '')).split())  if not site  else ()
+        self.sites =                    {name: config_snapshot(config, name) for name in self.Sites}
+        self._freeze()
+
+    def site_list(self):
+        """Return a list of (site name, snapshot).  Not in fleet mode, a single unnamed site using this snapshot.
+        """
+        return list(self.sites.items())  or  [('', self)]
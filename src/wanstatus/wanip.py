@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""External WAN IP check against multiple providers.
+
+A provider is a web page that returns the caller's IP address, plus the RE that extracts it.  A
+provider may have a token bucket rate budget, so that it is never queried more often than allowed,
+however often the check is run.  The budgets and the last accepted result may be saved to a
+session_store, so that they carry over between runs (eg, interactive mode runs from cron).  Providers are queried concurrently over one pooled requests session (so
+connections are kept alive and reused across checks).  A check starts only as many queries as are
+needed to reach the quorum, rotating the starting provider on each check, and queries more providers
+only when some fail or disagree.  The result is accepted as soon as quorum providers agree.
+If no provider has budget left then the last accepted result is returned with status None (cached,
+not confirmed by any provider), and a warning is logged.
+"""
+
+import concurrent.futures
+import threading
+import time
+
+import requests
+
+from cjnfuncs.core import logging
+
+from .workers import daemon_pool
+
+
+class token_bucket:
+    """ Allow up to capacity takes at once, refilled continuously at capacity per period seconds.
+    """
+
+    def __init__(self, capacity, period):
+        self.capacity = capacity
+        self.period = period
+        self.tokens = float(capacity)
+        self.time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.time) * self.capacity / self.period)
+        self.time = now
+
+    def take(self):
+        """Take a token if available.  Returns True if taken.
+        """
+        with self.lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def drain(self):
+        """Empty the bucket, eg when the provider asks us to slow down (HTTP 429).
+        """
+        with self.lock:
+            self._refill()
+            self.tokens = 0.0
+
+    def wait_time(self):
+        """Return the seconds until a token is available.
+        """
+        with self.lock:
+            self._refill()
+            return max(0, (1 - self.tokens) * self.period / self.capacity)
+
+    def get_state(self):
+        """Return the JSON-able bucket state, with a wall clock time so that it can be restored in
+        another process.
+        """
+        with self.lock:
+            self._refill()
+            return {"tokens": self.tokens, "time": time.time()}
+
+    def set_state(self, state):
+        """Restore a get_state() state, refilled for the time since it was saved.
+        """
+        with self.lock:
+            elapsed = max(0, time.time() - state["time"])
+            self.tokens = min(self.capacity, state["tokens"] + elapsed * self.capacity / self.period)
+            self.time = time.monotonic()
+
+
+class _provider:
+    def __init__(self, url, RE, rate, bucket):
+        self.url = url
+        self.RE = RE
+        self.rate = rate
+        self.bucket = bucket
+
+
+class wanip_checker:
+    """ Query the WAN IP providers, a tuple of (url, compiled RE, (capacity, period seconds) or None
+    for no rate limit).
+
+    prior is the checker being replaced (eg on a config reload), or None.  Its provider token buckets
+    and last result are kept, so that rebuilding the checker does not reset the rate budgets.
+    store is a session_store (or None) to which the buckets and last result are saved under key (the
+    fleet mode site, '' if not in fleet mode) after each check, and from which they are restored if
+    there is no prior.
+    """
+
+    def __init__(self, providers, prior=None, store=None, key=''):
+        self.spec = providers
+        self.store = store
+        self.key = key
+        saved = (store.load(key)  if store  and  not prior  else None)  or  {}
+        self.buckets = {}                       # (url, rate): token_bucket
+        self.providers = []
+        for url, RE, rate in providers:
+            bucket = None
+            if rate:
+                bucket = prior.buckets.get((url, rate))  if prior  else None
+                if bucket is None:
+                    bucket = token_bucket(*rate)
+                    state = saved.get("buckets", {}).get(url)
+                    if state  and  tuple(state["rate"]) == rate:
+                        bucket.set_state(state)
+                self.buckets[(url, rate)] = bucket
+            self.providers.append(_provider(url, RE, rate, bucket))
+        self.next = 0
+        self.cached_age = None                  # Age (s) of the cached WANIP returned by the last check, else None
+        self.last = prior.last  if prior  else tuple(saved["last"])  if saved.get("last")  else None    # (time.time(), WANIP) of the last accepted result
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=max(1, len(providers)), pool_maxsize=2)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.pool = daemon_pool(min(len(providers), 8), thread_name_prefix="wanip")
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+
+    def save(self):
+        """Save the bucket states and the last result to the store, if any.
+        """
+        if not self.store:
+            return
+        buckets = {url: {"rate": rate, **bucket.get_state()} for (url, rate), bucket in self.buckets.items()}
+        self.store.save(self.key, {"buckets": buckets, "last": self.last})
+
+    def _query(self, provider, timeout):
+        """Returns True, the WAN IP and the response time (ms), or False, the error message and None.
+        """
+        start_time = time.perf_counter()
+        try:
+            web_page = self.session.get(provider.url, timeout=timeout)
+            cmd_time = (time.perf_counter() - start_time) * 1000
+            if web_page.status_code == 429  and  provider.bucket:
+                provider.bucket.drain()
+                return False, "Rate limited by the provider (HTTP 429)", None
+            out = provider.RE.search(web_page.text)
+            if out:
+                return True, out.group(1), cmd_time
+            return False, f"Invalid web page response (HTTP {web_page.status_code})", None
+        except Exception as e:
+            return False, "Errored:  " + repr(e), None
+
+    def check(self, quorum, tries, timeout):
+        """Get the WAN IP from the providers.  quorum providers must agree.  Each provider is tried up
+        to tries times (budget permitting), with timeout seconds per try.
+
+        Returns status, WANIP ('' on failure), a message, and a list of (url, response time ms or
+        None, ok) for each query made.  status is True, False, or None if no provider had budget left
+        and the WANIP is the last accepted result.  cached_age is then set to its age in seconds,
+        else it is None.
+        """
+        try:
+            return self._check(quorum, tries, timeout)
+        finally:
+            self.save()
+
+    def _check(self, quorum, tries, timeout):
+        start_time = time.perf_counter()
+        self.cached_age = None
+        order = self.providers[self.next:] + self.providers[:self.next]
+        self.next = (self.next + 1) % max(1, len(self.providers))
+        candidates = [provider for _ in range(tries) for provider in order]
+        votes = {}                              # WANIP: set of agreeing provider urls
+        answered = set()
+        fails = []
+        queries = []
+        pending = {}
+
+        def launch():
+            while candidates:
+                provider = candidates.pop(0)
+                if provider.url not in answered  and  (provider.bucket is None  or  provider.bucket.take()):
+                    pending[self.pool.submit(self._query, provider, timeout)] = provider
+                    return True
+            return False
+
+        best = lambda: max((len(urls) for urls in votes.values()), default=0)
+        while best() + len(pending) < quorum  and  launch():
+            pass
+        if not pending:
+            wait = min((provider.bucket.wait_time() for provider in self.providers if provider.bucket), default=0)
+            if self.last:
+                self.cached_age = time.time() - self.last[0]
+                logging.warning (f"{self.key + ': '  if self.key  else ''}WANIP provider rate budgets are used up for {wait:.0f}s.  Reporting the WANIP cached {self.cached_age:.0f}s ago.")
+                return None, self.last[1], f"(cached {self.cached_age:.0f}s ago, provider rate budgets used up for {wait:.0f}s)", queries
+            return False, "", f"All WANIP provider rate budgets are used up.  Next available in {wait:.0f}s.", queries
+
+        deadline = time.monotonic() + timeout * (tries + 1)
+        while pending:
+            done, _ = concurrent.futures.wait(pending, timeout=max(0, deadline - time.monotonic()), return_when=concurrent.futures.FIRST_COMPLETED)
+            if not done:
+                fails.append("Deadline reached")
+                break
+            for future in done:
+                provider = pending.pop(future)
+                ok, value, cmd_time = future.result()
+                queries.append((provider.url, cmd_time, ok))
+                if ok:
+                    answered.add(provider.url)
+                    votes.setdefault(value, set()).add(provider.url)
+                else:
+                    fails.append(f"<{provider.url}> {value}")
+            for WANIP, urls in votes.items():
+                if len(urls) >= quorum:
+                    self.last = (time.time(), WANIP)
+                    msg = f"(command run time {(time.perf_counter() - start_time) * 1000:6.1f} ms"
+                    if len(self.providers) > 1:
+                        msg += f", {len(urls)} of {len(queries)} providers agree"
+                    return True, WANIP, msg + ")", queries
+            while best() + len(pending) < quorum  and  launch():
+                pass
+
+        if len(votes) > 1:
+            fails.append("Providers disagree:  " + ",  ".join(f"{WANIP} ({len(urls)})" for WANIP, urls in votes.items()))
+        elif votes:
+            fails.append(f"No quorum:  {best()} of {quorum} providers needed agree (others failed or out of rate budget)")
+        return False, "", "\n  ".join(fails), queries
@@ -3,6 +3,10 @@
 on WAN IP change.
 """
 
+# Startup time matters for one-shot runs from scripts (-V, --print-log, interactive mode), so modules
+# that only some code paths or configs need (requests, SMTP, the probe engines, the service mode
+# modules) are imported where first used, not here.  See benchmarks/importtime.py.
+
 #==========================================================
 #
 #  Chris Nelson, 2020 - 2023
@@ -10,35 +14,52 @@ on WAN IP change.
 #==========================================================
 
 import argparse
+import os
 import sys
 import datetime
 import time
-import requests
-import subprocess
 import socket
 import re
 import signal
-import collections
-import platform
-
-try:
-    import importlib.metadata
-    __version__ = importlib.metadata.version(__package__ or __name__)
-except:
-    try:
-        import importlib_metadata
-        __version__ = importlib_metadata.version(__package__ or __name__)
-    except:
-        __version__ = "3.1 X"
+import threading
+import concurrent.futures
 
 from cjnfuncs.core import logging, set_toolname
 from cjnfuncs.mungePath import mungePath
-from cjnfuncs.SMTP import snd_email, snd_notif
-from cjnfuncs.deployfiles import deploy_files
-from cjnfuncs.timevalue import timevalue
 from cjnfuncs.configman import config_item
+from cjnfuncs.timevalue import timevalue
 import cjnfuncs.core as core
 
+from .probectl import probe_controller
+from .settings import config_snapshot
+from .extract import page_scanner
+from .sessions import session_store, get_session_state, set_session_state
+from .latency import latency_store, rtt_window
+
+
+_version = None
+
+def get_version():
+    """Return the installed package version.  Looked up on first use, as importlib.metadata is slow to load.
+    """
+    global _version
+    if _version is None:
+        try:
+            import importlib.metadata
+            _version = importlib.metadata.version(__package__ or __name__)
+        except:
+            try:
+                import importlib_metadata
+                _version = importlib_metadata.version(__package__ or __name__)
+            except:
+                _version = "3.1 X"
+    return _version
+
+def __getattr__(name):
+    if name == "__version__":
+        return get_version()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 # Configs / Constants
 TOOLNAME        = "wanstatus"
@@ -49,262 +70,1096 @@ PRINTLOGLENGTH  = 40
 # ^^FIELD_WIDTH1                 ^^FIELD_WIDTH2
 FIELD_WIDTH1    = 28
 FIELD_WIDTH2    = 16
+RTT_SEED_WINDOW = 86400                 # Device response times are seeded from the latency store over this many seconds
+
+cfg = None                              # Current config_snapshot
+sessions = None                         # session_store for device logins, or None
+wanip_budgets = None                    # session_store for the WANIP provider rate budgets, or None
+latencies = None                        # latency_store for probe results, or None
+latency_access = 'append'               # latencies access:  'read' (--stats), 'append' (interactive) or 'trim' (service)
+events = None                           # event_store for outage, WAN IP and modem state history, or None
+interactive_devices = []                # Interactive mode device instances
+monitors = {}                           # Service mode wan_monitor per site
+sched = watcher = None                  # Service mode scheduler and config watcher
+metrics = exporter = None               # Service mode metrics_registry and metrics_server, if enabled
+notices = None                          # Service mode notifier
+control_socket = None                   # Service mode control_server, if enabled
+service_start = None                    # Service mode start time
+results_updated = threading.Condition() # Guards wan_monitor.results.  Notified on each new result.
 
 
 def main():
-    global modem_status, router_status
     logging.getLogger().setLevel(20)    # Force info level logging for interactive usage
 
-    SavedWANIP = ""
+    # Check internet access, modem status, router reported WANIP and external web page WANIP,
+    # for all sites in parallel
+    checks = {}
+    devices = {}
+    for site, snap in cfg.site_list():
+        label = site_label(site)
+        checks[label + "Internet"] = lambda snap=snap: have_internet(snap)
+        for device_name in ("Modem", "Router"):
+            if snap.devices[device_name]:
+                _device = device(device_name, snap)
+                interactive_devices.append(_device)
+                devices[label + device_name] = _device
+                checks[label + device_name] = _device.get_data
+        if snap.WANIPWebpage:
+            checks[label + "External"] = lambda snap=snap: get_external_WANIP(snap)
+    results = run_checks(checks)
+
+    for site, snap in cfg.site_list():
+        label = site_label(site)
+        SavedWANIP = ""
+        try:
+            WANfile = mungePath (snap.WANIPFile, core.tool.data_dir).full_path
+            with WANfile.open() as ifile:
+                SavedWANIP = ifile.read()
+        except Exception as e:
+            pass
+
+        # WANfile = mungePath (config.getcfg("WANIPFile"), core.tool.data_dir, set_attributes=True)
+        # if WANfile.is_file:
+        #     with WANfile.full_path.open() as ifile:
+        #         SavedWANIP = ifile.read()
+
+        status, msg = results[label + "Internet"]
+        if status:
+            logging.info   (f"{label}{'Internet access:':{FIELD_WIDTH1}} {'Working':{FIELD_WIDTH2}} {msg}")
+        else:
+            logging.warning(f"{label}{'Internet access:':{FIELD_WIDTH1}} {'NONE':{FIELD_WIDTH2}} {msg}")
+
+        if label + "Modem" in results:
+            log_modem_status(*results[label + "Modem"], label=label)
+            log_record(devices[label + "Modem"].record, "Modem", label=label)
+
+        if label + "Router" in results:
+            status, WANIP, msg = results[label + "Router"]
+            if status:
+                logging.info     (f"{label}{'Router reported WANIP:':{FIELD_WIDTH1}} {WANIP:{FIELD_WIDTH2}} {msg}")
+                if WANIP != SavedWANIP:
+                    logging.info (f"{label}{'Prior stored WANIP:':{FIELD_WIDTH1}} {SavedWANIP:{FIELD_WIDTH2}}")
+            else:
+                logging.warning(f"{label}Failed getting WANIP address from router:\n{msg}")
+            log_record(devices[label + "Router"].record, "Router", label=label)
+
+        if label + "External" in results:
+            log_external_WANIP(*results[label + "External"], label=label)
+            status, ext_WANIP, _ = results[label + "External"]
+            if status  and  label + "Router" in results  and  results[label + "Router"][0]  and  results[label + "Router"][1] != ext_WANIP:
+                logging.warning (f"{label}Router reported WANIP <{results[label + 'Router'][1]}> differs from the externally reported WANIP <{ext_WANIP}>")
+
+
+def site_label(site):
+    """Log message and check name prefix for a fleet mode site, or '' when not in fleet mode.
+    """
+    return f"{site}: "  if site  else ""
+
+
+def service():
+    global sched, service_start
+    from .scheduler import scheduler
+
+    service_start = time.time()
+    sched = scheduler(get_check_pool())
+    set_event_store()
+    set_watcher()
+    set_exporter()
+    set_notifier()
+    update_monitors()
+    set_control()
+    sched.add("config", check_config, config_period(), inline=True, delay=config_period())
+    sched.run()
+
+
+def update_monitors():
+    """Create, update or remove the per-site wan_monitors to match the current config, and (re)start
+    their scheduled checks.
+    """
+    sites = dict(cfg.site_list())
+    for site in list(monitors):
+        if site not in sites:
+            logging.warning(f"{site_label(site)}Site removed from the config.  Monitoring stopped.")
+            monitors.pop(site).close()
+    for site, snap in sites.items():
+        if site in monitors:
+            monitors[site].load_state(snap)
+        else:
+            monitors[site] = wan_monitor(site, snap)
+        monitors[site].add_jobs()
+
+
+def set_exporter():
+    """Start, restart or stop the metrics exporter per the current config.
+    Config params:
+        MetricsPort (default None, disabled)
+            Port for the Prometheus metrics exporter (http://MetricsAddress:MetricsPort/metrics).
+        MetricsAddress (default 127.0.0.1)
+            Listen address for the metrics exporter.  Use 0.0.0.0 to listen on all interfaces.
+    Metrics are only collected in service mode.
+    """
+    global metrics, exporter
+    if exporter  and  (exporter.address, exporter.port) != (cfg.MetricsAddress, cfg.MetricsPort):
+        exporter.close()
+        exporter = None
+    if cfg.MetricsPort  and  not exporter:
+        from .metrics import metrics_registry, metrics_server
+        if not metrics:
+            metrics = metrics_registry()
+            metrics.describe("wanstatus_internet_up", "gauge", "1 if the last internet access check succeeded, else 0.")
+            metrics.describe("wanstatus_probe_up", "gauge", "1 if the last probe of the target succeeded, else 0.  External WANIP providers not queried (rate budgets used up) keep their prior value.")
+            metrics.describe("wanstatus_wanip_cached_seconds", "gauge", "Age of the cached WAN IP reported by the last external check when no provider had rate budget left, else 0.")
+            metrics.describe("wanstatus_probe_latency_seconds", "histogram", "Successful probe latency (DNS connect, ping, or device/external page fetch).")
+            metrics.describe("wanstatus_wanip_info", "gauge", "Current router reported WAN IP address.")
+            metrics.describe("wanstatus_modem_state_info", "gauge", "Current modem status.")
+            metrics.describe("wanstatus_outages_total", "counter", "Internet access outages started.")
+            metrics.describe("wanstatus_outage_seconds_total", "counter", "Cumulative time of ended outages.")
+            metrics.describe("wanstatus_outage_start_timestamp_seconds", "gauge", "Start time of the current outage, or 0.")
+            metrics.describe("wanstatus_flaps_total", "counter", "Internet access losses during the recovery delay, counted as part of the ongoing outage.")
+            metrics.describe("wanstatus_device_field", "gauge", "Numeric xxxFieldsRE values from the device status page.")
+            metrics.describe("wanstatus_device_row_field", "gauge", "Numeric xxxRowRE values per row (eg, per channel) from the device status page.")
+            metrics.describe("wanstatus_process_open_fds", "gauge", "Open file descriptors.", volatile=True)
+            metrics.describe("wanstatus_process_sockets", "gauge", "Open sockets.", volatile=True)
+            metrics.describe("wanstatus_process_threads", "gauge", "Live Python threads.", volatile=True)
+            metrics.describe("wanstatus_process_resident_memory_bytes", "gauge", "Resident set size.", volatile=True)
+            metrics.add_collector(metric_resources)
+        try:
+            exporter = metrics_server(metrics, cfg.MetricsAddress, int(cfg.MetricsPort))
+        except Exception as e:
+            logging.error (f"Failed starting the metrics exporter on <{cfg.MetricsAddress}:{cfg.MetricsPort}>:  {e}")
+
+
+def set_notifier():
+    """Start the background notifier, or update its settings per the current config.
+    Config params:
+        NotifQueueFile (default notif_queue.json)
+            Unsent notices are kept here across restarts.  Absolute path, or relative to the data dir.
+        NotifCoalesceWindow (default 10s)
+            Notices within this time of the first are sent as one message.
+        NotifQueueMax (default 100)
+            Max unsent notices.  The oldest are dropped when full.
+        NotifRetryBackoff (default 30s), NotifMaxBackoff (default 30m)
+            First and max wait between send retries.  The wait doubles on each failure.
+    """
+    global notices
+    from .notify import notifier
+    path = mungePath(cfg.NotifQueueFile, core.tool.data_dir).full_path  if cfg.NotifQueueFile  else None
+    if notices  and  notices.path != path:
+        notices.close()
+        notices = None
+    if not notices:
+        notices = notifier(path, config, cfg.NotifCoalesceWindow, cfg.NotifQueueMax, cfg.NotifRetryBackoff, cfg.NotifMaxBackoff)
+    else:
+        notices.window, notices.max_queue = cfg.NotifCoalesceWindow, cfg.NotifQueueMax
+        notices.backoff, notices.max_backoff = cfg.NotifRetryBackoff, cfg.NotifMaxBackoff
 
+
+def set_control():
+    """Start, restart or stop the control socket per the current config.
+    Config params:
+        ControlSocket (default wanstatus.sock)
+            Unix domain socket where the service answers status requests and probe and reload
+            commands, eg from interactive wanstatus runs.  Absolute path, or relative to the data dir.
+            None to disable.
+    """
+    global control_socket
+    path = mungePath(cfg.ControlSocket, core.tool.data_dir).full_path  if cfg.ControlSocket  else None
+    if control_socket  and  control_socket.path != path:
+        control_socket.close()
+        control_socket = None
+    if path is not None  and  not control_socket:
+        if not hasattr(socket, "AF_UNIX"):
+            logging.warning ("ControlSocket is not supported on this platform")
+            return
+        from .control import control_server
+        try:
+            control_socket = control_server(path, control_command)
+        except Exception as e:
+            logging.error (f"Failed starting the control socket <{path}>:  {e}")
+
+
+def control_command(request):
+    """Handle a control socket request (called from the control socket's connection threads).
+    Commands:
+        status      Return the latest results of each site's checks.  See service_status().
+        probe       Run all of the checks now, and wait (up to the CycleDeadline) for the results.
+                    Returns the status, with ok false if any check did not finish in time.
+        reload      Reload the config file, whether changed or not.
+        resources   Return the process resource usage (see resources.resource_usage()) and the number
+                    of internet access checks run, for spotting leaks over time.
+    """
+    command = request.get("command")
+    if command == "status":
+        return {"ok": True, **service_status()}
+
+    if command == "probe":
+        start_time = time.time()
+        pending = []
+        for _monitor in list(monitors.values()):
+            pending += [(_monitor, name) for name in _monitor.probe()]
+        done = lambda: all(_monitor.checked(name, start_time) for _monitor, name in pending)
+        with results_updated:
+            finished = results_updated.wait_for(done, cfg.CycleDeadline)
+        response = {"ok": finished, **service_status()}
+        if not finished:
+            response["error"] = f"Not all checks finished within the <{cfg.CycleDeadline_str}> CycleDeadline"
+        return response
+
+    if command == "reload":
+        reloaded = threading.Event()
+        outcome = []
+        def reload():
+            outcome.append(check_config(force=True))
+            reloaded.set()
+        sched.add("reload", reload, None, inline=True)      # Run in the scheduler thread, like the config check
+        if not reloaded.wait(cfg.CycleDeadline):
+            return {"ok": False, "error": "Timed out waiting for the reload"}
+        if not outcome[0]:
+            return {"ok": False, "error": "Config file reload failed.  Continuing with the prior config.  See the log."}
+        return {"ok": True, "config_file": str(config.config_full_path)}
+
+    if command == "resources":
+        from .resources import resource_usage
+        return {"ok": True, "pid": os.getpid(), "started": service_start,
+                "checks": sum(_monitor.checks for _monitor in list(monitors.values())), **resource_usage()}
+
+    return {"ok": False, "error": f"Unknown command <{command}>"}
+
+
+def service_status():
+    """Return the service info and the per-site state and latest check results, as a JSON-able dict.
+    See wan_monitor.status().
+    """
+    return {"version":     get_version(),
+            "pid":         os.getpid(),
+            "started":     service_start,
+            "config_file": str(config.config_full_path),
+            "sites":       [_monitor.status() for _monitor in list(monitors.values())]}
+
+
+def metric(method, name, labels, *args):
+    """Call metrics_registry method (set, inc, observe or set_info) if metrics are enabled.
+    """
+    if metrics:
+        getattr(metrics, method)(name, labels, *args)
+
+
+def metric_resources():
+    """Set the process resource usage metrics.  Called on each metrics scrape.
+    """
+    from .resources import resource_usage
+    usage = resource_usage()
+    for name, key in (("wanstatus_process_open_fds", "fds"), ("wanstatus_process_sockets", "sockets"),
+                      ("wanstatus_process_threads", "threads"), ("wanstatus_process_resident_memory_bytes", "rss_bytes")):
+        if usage[key] is not None:
+            metrics.set(name, {}, usage[key])
+
+
+def metric_record(site, _device):
+    """Set the device record's numeric field and row values as metrics, replacing the prior values
+    (so rows no longer reported are dropped).
+    """
+    record = _device.record
+    if not metrics  or  not record:
+        return
+    labels = {"site": site, "device": _device.device_name}
+    number = lambda value: isinstance(value, (int, float))
+    metric("replace", "wanstatus_device_field", labels,
+           [({"field": name}, value) for name, value in record["fields"].items() if number(value)])
+    series = []
+    if record["columns"]:
+        key = record["columns"].index(record["key"])
+        for row in record["rows"]:
+            series += [({"row": str(row[key]), "field": column}, value)
+                       for column, value in zip(record["columns"], row) if column != record["key"]  and  number(value)]
+    metric("replace", "wanstatus_device_row_field", labels, series)
+
+
+def set_watcher():
+    """Start the config file watcher, restart it if the ConfigWatchMode changed, or else re-arm it for
+    the current config file and imports.  Call after each successful config (re)load.
+    See wan_monitor for ConfigWatchMode.
+    """
+    global watcher
+    from .cfgwatch import config_watcher
+    if watcher  and  watcher.mode != cfg.ConfigWatchMode:
+        watcher.close()
+        watcher = None
+    if not watcher:
+        watcher = config_watcher(config.config_full_path, cfg.ConfigWatchMode, callback=lambda: sched.run_now("config"))
+    else:
+        watcher.mark_loaded()
+
+
+def config_period():
+    return cfg.ConfigRecheckPeriod  if watcher.inotify is None  else max(cfg.ConfigRecheckPeriod, 3600)
+
+
+def check_config(force=False):
+    """Reload the config file if it has changed, or if force.
+    Returns True if reloaded, False if the reload failed, or None if not changed.
+    """
+    global cfg
+    if not watcher.changed()  and  not force:
+        return None
     try:
-        WANfile = mungePath (config.getcfg("WANIPFile"), core.tool.data_dir).full_path
-        with WANfile.open() as ifile:
-            SavedWANIP = ifile.read()
+        config.loadconfig(force_reload=True, flush_on_reload=True, call_logfile_wins=logfile_override)
+        new_cfg = config_snapshot(config)
     except Exception as e:
-        pass
+        logging.error(f"Config file reload failed.  Continuing with the prior config.\n  {e}")
+        watcher.mark_loaded()       # Don't retry until changed again
+        return False
+    cfg = new_cfg
+    set_stores()
+    set_event_store()
+    set_watcher()
+    logging.warning(f"NOTE - The config file has been reloaded.")
+    set_exporter()
+    set_notifier()
+    update_monitors()               # Restart all checks with the new periods
+    set_control()
+    sched.add("config", check_config, config_period(), inline=True, delay=config_period())
+    return True
+
+
+class wan_monitor:
+    """ Service mode state and scheduled jobs for one site.
+
+    site is the fleet mode site name, or '' when not in fleet mode.  snap is the site's config_snapshot.
+    The site's scheduler job names are prefixed with the site_label.
+
+    Config params:
+        StatusRecheckPeriod
+            Period for the internet access, modem and router checks.
+        OutageRecheckPeriod
+            Period for the internet access and modem checks while confirming an outage or recovery,
+            and at the start of an outage.
+        OutageBackoff (default 1.5), OutageMaxRecheckPeriod (default 1m)
+            The outage check period is multiplied by OutageBackoff on each failed check, up to
+            OutageMaxRecheckPeriod.
+        OutageConfirm (default 2/3), RecoveryConfirm (default 2/3)
+            An outage is declared when k of the last n internet access checks fail, and recovery when
+            k of the last n succeed.
+        RecoveryDelay
+            Wait time after internet access recovery before notification and regular checking.  An outage
+            confirmed during the RecoveryDelay continues the prior outage (a flap).
+        DegradedRecheckPeriod (default 30s), DegradedRTTFactor (default 2.0)
+            Period for the next internet access check after a degraded check - one with some failed
+            tries, or with a response time over DegradedRTTFactor times the running average.
+        ExternalWANRecheckPeriod
+            Period for the external web page WANIP check.
+        ConfigWatchMode (default 'inotify')
+            'inotify' reloads as soon as the config file or its imports change, with a ConfigRecheckPeriod
+            (minimum 1h) stat check as a backup.  'poll' (or if inotify is not available) checks
+            the file stats every ConfigRecheckPeriod.
+        ConfigRecheckPeriod (default 10s)
+            Period for checking for config file changes.
+        RecheckJitter (default 0.05)
+            Each check runs up to +/- this fraction of its period off its regular schedule.
+    Router and external WANIP checks are skipped during an outage.
+    The outage start and end times are those of the first and last failed internet access check.
+    The latest result of each check is kept in results, for the control socket.
+    """
 
-    # WANfile = mungePath (config.getcfg("WANIPFile"), core.tool.data_dir, set_attributes=True)
-    # if WANfile.is_file:
-    #     with WANfile.full_path.open() as ifile:
-    #         SavedWANIP = ifile.read()
+    def __init__(self, site, snap):
+        self.site = site
+        self.label = site_label(site)
+        self.SavedWANIP = ""
+        self.WANfile = None
+        self.controller = probe_controller(snap)
+        self.modem_state = None             # Last modem state and external WANIP, for the event store
+        self.external_WANIP = None
+        self.WANIP_mismatch = None          # (router, external) WANIPs, while they differ
+        self.modem_status = None
+        self.router_status = None
+        self.results = {}                   # check name: latest result dict.  Replaced, not updated, under results_updated.
+        self.checks = 0                     # Internet access checks run
+        self.load_state(snap)
+        metric("inc", "wanstatus_outages_total",                 {"site": site}, 0)
+        metric("inc", "wanstatus_outage_seconds_total",          {"site": site}, 0)
+        metric("set", "wanstatus_outage_start_timestamp_seconds", {"site": site}, 0)
+        metric("inc", "wanstatus_flaps_total",                   {"site": site}, 0)
+        record_event("service", site, new="start")
+
+    @property
+    def outage_timestamp(self):
+        """Outage start time, set from outage confirmation until the end of the RecoveryDelay.
+        """
+        return self.controller.outage_start  if self.controller.in_outage()  else None
+
+    @property
+    def recovered_timestamp(self):
+        """Set during the RecoveryDelay period.
+        """
+        return self.controller.recovered_time
+
+    def load_state(self, snap):
+        self.cfg = snap
+        self.controller.snap = snap
+        try:
+            self.WANfile = mungePath (self.cfg.WANIPFile, core.tool.data_dir).full_path
+            with self.WANfile.open() as ifile:
+                self.SavedWANIP = ifile.read()
+        except Exception as e:
+            pass
 
-    # Check internet access
-    status, msg = have_internet()
-    if status:
-        logging.info   (f"{'Internet access:':{FIELD_WIDTH1}} {'Working':{FIELD_WIDTH2}} {msg}")
-    else:
-        logging.warning(f"{'Internet access:':{FIELD_WIDTH1}} {'NONE':{FIELD_WIDTH2}} {msg}")
+        # Recreate device objects whose configs have changed.  Unchanged devices keep their live session.
+        self.modem_status = self.refresh_device(self.modem_status, "Modem")
+        self.router_status = self.refresh_device(self.router_status, "Router")
 
-    # Check modem status
-    if config.getcfg('ModemStatusPage', False):
-        modem_status = device("Modem")
-        status, state, msg = modem_status.get_data()
-        if status:
-            logging.info    (f"{'Modem status:':{FIELD_WIDTH1}} {state:{FIELD_WIDTH2}} {msg}")
+    def refresh_device(self, _device, device_name):
+        if _device  and  _device.settings == self.cfg.devices[device_name]:
+            _device.nRetries = self.cfg.nRetries
+            return _device
+        if _device:
+            _device.close()
+        return device(device_name, self.cfg)  if self.cfg.devices[device_name]  else None
+
+    def close(self):
+        record_event("service", self.site, new="stop")
+        for name in ("internet", "modem", "router", "external"):
+            sched.remove(self.job(name))
+        for _device in (self.modem_status, self.router_status):
+            if _device:
+                _device.close()
+
+    def job(self, name):
+        return self.label + name
+
+    def set_result(self, name, **result):
+        """Save the result of check name, timestamped with its completion time.
+        """
+        with results_updated:
+            self.results[name] = {"time": time.time(), **result}
+            results_updated.notify_all()
+
+    def status(self):
+        """Return the site's outage state and latest check results, as a JSON-able dict.
+        Result keys are 'internet' (status, msg, rtt), 'modem' (status, state, msg, record), 'router'
+        (status, wanip, msg, record) and 'external' (status, wanip, msg), each with the time of the result.
+        record is the device.record.
+        A check that has not completed yet has no key.
+        """
+        controller = self.controller
+        with results_updated:
+            results = dict(self.results)
+        return {"site":             self.site,
+                "state":            controller.state,
+                "degraded":         controller.degraded,
+                "outage_start":     self.outage_timestamp,
+                "recovered_time":   controller.recovered_time,
+                "flaps":            controller.flaps,
+                "results":          results}
+
+    def probe(self):
+        """Run the site's checks now.  Returns the names of the checks that will produce a result.
+        """
+        names = ["internet"]
+        if self.modem_status:
+            names.append("modem")
+        if self.router_status  and  not self.outage_timestamp:
+            names.append("router")
+        if self.cfg.WANIPWebpage  and  not self.outage_timestamp:
+            names.append("external")
+        sched.run_now(*[self.job(name) for name in names])
+        return names
+
+    def checked(self, name, since):
+        """Return True if check name has a result from since or later, or will be skipped
+        (the router and external checks during an outage).
+        """
+        if name in ("router", "external")  and  self.outage_timestamp:
+            return True
+        return self.results.get(name, {}).get("time", 0) >= since
+
+    def add_jobs(self):
+        jitter = self.cfg.RecheckJitter
+        sched.add(self.job("internet"), self.check_internet, self.internet_period, jitter=jitter)
+        sched.add(self.job("modem"),    self.check_modem,    self.internet_period, jitter=jitter)
+        sched.add(self.job("router"),   self.check_router,   self.cfg.StatusRecheckPeriod, jitter=jitter)
+        sched.add(self.job("external"), self.check_external, self.cfg.ExternalWANRecheckPeriod, jitter=jitter)
+
+    def internet_period(self):
+        return self.controller.period(time.time())
+
+    def check_internet(self):
+        controller = self.controller
+        start_time = time.time()
+        info = {}
+        status, msg = have_internet(self.cfg, info)
+        self.checks += 1
+        metric("set", "wanstatus_internet_up", {"site": self.site}, 1  if status  else 0)
+        prior_period = controller.period(start_time)
+        event = controller.update(status, start_time, info["rtt"], info["failed"])
+        self.set_result("internet", status=status, msg=msg, rtt=info["rtt"])
+
+        if event == 'lost':         # INTERNET ACCESS LOST
+            metric("inc", "wanstatus_outages_total",                 {"site": self.site})
+            metric("set", "wanstatus_outage_start_timestamp_seconds", {"site": self.site}, controller.outage_start)
+            logging.warning(f"{self.label}INTERNET ACCESS LOST (since {time.strftime('%H:%M:%S', time.localtime(controller.outage_start))})")
+            sched.run_now(self.job("modem"))    # Check if we can get past the router to the modem (for diagnostic purposes)
+        elif event == 'flap':
+            metric("inc", "wanstatus_flaps_total", {"site": self.site})
+            logging.warning(f"{self.label}INTERNET ACCESS LOST again during the recovery delay - continuing the outage ({controller.flaps} flaps)")
+        elif event == 'recovered':  # INTERNET ACCESS RECOVERED
+            logging.info (f"{self.label}Doing <{self.cfg.RecoveryDelay_str}> internet access recovery delay")
+        elif event == 'ended':      # RecoveryDelay done
+            outage_period = int(controller.outage_end - controller.outage_start)
+            metric("inc", "wanstatus_outage_seconds_total",          {"site": self.site}, outage_period)
+            metric("set", "wanstatus_outage_start_timestamp_seconds", {"site": self.site}, 0)
+            message = f"Outage time:  {datetime.timedelta(seconds = outage_period)}"    # Cast int seconds to "00:00:00" format
+            if controller.flaps:
+                message += f", with {controller.flaps} brief recoveries (flapping)"
+            send_notice("NOTICE:  HOME INTERNET OUTAGE ENDED", message, self.site)
+            record_event("outage", self.site, when=controller.outage_end, start=controller.outage_start, end=controller.outage_end,
+                         duration=controller.outage_end - controller.outage_start, flaps=controller.flaps)
+            sched.run_now(self.job("modem"), self.job("router"), self.job("external"))
+        elif controller.state == 'up':      # HAVE INTERNET
+            logging.info   (f"{self.label}{'Internet access:':{FIELD_WIDTH1}} {'Degraded'  if controller.degraded  else 'Working':{FIELD_WIDTH2}} {msg}")
+        elif controller.state == 'suspect':
+            logging.info   (f"{self.label}{'Internet access:':{FIELD_WIDTH1}} {'Unconfirmed':{FIELD_WIDTH2}} {msg}")
         else:
-            logging.warning (f"{'Modem status:':{FIELD_WIDTH1}} {state:{FIELD_WIDTH2}} {msg}")
+            logging.debug (f"{self.label}have_internet() call returned {status}, {msg}  (state {controller.state})")
+
+        period = controller.period(time.time())
+        if period != prior_period:
+            sched.reschedule(self.job("internet"), period)
 
-    # Check for router WAN IP address change
-    if config.getcfg('RouterStatusPage', False):
-        router_status = device("Router")
-        status, WANIP, msg = router_status.get_data()
+    def check_modem(self):
+        if not self.modem_status:
+            return
+        status, state, msg = self.modem_status.get_data()
+        self.set_result("modem", status=status, state=state, msg=msg, record=self.modem_status.record)
         if status:
-            logging.info     (f"{'Router reported WANIP:':{FIELD_WIDTH1}} {WANIP:{FIELD_WIDTH2}} {msg}")
-            if WANIP != SavedWANIP:
-                logging.info (f"{'Prior stored WANIP:':{FIELD_WIDTH1}} {SavedWANIP:{FIELD_WIDTH2}}")
+            metric("set_info", "wanstatus_modem_state_info", {"site": self.site}, {"state": state})
+            metric_record(self.site, self.modem_status)
+            if self.modem_state is not None  and  state != self.modem_state:
+                record_event("modem", self.site, old=self.modem_state, new=state)
+            self.modem_state = state
+        if self.outage_timestamp:
+            logging.info (f"{self.label}{'Modem status:':{FIELD_WIDTH1}} {state:{FIELD_WIDTH2}} {msg}")
         else:
-            logging.warning(f"Failed getting WANIP address from router:\n{msg}")
+            log_modem_status(status, state, msg, label=self.label)
 
-    # Check external web page for WANIP
-    if config.getcfg('WANIPWebpage', False):
-        status, ext_WANIP = get_external_WANIP()
+    def check_router(self):
+        if not self.router_status  or  self.outage_timestamp:
+            return
+        status, WANIP, msg = self.router_status.get_data()
+        self.set_result("router", status=status, wanip=WANIP, msg=msg, record=self.router_status.record)
         if status:
-            logging.info (f"{'Externally reported WANIP:':{FIELD_WIDTH1}} {ext_WANIP:{FIELD_WIDTH2}}")
+            metric("set_info", "wanstatus_wanip_info", {"site": self.site}, {"wanip": WANIP})
+            metric_record(self.site, self.router_status)
+            logging.info     (f"{self.label}{'Router reported WANIP:':{FIELD_WIDTH1}} {WANIP:{FIELD_WIDTH2}} {msg}")
+            if WANIP != self.SavedWANIP:
+                send_notice("NOTICE:  HOME WAN IP CHANGED", f"New WAN IP: <{WANIP}>, Prior WAN IP: <{self.SavedWANIP}>.", self.site)
+                record_event("wanip", self.site, old=self.SavedWANIP, new=WANIP, source="router")
+
+                # with WANfile.full_path.open('w') as ofile:
+                with self.WANfile.open('w') as ofile:
+                    ofile.write (WANIP)
+                self.SavedWANIP = WANIP
+                sched.run_now(self.job("external"))     # Confirm the change externally
         else:
-            logging.warning (f"Failed getting externally reported WANIP:  {ext_WANIP}")
+            logging.warning(f"{self.label}Failed getting WANIP address from router:\n{msg}")
+
+    def check_external(self):
+        if not self.cfg.WANIPWebpage  or  self.outage_timestamp:
+            return
+        status, ext_WANIP, msg = get_external_WANIP(self.cfg)
+        self.set_result("external", status=status, wanip=ext_WANIP, msg=msg)
+        log_external_WANIP(status, ext_WANIP, msg, label=self.label)
+        if status:                          # Not a cached WANIP (None), which confirms nothing
+            if self.external_WANIP is not None  and  ext_WANIP != self.external_WANIP:
+                record_event("wanip", self.site, old=self.external_WANIP, new=ext_WANIP, source="external")
+            self.external_WANIP = ext_WANIP
+            mismatch = (self.SavedWANIP, ext_WANIP)  if self.router_status  and  self.SavedWANIP  and  self.SavedWANIP != ext_WANIP  else None
+            if mismatch  and  mismatch != self.WANIP_mismatch:
+                logging.warning (f"{self.label}Router reported WANIP <{self.SavedWANIP}> differs from the externally reported WANIP <{ext_WANIP}>")
+            self.WANIP_mismatch = mismatch
+
+
+def set_stores(access=None):
+    """Set up the device and WANIP provider budget session_stores and the latency_store per the current config.
+    access, if given, sets the latency_access.  Only the service ('trim') enforces the latency retention.
+    Config params:
+        DeviceSessionFile (default device_sessions.json)
+        WANIPBudgetFile (default wanip_budgets.json)
+            WANIP provider rate budgets and the last agreed WAN IP, kept between runs.  None to disable.
+        LatencyStoreFile (default latency.dat)
+            Probe latency records, for --stats.  None to disable.
+        LatencyRetention (default 30d)
+        LatencyMaxSize (default 16777216)
+            Records older than LatencyRetention, or beyond LatencyMaxSize bytes, are dropped by the service.
+    """
+    global sessions, wanip_budgets, latencies, latency_access
+    latency_access = access  or  latency_access
+    path = mungePath(cfg.DeviceSessionFile, core.tool.data_dir).full_path  if cfg.DeviceSessionFile  else None
+    if path is None:
+        sessions = None
+    elif not sessions  or  sessions.path != path:
+        sessions = session_store(path)
+
+    path = mungePath(cfg.WANIPBudgetFile, core.tool.data_dir).full_path  if cfg.WANIPBudgetFile  else None
+    if path is None:
+        wanip_budgets = None
+    elif not wanip_budgets  or  wanip_budgets.path != path:
+        wanip_budgets = session_store(path, "WANIP provider budget")
+
+    path = mungePath(cfg.LatencyStoreFile, core.tool.data_dir).full_path  if cfg.LatencyStoreFile  else None
+    if latencies  and  (path is None  or  latencies.path != path):
+        latencies.close()
+        latencies = None
+    if path is not None:
+        if not latencies:
+            latencies = latency_store(path, cfg.LatencyRetention, cfg.LatencyMaxSize,
+                                      trim=latency_access == 'trim', readonly=latency_access == 'read')
+        latencies.retention, latencies.max_size = cfg.LatencyRetention, cfg.LatencyMaxSize
+
+
+def set_event_store():
+    """Set up the event_store per the current config.  Only service mode records events, so only
+    service mode opens the store (--report reads the database directly).
+    Config params:
+        EventStoreFile (default events.db)
+            Outage, WAN IP change and modem state change history, for --report.  None to disable.
+    """
+    global events
+    path = mungePath(cfg.EventStoreFile, core.tool.data_dir).full_path  if cfg.EventStoreFile  else None
+    if events  and  (path is None  or  events.path != path):
+        events.close()
+        events = None
+    if path is not None  and  not events:
+        from .events import event_store
+        events = event_store(path)
+
+
+def record_event(type, site, when=None, **columns):
+    """Queue an event to the event_store, if enabled.  See the events module for the types and columns.
+    """
+    if events:
+        events.record(type, when  if when is not None  else time.time(), site, **columns)
 
 
-def service():
-    global modem_status, router_status
-    global config, logfile_override
+def record_latency(site, probe, target, latency_ms, ok):
+    """Record a probe result to the latency_store, if enabled.  probe is one of latency.PROBES.
+    """
+    if latencies:
+        latencies.record(probe, f"{site}/{target}"  if site  else target, latency_ms, ok)
+    if metrics:
+        labels = {"site": site, "probe": probe, "target": target}
+        metrics.set("wanstatus_probe_up", labels, 1  if ok  else 0)
+        if ok  and  latency_ms is not None:
+            metrics.observe("wanstatus_probe_latency_seconds", labels, latency_ms / 1000)
+
+
+def send_notice(subject, message, site=''):
+    """Send subject/message to the NotifList and EmailTo addresses, if defined, else log it.
+    In fleet mode the site name is added to the subject.
+    In service mode the notice is queued for the background notifier, and this returns immediately.
+    """
+    if site:
+        subject += f" - {site}"
+    if not cfg.NotifList  and  not cfg.EmailTo:
+        logging.warning(f"{subject} - {message}")
+        return
+    if notices:
+        notices.submit(subject, message)
+        return
+    from cjnfuncs.SMTP import snd_email, snd_notif
+    if cfg.NotifList:
+        try:
+            snd_notif (subj=subject, msg=message, log=True, smtp_config=config)
+        except Exception as e:
+            logging.warning(f"snd_notif error for <{subject}> <{message}>:  {e}")
+    if cfg.EmailTo:
+        try:
+            snd_email (subj=subject, body=message, to='EmailTo', log=True, smtp_config=config)
+        except Exception as e:
+            logging.warning(f"snd_email error for <{subject}> <{message}>:  {e}")
 
-    SavedWANIP = ""
 
-    try:
-        WANfile = mungePath (config.getcfg("WANIPFile"), core.tool.data_dir).full_path
-        with WANfile.open() as ifile:
-            SavedWANIP = ifile.read()
-    except Exception as e:
-        pass
-
-    # WANfile = mungePath (config.getcfg("WANIPFile"), core.tool.data_dir, set_attributes=True)
-    # if WANfile.is_file:
-    #     with WANfile.full_path.open() as ifile:
-    #         SavedWANIP = ifile.read()
-
-    if config.getcfg('ModemStatusPage', False):
-        modem_status = device("Modem")
-    if config.getcfg('RouterStatusPage', False):
-        router_status = device("Router")
-    next_check_time = next_WANIP_check_time = time.time()
-    
-    while 1:
-        if config.loadconfig(flush_on_reload=True, call_logfile_wins=logfile_override):       # Refresh if changes
-            logging.warning(f"NOTE - The config file has been reloaded.")
-            modem_status = device("Modem")     # Recreate device objects since their configs may have changed
-            router_status = device("Router")
-            next_check_time = next_WANIP_check_time = time.time()
-
-        if time.time() > next_check_time:
-
-            status, msg = have_internet()
-
-            if not status: # INTERNET ACCESS LOST
-                outage_timestamp = time.time()
-                logging.warning(f"INTERNET ACCESS LOST")
-                while 1:
-                    # Uncomment for debug - allows changing IAPingAddr or IADNSPage for testing have_internet() logic
-                    # if config.loadconfig(flush_on_reload=True, call_logfile_wins=logfile_override):       # Refresh if changes
-                    #     logging.warning(f"NOTE - The config file has been reloaded.")
-
-                    if config.getcfg('ModemStatusPage', False):           # Check if we can get past the router to the modem (for diagnostic purposes)
-                        status, state, msg = modem_status.get_data()
-                        logging.info (f"{'Modem status:':{FIELD_WIDTH1}} {state:{FIELD_WIDTH2}} {msg}")
-
-
-                    status, msg = have_internet()
-                    logging.debug (f"have_internet() call returned {status}, {msg}")
-                    if status: # INTERNET ACCESS RECOVERED
-                        outage_period = int(time.time() - outage_timestamp)
-
-                        logging.info (f"Doing <{config.getcfg('RecoveryDelay')}> internet access recovery delay")
-                        time.sleep (timevalue(config.getcfg('RecoveryDelay')).seconds)
-
-                        subject = "NOTICE:  HOME INTERNET OUTAGE ENDED"
-                        message = f"Outage time:  {datetime.timedelta(seconds = outage_period)}"    # Cast int seconds to "00:00:00" format
-                        if config.getcfg("NotifList", False, section='SMTP'):
-                            try:
-                                snd_notif (subj=subject, msg=message, log=True, smtp_config=config)
-                            # except Exception as e:
-                            #     logging.warning(f"snd_notif error for <{subject}> <{message}>:  {e}")
-                            except:
-                                pass
-                        if config.getcfg("EmailTo", False, section='SMTP'):
-                            try:
-                                snd_email (subj=subject, body=message, to='EmailTo', log=True, smtp_config=config)
-                            except Exception as e:
-                                logging.warning(f"snd_email error for <{subject}> <{message}>:  {e}")
-                        # if not getcfg("NotifList", False)  and  not getcfg("EmailTo", False):
-                        if not config.getcfg("NotifList", False, section='SMTP')  and  not config.getcfg("EmailTo", False, section='SMTP'):
-                            logging.warning(f"{subject} - {message}")
-
-                        next_check_time = next_WANIP_check_time = time.time()
-                        break
-                    time.sleep (timevalue(config.getcfg('OutageRecheckPeriod')).seconds)
-
-            else:   # HAVE INTERNET
-                logging.info   (f"{'Internet access:':{FIELD_WIDTH1}} {'Working':{FIELD_WIDTH2}} {msg}")
-
-                # Check modem status
-                if config.getcfg('ModemStatusPage', False):
-                    status, state, msg = modem_status.get_data()
-                    if status:
-                        logging.info    (f"{'Modem status:':{FIELD_WIDTH1}} {state:{FIELD_WIDTH2}} {msg}")
-                    else:
-                        logging.warning (f"{'Modem status:':{FIELD_WIDTH1}} {state:{FIELD_WIDTH2}} {msg}")
-
-                # Check for router WAN IP address change
-                if config.getcfg('RouterStatusPage', False):
-                    status, WANIP, msg = router_status.get_data()
-                    if status:
-                        logging.info     (f"{'Router reported WANIP:':{FIELD_WIDTH1}} {WANIP:{FIELD_WIDTH2}} {msg}")
-                        if WANIP != SavedWANIP:
-                            subject = "NOTICE:  HOME WAN IP CHANGED"
-                            message = f"New WAN IP: <{WANIP}>, Prior WAN IP: <{SavedWANIP}>."
-                            if config.getcfg("NotifList", False, section='SMTP'):
-                                try:
-                                    snd_notif (subj=subject, msg=message, log=True, smtp_config=config)
-                                # except Exception as e:
-                                #     logging.warning(f"snd_notif error for <{subject}>:  {e}")
-                                except:
-                                    pass
-                            if config.getcfg("EmailTo", False, section='SMTP'):
-                                try:
-                                    snd_email (subj=subject, body=message, to='EmailTo', log=True, smtp_config=config)
-                                except Exception as e:
-                                    logging.warning(f"snd_email error for <{subject}>:  {e}")
-                            if not config.getcfg("NotifList", False, section='SMTP')  and  not config.getcfg("EmailTo", False, section='SMTP'):
-                                logging.warning(f"{subject} - {message}")
-
-                            # with WANfile.full_path.open('w') as ofile:
-                            with WANfile.open('w') as ofile:
-                                ofile.write (WANIP)
-                            SavedWANIP = WANIP
-                    else:
-                        logging.warning(f"Failed getting WANIP address from router:\n{msg}")
-
-                # Periodically check external web page for WANIP
-                if config.getcfg('WANIPWebpage', False):
-                    if (time.time() > next_WANIP_check_time):
-                        status, ext_WANIP = get_external_WANIP()
-                        if status:
-                            logging.info (f"{'Externally reported WANIP:':{FIELD_WIDTH1}} {ext_WANIP:{FIELD_WIDTH2}}")
-                        else:
-                            logging.warning (f"Failed getting externally reported WANIP:  {ext_WANIP}")
-                        
-                        next_WANIP_check_time += timevalue(config.getcfg('ExternalWANRecheckPeriod')).seconds
-
-            next_check_time += timevalue(config.getcfg('StatusRecheckPeriod')).seconds
-        time.sleep (10)
-
-
-def have_internet():
+def log_modem_status(status, state, msg, label=''):
+    if status:
+        logging.info    (f"{label}{'Modem status:':{FIELD_WIDTH1}} {state:{FIELD_WIDTH2}} {msg}")
+    else:
+        logging.warning (f"{label}{'Modem status:':{FIELD_WIDTH1}} {state:{FIELD_WIDTH2}} {msg}")
+
+
+def log_record(record, device_name, label=''):
+    """Log a one line summary of a device.record:  the fields, and the number of rows and the
+    min..max of each numeric row column.
+    """
+    if not record:
+        return
+    parts = [f"{name}={value}" for name, value in record["fields"].items()]
+    if record["columns"]:
+        parts.append(f"{len(record['rows'])} rows")
+        for index, column in enumerate(record["columns"]):
+            values = [row[index] for row in record["rows"] if isinstance(row[index], (int, float))]
+            if values  and  column != record["key"]:
+                parts.append(f"{column} {min(values)}..{max(values)}")
+    logging.info (f"{label}{device_name + ' data:':{FIELD_WIDTH1}} {'  '.join(parts)}")
+
+
+def log_external_WANIP(status, ext_WANIP, msg, label=''):
+    if status:
+        logging.info (f"{label}{'Externally reported WANIP:':{FIELD_WIDTH1}} {ext_WANIP:{FIELD_WIDTH2}} {msg}")
+    elif status is None:
+        logging.warning (f"{label}{'Cached external WANIP:':{FIELD_WIDTH1}} {ext_WANIP:{FIELD_WIDTH2}} {msg}")
+    else:
+        logging.warning (f"{label}Failed getting externally reported WANIP:\n  {msg}")
+
+
+check_pool = None
+check_futures = {}
+
+def get_check_pool():
+    """Return the shared pool for all checks of all sites.
+    Config params:
+        MaxConcurrentChecks (default 6)
+            Max number of checks running at once, across all sites.  Changes take effect on restart.
+    """
+    global check_pool
+    if check_pool is None:
+        from .workers import daemon_pool
+        check_pool = daemon_pool(cfg.MaxConcurrentChecks, thread_name_prefix="check")
+    return check_pool
+
+def run_checks(checks):
+    """Run the internet access, modem, router and external WANIP checks concurrently on the check_pool threads.
+    checks is a dict of name: function, with each function returning a status tuple
+    (have_internet(), device.get_data() or get_external_WANIP()).  Names end with the check type,
+    eg 'site1: Router'.
+    Config params:
+        CycleDeadline (default 1m)
+            Max time to wait for all checks to finish.
+    Returns a dict of name: status tuple, in the same order as checks.  A check not finished by the
+    CycleDeadline, or still running from a prior call, returns False with an explanation message.
+    A check not finished by the CycleDeadline is left running.  The check_pool workers (and the probe
+    and WANIP provider workers under them) are daemon threads, so such a check doesn't hold up exit,
+    and an interactive run ends within about the CycleDeadline.  In service mode the check runs on
+    until its own timeouts (eg, nRetries times xxxTimeout for a device), and is not restarted meanwhile.
+    """
+    futures = {}
+    results = {}
+    for name, func in checks.items():
+        prior = check_futures.get(name)
+        if prior  and  not prior.done():
+            results[name] = f"{name} check still running from a prior cycle"
+        else:
+            futures[name] = check_futures[name] = get_check_pool().submit(func)
+
+    concurrent.futures.wait(futures.values(), timeout=cfg.CycleDeadline)
+    for name, future in futures.items():
+        if not future.done():
+            results[name] = f"{name} check not finished within CycleDeadline <{cfg.CycleDeadline_str}>"
+        else:
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                results[name] = f"{name} check errored:\n  " + repr(e)
+
+    for name in checks:         # Shape failure messages to match the check's normal return tuple
+        if isinstance(results[name], str):
+            results[name] = (False, results[name])  if name.endswith("Internet")  else (False, "", results[name])
+    return {name: results[name] for name in checks}
+
+
+def have_internet(snap=None, info=None):
     """Check for internet access by pinging an external address, or by making a socket connection to an 
         external DNS server.
     Config params:
-        IACheckMethod (Internet Access check methods: 'DNS' or 'ping', case insensitive)
+        IACheckMethod (Internet Access check methods: 'DNSquery', 'DNS' or 'ping', case insensitive)
             ping mode
                 IAPingAddrs - a whitespace separated list of addresses to ping
                 IAPingMaxTime
+                IAPingTimeout (default 5s) - per-try timeout
+                IAPingEngine (default 'native') - 'native' sends ICMP echo requests from this process,
+                    with fallback to the 'subprocess' ping command if ICMP sockets are not permitted
             DNS mode
-                IADNSAddrs - a whitespace separated list of DNS server IP addresses
+                IADNSAddrs - a whitespace separated list of DNS server IP addresses, each optionally
+                    with a :port (default 53)
                 IADNSTimeout
-    Returns True on successful ping time < IAPingMaxTime (in ms)  or  successful DNS connection within 
-    IADNSTimeout (based on IACheckMethod), else False.
+            DNSquery mode
+                IADNSAddrs, IADNSTimeout - as for DNS mode
+                IADNSQueryName (default www.google.com) - name to look up.  Each server must give a
+                    valid answer (NOERROR with an A record), over UDP (TCP if the UDP answer is truncated).
+        IAConcurrent (default False)
+            If True, all addresses are probed at once and the first success wins.  The remaining probes
+            are cancelled.  As in serial mode, a ping reply slower than IAPingMaxTime decides the check
+            (False) and is not retried.
+        IADeadline (default nRetries times the per-try timeout)
+            Overall time limit for a concurrent check.
+    snap is the config_snapshot to use, default the current snapshot.
+    info, if a dict, is given 'rtt' (the deciding probe's response time in ms, or None) and 'failed'
+    (the number of failed tries before the result), for the service mode probe_controller.
+    Returns True on successful ping time < IAPingMaxTime (in ms)  or  successful DNS connection or DNS
+    query answer within IADNSTimeout (based on IACheckMethod), else False.
     Also returns target address and response time
     """
-    msg = f"have_internet() failed - Invalid IACheckMethod <{config.getcfg('IACheckMethod')}>?"
+    snap = snap or cfg
+    status, msg, rtt, failed = _have_internet(snap)
+    if info is not None:
+        info.update(rtt=rtt, failed=failed)
+    return status, msg
 
-    if config.getcfg("IACheckMethod", "none").lower() == "ping":
-        for addr in config.getcfg("IAPingAddrs").split():
-            for _ in range (config.getcfg('nRetries')):
-                logging.debug (f"have_internet() try {_} ")
-                try:
-                    logging.debug (f"Attempting ping to {addr}")
-                    start_time = time.time()
-                    if platform.system() == "Windows":
-                        _cmd = ["ping", addr, r"/n", "1"] #, r"/w", "5000"]     # Setting timeout /w on Windows fails.  ??
-                    else:
-                        _cmd = ["ping", addr, "-c", "1", "-W", "5"]     # timeout hardcoded to 5sec
-                    ping = subprocess.run(_cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-                    cmd_time = time.time() - start_time
-                    ping.check_returncode()
-                    ping_time = float(re.search("time=([\d.]*)", ping.stdout).group(1))
-                    msg = f"(ping {addr} {ping_time:6.1f} ms, command run time {cmd_time*1000:6.1f} ms)"
-                    if ping_time < float(config.getcfg("IAPingMaxTime")):
-                        return True, msg
-                    else:
-                        return False, msg
-                except Exception as e:
-                    msg = (f"Ping errored:\n  {e}")
-            logging.info (f"Ping to <{addr}> failed.  Trying next server, if specified.")
-        # logging.debug (f"have_internet() checks errored:\n  {msg}")
-
-    if config.getcfg("IACheckMethod", "none").lower() == "dns":
-        # Host: 8.8.8.8 (google-public-dns-a.google.com)
-        # OpenPort: 53/tcp
-        # Service: domain (DNS/TCP)
-        # From:  https://stackoverflow.com/questions/3764291/checking-network-connection
-        for addr in config.getcfg("IADNSAddrs").split():
-            for _ in range (config.getcfg('nRetries')):
-                logging.debug (f"have_internet() try {_} ")
-                try:
-                    # socket.setdefaulttimeout(config.getcfg("IADNSTimeout"))
-                    logging.debug (f"Attempting socket connection to {addr}")
-                    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                    s.settimeout(timevalue(config.getcfg('IADNSTimeout')).seconds)
-                    start_time = time.time()
-                    s.connect((addr, 53))
-                    cmd_time = time.time() - start_time
-                    s.close()
-                    msg = f"(DNS server {addr}, command run time {cmd_time*1000:6.1f} ms)"
-                    return True, msg
-                except Exception as e:
-                    msg = "DNS connection errored:\n  " + repr(e)
-            logging.info (f"DNS connection to <{addr}> failed.  Trying next server, if specified.")
-        # logging.debug (f"have_internet() checks errored:\n  {msg}")
-    return False, msg
+
+def _have_internet(snap):
+    """have_internet() worker.  Returns status, msg, rtt (ms) and the number of failed tries.
+    """
+    msg = f"have_internet() failed - Invalid IACheckMethod <{snap.IACheckMethod}>?"
+
+    method = snap.IACheckMethod.lower()
+    if method == "ping":
+        probe, label = _ping_probe, "Ping"
+        addrs = snap.IAPingAddrs
+        try_timeout = snap.IAPingTimeout
+    elif method == "dns":
+        probe, label = _dns_probe, "DNS connection"
+        addrs = snap.IADNSAddrs
+        try_timeout = snap.IADNSTimeout
+    elif method == "dnsquery":
+        probe, label = _dnsquery_probe, "DNS query"
+        addrs = snap.IADNSAddrs
+        try_timeout = snap.IADNSTimeout
+    else:
+        return False, msg, None, 0
+
+    if snap.IAConcurrent:
+        deadline = time.time() + (snap.IADeadline  or  snap.nRetries * try_timeout)
+        if probe is _ping_probe  and  get_pinger(snap):
+            return _ping_all(snap, addrs, try_timeout, deadline)
+        if probe is _dnsquery_probe:
+            return _dnsquery_all(snap, addrs, try_timeout, deadline)
+        return _race_probes(snap, probe, addrs, try_timeout, deadline)
+
+    failed = 0
+    for addr in addrs:
+        for _ in range (snap.nRetries):
+            logging.debug (f"have_internet() try {_} ")
+            try:
+                status, msg, rtt = probe(snap, addr, try_timeout)
+                if _is_final(probe, status):
+                    return status, msg, rtt, failed
+            except Exception as e:
+                msg = f"{label} errored:\n  " + repr(e)
+                record_latency(snap.site, "ping"  if probe is _ping_probe  else "dns", addr, None, False)
+            failed += 1
+        logging.info (f"{site_label(snap.site)}{label} to <{addr}> failed.  Trying next server, if specified.")
+    return False, msg, None, failed
+
+
+def _ping_probe(snap, addr, timeout):
+    """Ping addr once.  Returns True if the ping time is < IAPingMaxTime, else False, the result msg and the ping time.
+    Raises an exception if the ping fails or times out.
+    """
+    logging.debug (f"Attempting ping to {addr}")
+    engine = get_pinger(snap)
+    start_time = time.time()
+    if engine:
+        replies = engine.ping([addr], timeout)
+        cmd_time = time.time() - start_time
+        if not replies:
+            raise TimeoutError(f"No reply from <{addr}> within {timeout} sec")
+        ping_time = replies[0][1]
+    else:
+        import platform, subprocess
+        from .icmp import resolve
+        ip = resolve(addr)
+        if platform.system() == "Windows":
+            _cmd = ["ping", ip, r"/n", "1"] #, r"/w", "5000"]     # Setting timeout /w on Windows fails.  ??
+        else:
+            _cmd = ["ping", ip, "-c", "1", "-W", str(max(1, int(timeout)))]
+        ping = subprocess.run(_cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, timeout=timeout)
+        cmd_time = time.time() - start_time
+        ping_time = float(PING_TIME_RE.search(ping.stdout).group(1))
+    record_latency(snap.site, "ping", addr, ping_time, True)
+    msg = f"(ping {addr} {ping_time:6.1f} ms, command run time {cmd_time*1000:6.1f} ms)"
+    return ping_time < snap.IAPingMaxTime, msg, ping_time
+
+PING_TIME_RE = re.compile(r"time=([\d.]*)")
+
+
+def _is_final(probe, status):
+    """True if a probe that returned (rather than raised) decides the check, in both the serial and
+    concurrent modes:  any success, or any ping reply, since a reply slower than IAPingMaxTime is a
+    slow link, not a lost packet, and is not retried.
+    """
+    return status  or  probe is _ping_probe
+
+
+def _ping_all(snap, addrs, timeout, deadline):
+    """Ping all addrs at once from the native ping engine socket, up to nRetries rounds.
+    The first reply decides - True if its ping time is < IAPingMaxTime.
+    Returns False once all rounds go unanswered or the deadline (a time.time() value) has passed.
+    Also returns the msg, the ping time and the number of unanswered pings.
+    """
+    msg = "No ping reply from any target"
+    failed = 0
+    for _ in range (snap.nRetries):
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        logging.debug (f"have_internet() try {_} ")
+        try:
+            start_time = time.time()
+            replies = pinger.ping(addrs, min(timeout, remaining))
+            cmd_time = time.time() - start_time
+            if replies:
+                addr, ping_time = replies[0]
+                record_latency(snap.site, "ping", addr, ping_time, True)
+                msg = f"(ping {addr} {ping_time:6.1f} ms, command run time {cmd_time*1000:6.1f} ms)"
+                return ping_time < snap.IAPingMaxTime, msg, ping_time, failed
+        except Exception as e:
+            msg = f"Ping errored:\n  " + repr(e)
+        for addr in addrs:
+            record_latency(snap.site, "ping", addr, None, False)
+        failed += len(addrs)
+    return False, msg, None, failed
+
+
+pinger = None
+
+def get_pinger(snap):
+    """Return the icmp_pinger shared by all sites (calls run concurrently), or None if IAPingEngine is
+    'subprocess' or ICMP sockets are not permitted on this host.
+    """
+    global pinger
+    if snap.IAPingEngine != 'native':
+        return None
+    if pinger is None:
+        from .icmp import icmp_pinger
+        try:
+            pinger = icmp_pinger()
+            logging.debug (f"Native ping engine using {'raw' if pinger.raw else 'datagram'} ICMP socket")
+        except OSError as e:
+            logging.info (f"Native ping engine not available, using the ping command:  {e}")
+            pinger = False
+    return pinger
+
+
+def _dns_probe(snap, addr, timeout):
+    """Make a socket connection to DNS server addr.  Returns True, the result msg and the connection time.
+    Raises an exception if the connection fails or times out.
+    """
+    # Host: 8.8.8.8 (google-public-dns-a.google.com)
+    # OpenPort: 53/tcp
+    # Service: domain (DNS/TCP)
+    # From:  https://stackoverflow.com/questions/3764291/checking-network-connection
+    logging.debug (f"Attempting socket connection to {addr}")
+    host, _, port = addr.partition(":")
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        start_time = time.time()
+        s.connect((host, int(port or 53)))
+        cmd_time = time.time() - start_time
+    record_latency(snap.site, "dns", addr, cmd_time*1000, True)
+    return True, f"(DNS server {addr}, command run time {cmd_time*1000:6.1f} ms)", cmd_time*1000
+
+
+dns_engine = None
+
+def get_dns_prober():
+    """Return the dns_prober shared by all sites (calls run concurrently).
+    """
+    global dns_engine
+    if dns_engine is None:
+        from .dnsquery import dns_prober
+        dns_engine = dns_prober()
+    return dns_engine
+
+
+def _dnsquery_probe(snap, addr, timeout):
+    """Query DNS server addr for the IADNSQueryName A record.  Returns True, the result msg and the response time.
+    Raises an exception if there is no valid answer within timeout.
+    """
+    logging.debug (f"Attempting DNS query to {addr}")
+    answers, errors = get_dns_prober().query([addr], snap.IADNSQueryName, timeout)
+    if not answers:
+        if addr in errors:
+            raise RuntimeError(f"<{addr}> answered {errors[addr]} for <{snap.IADNSQueryName}>")
+        raise TimeoutError(f"No answer from <{addr}> within {timeout} sec")
+    addr, rtt, answer = answers[0]
+    record_latency(snap.site, "dns", addr, rtt, True)
+    return True, f"(DNS query {addr} {snap.IADNSQueryName} {answer}, {rtt:6.1f} ms)", rtt
+
+
+def _dnsquery_all(snap, addrs, timeout, deadline):
+    """Query all DNS server addrs at once from the dns_prober socket, up to nRetries rounds.
+    The first valid answer wins.  Returns False once all rounds go unanswered (or answered with errors)
+    or the deadline (a time.time() value) has passed.
+    Also returns the msg, the response time and the number of failed queries.
+    """
+    msg = "No DNS answer from any server"
+    failed = 0
+    for _ in range (snap.nRetries):
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        logging.debug (f"have_internet() try {_} ")
+        try:
+            answers, errors = get_dns_prober().query(addrs, snap.IADNSQueryName, min(timeout, remaining))
+            if answers:
+                addr, rtt, answer = answers[0]
+                record_latency(snap.site, "dns", addr, rtt, True)
+                return True, f"(DNS query {addr} {snap.IADNSQueryName} {answer}, {rtt:6.1f} ms)", rtt, failed + len(errors)
+            if errors:
+                msg = "DNS query errors:  " + ", ".join(f"<{addr}> {error}" for addr, error in errors.items())
+        except Exception as e:
+            msg = f"DNS query errored:\n  " + repr(e)
+        for addr in addrs:
+            record_latency(snap.site, "dns", addr, None, False)
+        failed += len(addrs)
+    return False, msg, None, failed
+
+
+def _race_probes(snap, probe, addrs, try_timeout, deadline):
+    """Probe all addrs at once, each on its own thread of a pool for this call only, so that probes held
+    by a stalled site never delay another site's probes.  Each address gets up to nRetries tries.
+    Returns the status, msg and response time of the first final result (see _is_final() - a success,
+    or a ping reply slower than IAPingMaxTime), and the number of addresses that failed before it,
+    after cancelling the remaining probes.
+    Returns False once all addresses have failed or the deadline (a time.time() value) has passed.
+    Cancelled probes are abandoned, not waited for.  Each ends after at most its current try.
+    """
+    from .workers import daemon_pool
+    probe_pool = daemon_pool(len(addrs), thread_name_prefix="probe")
+    cancel = threading.Event()
+
+    def probe_addr(addr):
+        status, msg, rtt, final = False, f"<{addr}> not tried before the deadline", None, False
+        for _ in range (snap.nRetries):
+            remaining = deadline - time.time()
+            if cancel.is_set()  or  remaining <= 0:
+                break
+            logging.debug (f"have_internet() <{addr}> try {_} ")
+            try:
+                status, msg, rtt = probe(snap, addr, min(try_timeout, remaining))
+                final = _is_final(probe, status)
+                if final:
+                    break
+            except Exception as e:
+                status, msg = False, f"<{addr}> errored:  " + repr(e)
+                record_latency(snap.site, "ping"  if probe is _ping_probe  else "dns", addr, None, False)
+        return status, msg, rtt, final
+
+    pending = {probe_pool.submit(probe_addr, addr) for addr in addrs}
+    fails = []
+    try:
+        while pending:
+            done, pending = concurrent.futures.wait(pending, timeout=max(0, deadline - time.time()), return_when=concurrent.futures.FIRST_COMPLETED)
+            if not done:
+                fails.append("Deadline reached")
+                break
+            for future in done:
+                status, msg, rtt, final = future.result()
+                if final:
+                    return status, msg, rtt, len(fails)
+                fails.append(msg)
+    finally:
+        cancel.set()
+        probe_pool.shutdown(wait=False, cancel_futures=True)
+    return False, "All targets failed:\n  " + "\n  ".join(fails), None, len(fails)
 
 
 class device:
@@ -335,29 +1190,78 @@ class device:
             Page for extracting info from using the xxxStatusRE.
         xxxStatusRE                <td.+title="via.dhcp">\s+([\d]+\.[\d]+\.[\d]+\.[\d]+)
             RE for extracting modem status or router WAN IP from the xxxRouterStatusPage.
+        xxxFieldsRE                Up Time</td>\s*<td[^>]*>(?P<uptime>[^<]+)<
+            Optional.  RE with named groups for extracting more values from the xxxStatusPage, matched once.
+        xxxRowRE                   <tr><td>(?P<channel>\d+)</td><td>(?P<power>[-\d.]+)</td><td>(?P<snr>[\d.]+)</td>
+            Optional.  RE with named groups for extracting table rows (eg, per channel stats) from the
+            xxxStatusPage, matched as many times as it occurs.  Each row must fit within the xxxScanWindow.
+            The whole page is read (no early close) when defined.
+        xxxRowKey                  channel
+            Optional.  xxxRowRE group identifying the row, for the metrics row label.  Default the first group.
         xxxTimeout
-            Max time allowed for response from the device.
+            Max time allowed for response from the device.  Once there are a few recent response times
+            (see below) the request timeout is 4x the p99 response time (min 2s), up to xxxTimeout.
+            The last of the nRetries tries always uses the full xxxTimeout.
+        xxxHedge                   True
+            Optional, default True.  If a status page request takes longer than the p95 response time
+            then a second (hedged) request is sent on a new connection, and whichever completes first
+            is used.
+        xxxScanWindow              65536
+            Optional.  Pages are scanned as they are received, keeping only this many characters 
+            for matching.  xxxStatusRE and xxxCsrfRE matches must fit within the window.  An RE
+            with an unbounded greedy .* or .+ is accepted once a newline has arrived after the match,
+            or with DOTALL ((?s)) is matched over the whole page once it has all been read, so that
+            it gives the same match as a search of the full page.
+        xxxMaxPageSize             4194304
+            Optional.  Max bytes read from a device page.
+
+    The session cookies and csrf token are saved to the DeviceSessionFile (default device_sessions.json
+    in the data dir, None to disable) after each login, and restored on instantiation.  A restored
+    session that has expired is detected by xxxLoginRequiredText, and a new login is done.
+
+    The recent successful status page response times are kept per device (in memory, seeded from the
+    latency store if enabled) for the adaptive timeout and the hedge delay.  A hedged request uses a
+    new requests session with a copy of the session cookies, so both requests share the device's login
+    session and carry the same csrf token.  Only the winning response's csrf token is used, and if
+    the hedged request wins its session replaces the stalled one.
 
     Return info - device.get_data() returns a 3-tuple:
         True/False for the success of the call.
         The data item of interest per xxxStatusRE (modem state or WANIP from the router).
         Formatted text message - command run time on success, or an error message.
+    If xxxFieldsRE or xxxRowRE is defined then device.record is set by each get_data() call to a dict
+    (JSON-able), else None, and is None after a failed call:
+        fields      Dict of the xxxFieldsRE group values ({} if not matched)
+        columns     List of the xxxRowRE group names ([] if not defined)
+        key         The xxxRowKey column
+        rows        List of rows, each a tuple of the xxxRowRE group values in columns order
+    Values that are numbers are ints or floats.  All are extracted in the same single pass over the page.
     """
 
-    def __init__(self, device_name):
+    def __init__(self, device_name, snap=None):
+        snap = snap or cfg
+        self.settings              = snap.devices[device_name]      # device_settings, with compiled REs
+        self.nRetries              = snap.nRetries
         self.device_name           = device_name
-        self.status_page           = config.getcfg(device_name + "StatusPage", "")
-        self.status_RE             = config.getcfg(device_name + "StatusRE", "")
-        self.login_page            = config.getcfg(device_name + "LoginPage", None)
-        self.login_required_text   = config.getcfg(device_name + "LoginRequiredText", "nosuchtext")
-        self.login_username_field  = config.getcfg(device_name + "LoginUsernameField", False)
-        self.login_username        = config.getcfg(device_name + "_USER", "")
-        self.login_password_field  = config.getcfg(device_name + "LoginPasswordField", "")
-        self.login_password        = config.getcfg(device_name + "_PASS", "")
-        self.login_additional_keys = config.getcfg(device_name + "LoginAdditionalKeys", "")
-        self.csrf_RE               = config.getcfg(device_name + "CsrfRE", "")
-        self.timeout               = timevalue(config.getcfg(device_name + "Timeout", 1)).seconds
-
+        self.status_page           = self.settings.status_page
+        self.status_RE             = self.settings.status_RE
+        self.login_page            = self.settings.login_page
+        self.login_required_text   = self.settings.login_required_text
+        self.login_username_field  = self.settings.login_username_field
+        self.login_username        = self.settings.login_username
+        self.login_password_field  = self.settings.login_password_field
+        self.login_password        = self.settings.login_password
+        self.login_additional_keys = self.settings.login_additional_keys
+        self.csrf_RE               = self.settings.csrf_RE
+        self.timeout               = self.settings.timeout
+        self.site                  = snap.site
+        self.record                = None
+        self.rtt                   = rtt_window()
+        self.hedges                = 0          # Hedged requests sent
+        self.fetch_pool            = None       # Hedged request workers, started on first use
+        self.stragglers            = set()      # Losing hedged requests not yet finished
+
+        import requests
         self.session = requests.session()
         self.payload = {}
         self.csrf_mode = False
@@ -374,88 +1278,389 @@ class device:
                     self.csrf_mode = True
                     self.csrf_key = key.strip(" '\"")
 
+        csrf_RE = self.csrf_RE  if self.csrf_mode  else None
+        self.status_scanner = page_scanner(self.status_RE, csrf_RE, self.login_required_text, self.settings.scan_window, self.settings.max_page_size,
+                                           self.settings.fields_RE, self.settings.row_RE)
+        self.login_scanner =  page_scanner(None, csrf_RE, None, self.settings.scan_window, self.settings.max_page_size)
+
+        self.session_key = f"{site_label(snap.site)}{device_name} {self.login_page or self.status_page}"
+        self.saved_state = None
+        self.restored = False
+        if sessions:
+            self.saved_state = sessions.load(self.session_key)
+            if self.saved_state:
+                csrf = set_session_state(self.session, self.saved_state)
+                if self.csrf_mode  and  csrf is not None:
+                    self.payload[self.csrf_key] = csrf
+                self.restored = True
+                logging.debug (f"{self.device_name} saved session restored")
+
+        if latencies:
+            try:
+                self.rtt.seed(latencies, device_name.lower(), f"{snap.site}/{device_name}"  if snap.site  else device_name, time.time() - RTT_SEED_WINDOW)
+            except Exception as e:
+                logging.debug (f"{self.device_name} response time history not read from the latency store:  {e}")
+
+    def save_session(self):
+        """Save the session cookies and csrf token, if changed since last saved.
+        """
+        if not sessions:
+            return
+        state = get_session_state(self.session, self.payload.get(self.csrf_key)  if self.csrf_mode  else None)
+        if not state["cookies"]  and  state["csrf"] is None:
+            state = None                        # Nothing worth saving (eg, no login used)
+        if state != self.saved_state:
+            sessions.save(self.session_key, state)
+            self.saved_state = state
+
     def close(self):
         if self.session:
+            self.save_session()
             self.session.close()
-
-    def update_csrf(self, page_text):
-        csrf = re.search(self.csrf_RE, page_text)
-        if csrf:
-            self.payload[self.csrf_key] = csrf.group(1)
-            # logging.debug (f"Updated csrf token:  {csrf.group(1)}")
+        if self.fetch_pool:
+            self.fetch_pool.shutdown(wait=False)                    # Running requests finish.  A later fetch starts a new pool.
+            self.fetch_pool = None
+
+    def update_csrf(self, csrf):
+        if csrf is not None:
+            self.payload[self.csrf_key] = csrf
+            # logging.debug (f"Updated csrf token:  {csrf}")
         else:
             logging.warning (f"No csrf response from the {self.device_name}")
 
+    def fetch_status_page(self, session, payload, timeout):
+        """Get (or post, in csrf mode) the xxxStatusPage on session and scan it as it streams in.
+        Returns a page_scan and the response time (s).  Safe to run from a worker thread.
+        """
+        start_time = time.perf_counter()
+        if not self.csrf_mode:
+            status_page = session.get(self.status_page, timeout=timeout, verify = False, stream=True)
+        else:
+            status_page = session.post(self.status_page, data=payload, timeout=timeout, verify = False, stream=True)
+        scan = self.status_scanner.scan(status_page)
+        return scan, time.perf_counter() - start_time
+
+    def get_status_page(self, timeout):
+        """Get the xxxStatusPage, hedging a slow request (see the class notes), and update the csrf
+        token from the winning response.  Returns a page_scan.
+        """
+        hedge_delay = self.rtt.hedge_delay()  if self.settings.hedge  else None
+        payload = dict(self.payload)
+        if hedge_delay is None:
+            scan, rtt = self.fetch_status_page(self.session, payload, timeout)
+        else:
+            scan, rtt = self.hedged_fetch(payload, timeout, hedge_delay)
+        if self.csrf_mode:
+            self.update_csrf(scan.csrf)
+        if scan.status is not None:
+            self.rtt.add(rtt * 1000)
+        return scan
+
+    def hedged_fetch(self, payload, timeout, hedge_delay):
+        """Send the status page request.  If it hasn't completed within hedge_delay seconds then send
+        the same request on a new session, and return the first to complete successfully.  The loser
+        is left to finish (or time out) in the background, and then its session is closed.
+        Raises the first request's exception if both fail.
+        The two requests run on the device's fetch_pool (2 daemon threads, so that a stalled request
+        doesn't hold up exit).  While a prior loser is still running the request is made inline on the
+        calling thread and not hedged, so there are never more than 2 fetches in progress per device.
+        """
+        self.stragglers = {future for future in self.stragglers if not future.done()}
+        if self.stragglers:
+            logging.debug (f"{self.device_name} prior hedged request still running.  Not hedging.")
+            return self.fetch_status_page(self.session, payload, timeout)
+
+        if self.fetch_pool is None:
+            from .workers import daemon_pool
+            self.fetch_pool = daemon_pool(2, thread_name_prefix=self.device_name)
+        primary = self.fetch_pool.submit(self.fetch_status_page, self.session, payload, timeout)
+        done, _ = concurrent.futures.wait([primary], timeout=hedge_delay)
+        if done:
+            return primary.result()
+
+        import requests
+        self.hedges += 1
+        logging.debug (f"{self.device_name} no response within {hedge_delay*1000:.1f} ms.  Sending a hedged request.")
+        hedge_session = requests.session()
+        hedge_session.headers.update(self.session.headers)
+        hedge_session.cookies.update(self.session.cookies)
+        hedge = self.fetch_pool.submit(self.fetch_status_page, hedge_session, payload, timeout)
+        sessions_used = {primary: self.session, hedge: hedge_session}
+
+        pending = {primary, hedge}
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for winner in done:
+                if winner.exception() is None:
+                    self.session = sessions_used[winner]
+                    loser = hedge  if winner is primary  else primary
+                    loser.add_done_callback(lambda _, session=sessions_used[loser]: session.close())
+                    self.stragglers.add(loser)
+                    if winner is hedge:
+                        logging.debug (f"{self.device_name} hedged request won")
+                    return winner.result()
+        hedge_session.close()
+        return primary.result()
+
     def get_data(self):
         msg = f"Invalid web page response from {self.device_name}"
 
-        for _ in range (config.getcfg('nRetries')):
+        for _ in range (self.nRetries):
             try:
                 logging.debug (f"{self.device_name} try {_} ")
                 # logging.debug(f"{self.device_name} payload:  {self.payload}")
+                timeout = self.rtt.timeout(self.timeout)  if _ < self.nRetries - 1  else self.timeout
                 start_time = time.time()
-                if not self.csrf_mode:
-                    status_page = self.session.get(self.status_page, timeout=self.timeout, verify = False)
-                else:
-                    status_page = self.session.post(self.status_page, data=self.payload, timeout=self.timeout, verify = False)
-                    self.update_csrf(status_page.text)
+                scan = self.get_status_page(timeout)
                 cmd_time = time.time() - start_time
 
-                if self.login_required_text in status_page.text:
+                if scan.login_required:
+                    if self.restored:
+                        logging.debug(f"{self.device_name} saved session expired")
+                        self.restored = False
                     logging.debug(f"{self.device_name} login executed")
                     # logging.debug(f"{self.device_name} payload:  {self.payload}")
                     if self.login_page is not None:
-                        login_page = self.session.post(self.login_page, data=self.payload, timeout=self.timeout, verify = False)
+                        login_page = self.session.post(self.login_page, data=self.payload, timeout=timeout, verify = False, stream=True)
+                        login_scan = self.login_scanner.scan(login_page)
                         if self.csrf_mode:
-                            self.update_csrf(login_page.text)
+                            self.update_csrf(login_scan.csrf)
                     start_time = time.time()
-                    if not self.csrf_mode:
-                        status_page = self.session.get(self.status_page, timeout=self.timeout, verify = False)
-                    else:
-                        status_page = self.session.post(self.status_page, data=self.payload, timeout=self.timeout, verify = False)
-                        self.update_csrf(status_page.text)
+                    scan = self.get_status_page(timeout)
                     cmd_time = time.time() - start_time
 
-                out = re.search(self.status_RE, status_page.text, re.DOTALL)
-                if out:
+                if scan.status is not None:
+                    self.save_session()
+                    if self.settings.fields_RE  or  self.settings.row_RE:
+                        self.record = {"fields":  scan.fields,
+                                       "columns": list(self.status_scanner.columns),
+                                       "key":     self.settings.row_key,
+                                       "rows":    scan.rows}
+                    record_latency(self.site, self.device_name.lower(), self.device_name, cmd_time*1000, True)
                     msg = f"(command run time {cmd_time*1000:6.1f} ms)"
-                    return True, out.group(1), msg
+                    return True, scan.status, msg
             except Exception as e:
                 msg = f"{self.device_name} access errored:\n  " + repr(e)
+        self.record = None
+        record_latency(self.site, self.device_name.lower(), self.device_name, None, False)
         return False, "", msg
 
 
-def get_external_WANIP():
-    """Get WAN IP from external web page.
+wanip_checkers = {}                     # site: wanip_checker
+
+def get_external_WANIP(snap=None):
+    """Get WAN IP from the external web page(s).
     Config params:
         WANIPWebpage
+            URL of a web page that returns the WAN IP address.  May also be a whitespace separated
+            list of URLs, or a dict of URL: RE or URL: {'RE': RE, 'rate': 'n/period'} for providers
+            needing their own RE or rate budget.
         WANIPWebpageRE
+            RE for extracting the WAN IP address, for providers with no RE of their own.
         WANIPWebpageTimeout
-    On success, returns True and the IP address returned from the webpage, else False and the error message.
+        WANIPProviderRate (default None, no limit)
+            Token bucket rate budget for each provider:  at most n queries at once, refilled at n per period.
+            The budgets are kept in the WANIPBudgetFile (see set_stores()), so they also hold across
+            interactive mode runs.
+        WANIPQuorum (default 2, or 1 if only one provider)
+            Number of providers that must agree on the WAN IP.
+    snap is the config_snapshot to use, default the current snapshot.
+    Returns True, the WAN IP and a message, or False, '' and the error message.  If all of the provider
+    rate budgets are used up then None, the last accepted WAN IP (if any, else False and '') and a
+    message with its age are returned, and a warning is logged.  A cached WAN IP is not a confirmation
+    of the current WAN IP.
     """
-    WANIP_FORMAT = re.compile(config.getcfg("WANIPWebpageRE"))
-    msg = f"Invalid web page response from external webpage {config.getcfg('WANIPWebpage')}"
-    for _ in range (config.getcfg('nRetries')):
-        try:
-            start_time = time.time()
-            web_page = requests.get(config.getcfg('WANIPWebpage'), timeout=timevalue(config.getcfg('WANIPWebpageTimeout')).seconds)
-            cmd_time = time.time() - start_time
-            out = WANIP_FORMAT.search(web_page.text)
-            if out:
-                msg = f"{out.group(1):{FIELD_WIDTH2}} (command run time {cmd_time*1000:6.1f} ms)"
-                return True, msg
-        except Exception as e:
-            msg = "Checking external WANIPage errored:\n  " + repr(e)
-    return False, msg
+    snap = snap or cfg
+    checker = get_wanip_checker(snap)
+    status, WANIP, msg, queries = checker.check(snap.WANIPQuorum, snap.nRetries, snap.WANIPWebpageTimeout)
+    for url, cmd_time, ok in queries:
+        record_latency(snap.site, "external", url, cmd_time, ok)
+    metric("set", "wanstatus_wanip_cached_seconds", {"site": snap.site}, checker.cached_age  if status is None  else 0)
+    return status, WANIP, msg
+
+
+def get_wanip_checker(snap):
+    """Return the site's wanip_checker, rebuilt (keeping the provider rate budgets) if the providers or
+    the WANIPBudgetFile have changed.
+    """
+    from .wanip import wanip_checker
+    checker = wanip_checkers.get(snap.site)
+    if checker is None  or  checker.spec != snap.WANIPProviders  or  checker.store is not wanip_budgets:
+        wanip_checkers[snap.site] = wanip_checker(snap.WANIPProviders, checker, wanip_budgets, snap.site)
+        if checker:
+            checker.close()
+    return wanip_checkers[snap.site]
+
+
+def query_service(command, timeout=5):
+    """Send command to the running service's control socket (see control_command()).
+    Returns the response dict, or None if no service is listening or the request failed.
+    """
+    if not cfg.ControlSocket  or  not hasattr(socket, "AF_UNIX"):
+        return None
+    from .control import control_request
+    path = mungePath(cfg.ControlSocket, core.tool.data_dir).full_path
+    try:
+        return control_request(path, command, timeout)
+    except (FileNotFoundError, ConnectionRefusedError):
+        return None
+    except Exception as e:
+        logging.warning (f"Control socket <{path}> request <{command}> failed:  {repr(e)}")
+        return None
+
+
+def print_service_status(status):
+    """Log the running service's latest check results, in the same format as interactive mode.
+    """
+    logging.getLogger().setLevel(20)    # Force info level logging for interactive usage
+    logging.warning (f"Results from the running service (pid {status['pid']}, started {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(status['started']))})")
+    if not status["ok"]:
+        logging.warning (status["error"])
+    age = lambda result: f"  (checked {time.time() - result['time']:.0f}s ago)"
+
+    for site in status["sites"]:
+        label = site_label(site["site"])
+        results = site["results"]
+
+        internet = results.get("internet")
+        if not internet:
+            logging.info   (f"{label}{'Internet access:':{FIELD_WIDTH1}} {'Not yet checked':{FIELD_WIDTH2}}")
+        elif site["outage_start"]:
+            since = time.strftime('%H:%M:%S', time.localtime(site["outage_start"]))
+            flaps = f", {site['flaps']} flaps"  if site["flaps"]  else ""
+            logging.warning(f"{label}{'Internet access:':{FIELD_WIDTH1}} {'NONE':{FIELD_WIDTH2}} Outage since {since} ({site['state']}{flaps})  {internet['msg']}{age(internet)}")
+        elif site["state"] == 'suspect':
+            logging.warning(f"{label}{'Internet access:':{FIELD_WIDTH1}} {'Unconfirmed':{FIELD_WIDTH2}} {internet['msg']}{age(internet)}")
+        else:
+            logging.info   (f"{label}{'Internet access:':{FIELD_WIDTH1}} {'Degraded'  if site['degraded']  else 'Working':{FIELD_WIDTH2}} {internet['msg']}{age(internet)}")
+
+        if "modem" in results:
+            modem = results["modem"]
+            log_modem_status(modem["status"], modem["state"], modem["msg"] + age(modem), label=label)
+            log_record(modem.get("record"), "Modem", label=label)
+
+        if "router" in results:
+            router = results["router"]
+            if router["status"]:
+                logging.info   (f"{label}{'Router reported WANIP:':{FIELD_WIDTH1}} {router['wanip']:{FIELD_WIDTH2}} {router['msg']}{age(router)}")
+            else:
+                logging.warning(f"{label}Failed getting WANIP address from router{age(router)}:\n{router['msg']}")
+            log_record(router.get("record"), "Router", label=label)
+
+        if "external" in results:
+            external = results["external"]
+            log_external_WANIP(external["status"], external["wanip"], external["msg"] + age(external), label=label)
+
+
+def print_resources(usage):
+    """Print the running service's resource usage, as returned by the control socket resources command.
+    """
+    uptime = datetime.timedelta(seconds=int(time.time() - usage["started"]))
+    print (f"Service pid {usage['pid']}, up {uptime}, {usage['checks']} internet access checks")
+    mb = lambda value: f"{value / 2**20:.1f} MB"  if value is not None  else "n/a"
+    count = lambda value: value  if value is not None  else "n/a"
+    print (f"  {'Open fds:':{FIELD_WIDTH2}} {count(usage['fds'])}")
+    print (f"  {'Sockets:':{FIELD_WIDTH2}} {count(usage['sockets'])}")
+    print (f"  {'Threads:':{FIELD_WIDTH2}} {usage['threads']}")
+    print (f"  {'RSS:':{FIELD_WIDTH2}} {mb(usage['rss_bytes'])}")
+    if usage["traced_bytes"] is not None:
+        print (f"  {'Traced:':{FIELD_WIDTH2}} {mb(usage['traced_bytes'])} (peak {mb(usage['traced_peak_bytes'])})")
+
+
+def print_stats(window):
+    """Print the min/p50/p95/p99/max probe latencies and availability per target over the last window.
+    """
+    if not latencies:
+        print ("LatencyStoreFile is not enabled in the config file")
+        return 1
+    try:
+        stats = latencies.stats(time.time() - timevalue(window).seconds)
+    except Exception as e:
+        print (f"Couldn't read the latency store <{latencies.path}>:\n  {e}")
+        return 1
+    print (f"Probe latencies (ms) over the last {window}, from <{latencies.path}>:")
+    print (f"{'Probe':9} {'Target':40} {'Samples':>8} {'Avail %':>8} {'min':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    for stat in stats:
+        print (f"{stat.probe:9} {stat.target:40} {stat.nsamples:8} {stat.availability*100:8.2f} "
+               f"{stat.min:8.1f} {stat.p50:8.1f} {stat.p95:8.1f} {stat.p99:8.1f} {stat.max:8.1f}")
+    if not stats:
+        print ("No samples")
+
+
+def print_log(args):
+    """Print the last PrintLogLength log records (across rotated log files), filtered per the
+    --level, --since, --until, --grep and --events args.
+    """
+    try:
+        _lf = mungePath(config.getcfg("LogFile"), core.tool.log_dir_base).full_path
+        from .logtail import tail, EVENTS_RE
+        pattern = "|".join(f"(?:{_pattern})" for _pattern in (args.grep, EVENTS_RE  if args.events  else None) if _pattern)
+        records = tail(_lf, config.getcfg("PrintLogLength", PRINTLOGLENGTH), level=args.level, pattern=pattern,
+                       since=log_time(args.since)  if args.since  else None,
+                       until=log_time(args.until)  if args.until  else None)
+    except Exception as e:
+        print (f"Couldn't print the log file.  LogFile defined in the config file?\n  {e}")
+        return 1
+    print (f"Tail of  <{_lf}>:")
+    for record in records:
+        print (record)
+
+
+def log_time(when):
+    """Return a time.time() value for when, a time ago (eg '6h') or a date/time (eg '2024-01-31 08:00').
+    """
+    try:
+        return time.time() - timevalue(when).seconds
+    except ValueError:
+        return datetime.datetime.fromisoformat(when).timestamp()
+
+
+def print_report():
+    """Print the monthly availability, longest outages, and WAN IP and modem state change history.
+    """
+    if not cfg.EventStoreFile:
+        print ("EventStoreFile is not enabled in the config file")
+        return 1
+    from .events import report
+    path = mungePath(cfg.EventStoreFile, core.tool.data_dir).full_path
+    try:
+        lines = report(path)
+    except Exception as e:
+        print (f"Couldn't read the event store <{path}>:\n  {e}")
+        return 1
+    print (f"Event history from <{path}>:")
+    for line in lines:
+        print (line)
 
 
 def cleanup():
-    global modem_status, router_status
     logging.warning ("Cleanup")
-    if config.getcfg('ModemStatusPage', False):
-        modem_status.close()
-    if config.getcfg('RouterStatusPage', False):
-        router_status.close()
+    if control_socket:
+        control_socket.close()
+    if sched:
+        sched.stop()
+    if watcher:
+        watcher.close()
+    for _monitor in monitors.values():
+        _monitor.close()
+    for _device in interactive_devices:
+        _device.close()
+    if pinger:
+        pinger.close()
+    if dns_engine:
+        dns_engine.close()
+    for checker in wanip_checkers.values():
+        checker.close()
+    if latencies:
+        latencies.close()
+    if events:
+        events.close()
+    if exporter:
+        exporter.close()
+    if notices:
+        notices.close()
+    if check_pool:
+        check_pool.shutdown(wait=False, cancel_futures=True)
 
 
 def int_handler(signal, frame):
@@ -466,31 +1671,66 @@ signal.signal(signal.SIGINT,  int_handler)      # Ctrl-C
 signal.signal(signal.SIGTERM, int_handler)      # kill
 
 
+class _arg_parser(argparse.ArgumentParser):
+    def format_help(self):
+        self.description = __doc__ + get_version()         # Version looked up only when help is printed
+        return super().format_help()
+
+class _version_action(argparse.Action):
+    def __call__(self, parser, namespace, values, option_string=None):
+        print (f"{core.tool.toolname} {get_version()}")
+        parser.exit()
+
+
 def cli():
-    global config
+    global config, cfg
     global logfile_override
 
     set_toolname (TOOLNAME)
 
-    parser = argparse.ArgumentParser(description=__doc__ + __version__, formatter_class=argparse.RawTextHelpFormatter)
+    parser = _arg_parser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
     parser.add_argument('--config-file', '-c', type=str, default=CONFIG_FILE,
                         help=f"Path to the config file (Default <{CONFIG_FILE})> in user/site config directory.")
     parser.add_argument('--log-file', '-l', type=str, default=None,
                         help=f"Path to the log file.")
     parser.add_argument('--print-log', '-p', action='store_true',
-                        help=f"Print the tail end of the log file (default last {PRINTLOGLENGTH} lines).")
+                        help=f"Print the tail end of the log file, continuing into rotated log files (default last {PRINTLOGLENGTH} records).")
+    parser.add_argument('--level', type=str.upper, choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help="With --print-log, print only records at or above this level.")
+    parser.add_argument('--since', metavar='WHEN',
+                        help="With --print-log, print only records since WHEN, a time ago (eg 6h) or a date/time (eg 2024-01-31 or '2024-01-31 08:00').")
+    parser.add_argument('--until', metavar='WHEN',
+                        help="With --print-log, print only records until WHEN.")
+    parser.add_argument('--grep', metavar='REGEX',
+                        help="With --print-log, print only records matching REGEX.")
+    parser.add_argument('--events', action='store_true',
+                        help="With --print-log, print only outage and WAN IP change records.")
+    parser.add_argument('--stats', nargs='?', const='1d', metavar='WINDOW',
+                        help=f"Print probe latency percentiles and availability over the last WINDOW (default 1d).")
+    parser.add_argument('--report', action='store_true',
+                        help=f"Print monthly availability, the longest outages, and WAN IP and modem state change counts.")
     parser.add_argument('--service', action='store_true',
                         help="Enter endless loop for use as a systemd service.")
+    parser.add_argument('--probe', action='store_true',
+                        help="Have the running service run its checks now, and print the fresh results.")
+    parser.add_argument('--reload', action='store_true',
+                        help="Have the running service reload its config file.")
+    parser.add_argument('--resources', action='store_true',
+                        help="Print the running service's open fds, sockets, threads and memory usage.")
+    parser.add_argument('--direct', action='store_true',
+                        help="Run the checks in this process, even if a service is running.")
     parser.add_argument('--setup-user', action='store_true',
                         help=f"Install starter files in user space.")
     parser.add_argument('--setup-site', action='store_true',
                         help=f"Install starter files in system-wide space. Run with root prev.")
-    parser.add_argument('-V', '--version', action='version', version=f"{core.tool.toolname} {__version__}",
+    parser.add_argument('-V', '--version', action=_version_action, nargs=0,
                         help="Return version number and exit.")
     args = parser.parse_args()
 
 
     # Deploy template files
+    if args.setup_user  or  args.setup_site:
+        from cjnfuncs.deployfiles import deploy_files
     if args.setup_user:
         logging.getLogger('cjnfuncs.deployfiles').setLevel(logging.INFO)
         deploy_files([
@@ -519,28 +1759,65 @@ def cli():
     try:
         config = config_item(args.config_file)
         config.loadconfig(call_logfile_wins=logfile_override, call_logfile=args.log_file) #, ldcfg_ll=10)
+        cfg = config_snapshot(config)
     except Exception as e:
         logging.error(f"Failed loading config file <{args.config_file}>. \
 \n  Run with  '--setup-user' or '--setup-site' to install starter files.\n  {e}\n  Aborting.")
         sys.exit(1)
 
 
-    logging.warning (f"========== {core.tool.toolname} ({__version__}) ==========")
+    logging.warning (f"========== {core.tool.toolname} ({get_version()}) ==========")
     logging.warning (f"Config file <{config.config_full_path}>")
 
 
     # Print log
-    if args.print_log:
-        try:
-            _lf = mungePath(config.getcfg("LogFile"), core.tool.log_dir_base).full_path
-            print (f"Tail of  <{_lf}>:")
-            _xx = collections.deque(_lf.open(), config.getcfg("PrintLogLength", 40))
-            for line in _xx:
-                print (line, end="")
-        except Exception as e:
-            print (f"Couldn't print the log file.  LogFile defined in the config file?\n  {e}")
+    if args.print_log  or  args.level  or  args.since  or  args.until  or  args.grep  or  args.events:
+        sys.exit(print_log(args))
+
+
+    # Print event history report
+    if args.report:
+        sys.exit(print_report())
+
+
+    # Get the running service's results, or have it probe or reload, via its control socket
+    if args.reload:
+        response = query_service("reload")
+        if not response:
+            logging.error (f"No running service found at ControlSocket <{cfg.ControlSocket}>")
+            sys.exit(1)
+        if not response["ok"]:
+            logging.error (f"Service config reload failed:  {response['error']}")
+            sys.exit(1)
+        logging.warning (f"Service config file <{response['config_file']}> reloaded")
         sys.exit()
 
+    if args.resources:
+        response = query_service("resources")
+        if not response:
+            logging.error (f"No running service found at ControlSocket <{cfg.ControlSocket}>")
+            sys.exit(1)
+        print_resources(response)
+        sys.exit()
+
+    if not args.service  and  not args.direct  and  not args.stats:
+        response = query_service("probe", timeout=cfg.CycleDeadline + 5)  if args.probe  else query_service("status")
+        if response:
+            print_service_status(response)
+            sys.exit(0  if response["ok"]  else 1)
+
+
+    try:
+        set_stores('read'  if args.stats  else 'trim'  if args.service  else 'append')
+    except Exception as e:
+        logging.error(f"Failed setting up the data stores per the config file <{args.config_file}>.\n  {e}\n  Aborting.")
+        sys.exit(1)
+
+
+    # Print latency stats
+    if args.stats:
+        sys.exit(print_stats(args.stats))
+
 
     # Run in service or interactive modes
     if args.service:
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""Bounded thread pool with daemon worker threads.
+
+For work (eg, a stalled network request) that must not hold up exit.  Kept apart from the scheduler so
+that interactive runs can use it without loading the service mode modules.
+"""
+
+import concurrent.futures
+import queue
+import threading
+
+
+class daemon_pool:
+    """ A bounded concurrent.futures style executor (submit() and shutdown()) with daemon worker threads.
+
+    concurrent.futures.ThreadPoolExecutor joins its workers at interpreter exit, so a job stuck in a
+    network call holds up exit until the call times out.  Here exit doesn't wait for running jobs.
+    Up to max_workers threads are started as needed, and reused.
+    """
+
+    def __init__(self, max_workers, thread_name_prefix="worker"):
+        self.max_workers = max(1, max_workers)
+        self.thread_name_prefix = thread_name_prefix
+        self.queue = queue.SimpleQueue()
+        self.idle = threading.Semaphore(0)
+        self.threads = []
+        self.lock = threading.Lock()
+        self.shutdown_flag = False
+
+    def submit(self, func, *args, **kwargs):
+        with self.lock:
+            if self.shutdown_flag:
+                raise RuntimeError("cannot schedule new futures after shutdown")
+            future = concurrent.futures.Future()
+            self.queue.put((future, func, args, kwargs))
+            if not self.idle.acquire(timeout=0)  and  len(self.threads) < self.max_workers:
+                thread = threading.Thread(target=self._worker, name=f"{self.thread_name_prefix}_{len(self.threads)}", daemon=True)
+                self.threads.append(thread)
+                thread.start()
+        return future
+
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.put(None)                                # Wake the next worker to stop
+                return
+            future, func, args, kwargs = item
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(func(*args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+            del item, future
+            self.idle.release()
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        """Stop accepting jobs, optionally cancel the queued ones, and stop the workers once the queue
+        is done.  With wait, wait for the running jobs to finish.
+        """
+        with self.lock:
+            self.shutdown_flag = True
+            if cancel_futures:
+                while True:
+                    try:
+                        item = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not None:
+                        item[0].cancel()
+            self.queue.put(None)
+        if wait:
+            for thread in self.threads:
+                thread.join()
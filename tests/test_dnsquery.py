@@ -0,0 +1,64 @@
+"""Tests for wanstatus.dnsquery.parse_response.
+"""
+
+import struct
+
+from wanstatus import dnsquery
+
+
+TXID = 0x1234
+NAME = "www.example.com"
+
+
+def question(name=NAME):
+    return dnsquery.encode_name(name) + struct.pack("!HH", dnsquery.QTYPE_A, dnsquery.QCLASS_IN)
+
+
+def answer(rtype=dnsquery.QTYPE_A, rdata=bytes([93, 184, 216, 34]), name=b"\xc0\x0c"):
+    return name + struct.pack("!HHIH", rtype, dnsquery.QCLASS_IN, 300, len(rdata)) + rdata
+
+
+def response(answers=(), flags=dnsquery.FLAG_QR | dnsquery.FLAG_RD, txid=TXID, _question=None):
+    header = dnsquery.HEADER.pack(txid, flags, 1, len(answers), 0, 0)
+    return header + (_question  if _question is not None  else question()) + b"".join(answers)
+
+
+def parse(data):
+    return dnsquery.parse_response(data, TXID, question())
+
+
+def test_build_query_round_trip():
+    query = dnsquery.build_query(TXID, NAME)
+    assert query[dnsquery.HEADER.size:] == question()
+    assert dnsquery.HEADER.unpack_from(query)[:3] == (TXID, dnsquery.FLAG_RD, 1)
+
+
+def test_a_record():
+    assert parse(response([answer()])) == (True, "93.184.216.34", False)
+
+
+def test_a_record_after_cname():
+    cname = answer(rtype=5, rdata=dnsquery.encode_name("edge.example.net"))
+    a_record = answer(name=dnsquery.encode_name("edge.example.net"))
+    assert parse(response([cname, a_record])) == (True, "93.184.216.34", False)
+
+
+def test_question_case_insensitive():
+    data = response([answer()], _question=question(NAME.upper()))
+    assert parse(data)[0]
+
+
+def test_failures():
+    assert parse(b"\x12") == (False, "Short response", False)
+    assert parse(response([answer()], txid=TXID + 1)) == (False, "Not a response to the query", False)
+    assert parse(response([answer()], flags=dnsquery.FLAG_RD)) == (False, "Not a response to the query", False)
+    assert parse(response(flags=dnsquery.FLAG_QR | 3)) == (False, "NXDOMAIN", False)
+    assert parse(response(flags=dnsquery.FLAG_QR | 9)) == (False, "RCODE 9", False)
+    assert parse(response([answer()], _question=question("other.example.com"))) == (False, "Question mismatch", False)
+    assert parse(response()) == (False, "No A record in the answer", False)
+    assert parse(response([answer(rtype=28, rdata=bytes(16))])) == (False, "No A record in the answer", False)
+    assert parse(response([answer()[:-6]])) == (False, "Malformed answer", False)
+
+
+def test_truncated():
+    assert parse(response(flags=dnsquery.FLAG_QR | dnsquery.FLAG_TC)) == (False, "Truncated", True)
@@ -0,0 +1,104 @@
+"""Tests for wanstatus.extract.page_scanner.
+"""
+
+import re
+from pathlib import Path
+
+import pytest
+
+from wanstatus import extract
+
+
+CFG = Path(__file__).resolve().parent.parent / 'src' / 'wanstatus' / 'deployment_files' / 'wanstatus.cfg'
+
+
+class fake_response:
+    """Minimal stand-in for a streamed requests response.
+    """
+    def __init__(self, text, chunk_size=100):
+        self.data = text.encode('utf-8')
+        self.chunk_size = chunk_size
+        self.encoding = 'utf-8'
+        self.closed = False
+
+    def iter_content(self, _size):
+        for pos in range(0, len(self.data), self.chunk_size):
+            yield self.data[pos:pos + self.chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
+def cfg_RE(name):
+    """Return the compiled RE of the active (uncommented) param name in the shipped wanstatus.cfg.
+    """
+    for line in CFG.read_text().splitlines():
+        if line.startswith(name + ' '):
+            return re.compile(line.split(None, 1)[1].split('\t#')[0].strip())
+    raise KeyError(name)
+
+
+def test_shipped_REs_stop_early():
+    csrf_RE = cfg_RE('RouterCsrfRE')
+    status_RE = cfg_RE('RouterStatusRE')
+    assert extract.line_RE(csrf_RE)  and  extract.line_RE(status_RE)
+    assert not extract.full_page_RE(csrf_RE)  and  not extract.full_page_RE(status_RE)
+
+    page = ('<html><script>var csrfMagicToken = "sid:abc,123";var csrfMagicName = "__csrf_magic";</script>\n'
+            '<tr><td class="listr" title="via dhcp">WAN</td>'
+            '<td class="listr" title="via dhcp">\n    192.168.1.2\n</td></tr>\n'
+            + 'x' * 200000 + '\n</html>\n')
+    response = fake_response(page, chunk_size=1024)
+    result = extract.page_scanner(status_RE=status_RE, csrf_RE=csrf_RE).scan(response)
+    assert result.csrf == csrf_RE.search(page).group(1) == 'sid:abc,123'
+    assert result.status == status_RE.search(page).group(1) == '192.168.1.2'
+    assert result.size <= 2048                                      # Stopped within the first chunks
+    assert response.closed
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 7, 64])
+def test_line_RE_matches_full_page_search(chunk_size):
+    RE = re.compile(r'<td.+title="(\w+)">')
+    page = '<td a title="one"> <td b title="two">\n<td c title="three">\n'
+    result = extract.page_scanner(status_RE=RE).scan(fake_response(page, chunk_size))
+    assert result.status == RE.search(page).group(1) == 'two'
+
+
+@pytest.mark.parametrize('chunk_size', [1, 5, 64])
+def test_dotall_RE_waits_for_whole_page(chunk_size):
+    RE = re.compile(r'(?s)start(.*)end')
+    page = 'start a end\nb end\nc end tail'
+    assert extract.full_page_RE(RE)
+    result = extract.page_scanner(status_RE=RE, window=8).scan(fake_response(page, chunk_size))
+    assert result.status == RE.search(page).group(1)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 4, 1000])
+def test_no_partial_match_at_chunk_boundary(chunk_size):
+    RE = re.compile(r'IP: ([\d.]+)')
+    page = 'head IP: 10.20.30.40 tail'
+    result = extract.page_scanner(status_RE=RE).scan(fake_response(page, chunk_size))
+    assert result.status == '10.20.30.40'
+
+
+def test_login_required():
+    page = 'Please log in to continue.  Status: up'
+    result = extract.page_scanner(status_RE=re.compile(r'Status: (\w+)'), login_text='log in').scan(fake_response(page, 4))
+    assert result.login_required
+
+
+@pytest.mark.parametrize('chunk_size', [1, 9, 4096])
+def test_fields_and_rows(chunk_size):
+    fields_RE = re.compile(r'Uptime: (?P<uptime>\d+) Model: (?P<model>\w+)')
+    row_RE = re.compile(r'<tr><td>(?P<channel>\d+)</td><td>(?P<power>[-\d.]+)</td></tr>')
+    page = ('Uptime: 1234 Model: SB6183\n'
+            + ''.join(f'<tr><td>{n}</td><td>{n / 2 - 1}</td></tr>\n' for n in range(1, 25))
+            + 'x' * 100)
+    result = extract.page_scanner(fields_RE=fields_RE, row_RE=row_RE, window=200).scan(fake_response(page, chunk_size))
+    assert result.fields == {'uptime': 1234, 'model': 'SB6183'}
+    assert result.rows == [(n, n / 2 - 1) for n in range(1, 25)]
+
+
+def test_max_size():
+    with pytest.raises(ValueError):
+        extract.page_scanner(status_RE=re.compile(r'never (\w+)'), max_size=1000).scan(fake_response('x' * 5000))
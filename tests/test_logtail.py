@@ -0,0 +1,70 @@
+"""Tests for wanstatus.logtail.tail filtering.
+"""
+
+import gzip
+import os
+import time
+import datetime
+
+from wanstatus import logtail
+
+
+def stamp(minute):
+    return f"2024-01-01 10:{minute:02d}:00"
+
+
+def epoch(minute):
+    return datetime.datetime(2024, 1, 1, 10, minute).timestamp()
+
+
+def write_logs(tmp_path):
+    """Write a log file and two rotated files, each record one minute apart.
+    """
+    log = tmp_path / "wanstatus.log"
+    (tmp_path / "wanstatus.log.2.gz").write_bytes(gzip.compress(
+        f"{stamp(0)}  wanstatus.main -  WARNING:  INTERNET ACCESS LOST\n{stamp(1)}  wanstatus.main -     INFO:  oldest info\n".encode()))
+    (tmp_path / "wanstatus.log.1").write_text(
+        f"{stamp(2)}  wanstatus.main -    ERROR:  Failed\n  second line of the error\n{stamp(3)}  wanstatus.main -     INFO:  older info\n")
+    log.write_text(
+        f"{stamp(4)}  wanstatus.main -  WARNING:  OUTAGE ENDED\n{stamp(5)}  wanstatus.main -    DEBUG:  debug detail\n"
+        f"{stamp(6)}  wanstatus.main -     INFO:  newest info\n")
+    now = time.time()
+    for age, name in enumerate(("wanstatus.log", "wanstatus.log.1", "wanstatus.log.2.gz")):
+        os.utime(tmp_path / name, (now - age * 100, now - age * 100))
+    return log
+
+
+def messages(records):
+    return [record.split(":  ", 1)[1].split("\n")[0] for record in records]
+
+
+def test_last_count_in_time_order(tmp_path):
+    log = write_logs(tmp_path)
+    assert messages(logtail.tail(log, 3)) == ["OUTAGE ENDED", "debug detail", "newest info"]
+    assert len(logtail.tail(log, 100)) == 7                         # Across the rotated files
+
+
+def test_level_filter(tmp_path):
+    log = write_logs(tmp_path)
+    assert messages(logtail.tail(log, 10, level='warning')) == ["INTERNET ACCESS LOST", "Failed", "OUTAGE ENDED"]
+
+
+def test_multiline_record_kept_whole(tmp_path):
+    log = write_logs(tmp_path)
+    records = logtail.tail(log, 10, level='ERROR')
+    assert records == [f"{stamp(2)}  wanstatus.main -    ERROR:  Failed\n  second line of the error"]
+
+
+def test_time_range(tmp_path):
+    log = write_logs(tmp_path)
+    assert messages(logtail.tail(log, 10, since=epoch(2), until=epoch(4))) == ["Failed", "older info", "OUTAGE ENDED"]
+
+
+def test_pattern(tmp_path):
+    log = write_logs(tmp_path)
+    assert messages(logtail.tail(log, 10, pattern=logtail.EVENTS_RE)) == ["INTERNET ACCESS LOST", "OUTAGE ENDED"]
+    assert messages(logtail.tail(log, 10, pattern="second line")) == ["Failed"]
+
+
+def test_missing_log(tmp_path):
+    assert logtail.tail(tmp_path / "none.log", 10) == []
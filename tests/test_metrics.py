@@ -0,0 +1,40 @@
+"""Tests for wanstatus.metrics.metrics_registry rendering.
+"""
+
+from wanstatus.metrics import metrics_registry
+
+
+def test_volatile_collector_keeps_render_cache():
+    registry = metrics_registry()
+    registry.describe("wanstatus_internet_up", "gauge", "Up.")
+    registry.describe("wanstatus_process_threads", "gauge", "Threads.", volatile=True)
+    scrapes = []
+    def collector():
+        scrapes.append(1)
+        registry.set("wanstatus_process_threads", {}, len(scrapes))
+    registry.add_collector(collector)
+    registry.set("wanstatus_internet_up", {"site": "a"}, 1)
+
+    first = registry.render()
+    cached = registry.rendered
+    second = registry.render()
+    assert registry.rendered is cached                              # Not re-rendered
+    assert 'wanstatus_internet_up{site="a"} 1.0' in second.decode()
+    assert "wanstatus_process_threads 1.0" in first.decode()
+    assert "wanstatus_process_threads 2.0" in second.decode()
+
+    registry.set("wanstatus_internet_up", {"site": "a"}, 0)
+    assert 'wanstatus_internet_up{site="a"} 0.0' in registry.render().decode()
+    assert registry.rendered is not cached
+
+
+def test_histogram():
+    registry = metrics_registry()
+    registry.describe("latency", "histogram", "Latency.", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        registry.observe("latency", {"target": "x"}, value)
+    text = registry.render().decode()
+    assert 'latency_bucket{target="x",le="0.1"} 1' in text
+    assert 'latency_bucket{target="x",le="1.0"} 2' in text
+    assert 'latency_bucket{target="x",le="+Inf"} 3' in text
+    assert 'latency_count{target="x"} 3' in text
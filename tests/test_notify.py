@@ -0,0 +1,55 @@
+"""Tests for wanstatus.notify.notifier queue handling.
+"""
+
+import threading
+import time
+
+from wanstatus import notify
+
+
+def wait_for(condition, timeout=5):
+    end_time = time.time() + timeout
+    while time.time() < end_time:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_overflow_during_send_keeps_newer_notices():
+    """Notices submitted (and older ones dropped) while a batch is being sent must not be removed
+    when that batch completes.
+    """
+    sending = threading.Event()
+    release = threading.Event()
+    sent = []
+
+    def send(batch):
+        sending.set()
+        release.wait(5)
+        sent.append([item["subject"] for item in batch])
+
+    notifier = notify.notifier(None, None, window=0, max_queue=3)
+    notifier.send = send
+    try:
+        notifier.submit("a", "")
+        notifier.submit("b", "")
+        assert sending.wait(5)
+        for subject in ("c", "d", "e"):                             # Drops a and b while in flight
+            notifier.submit(subject, "")
+        release.set()
+        assert wait_for(lambda: len(sent) == 2  and  not notifier.queue)
+    finally:
+        notifier.close()
+    assert sent[0] == ["a", "b"]  or  sent[0] == ["a"]
+    assert sent[-1] == ["c", "d", "e"]
+
+
+def test_coalesce():
+    batch = [{"subject": "NOTICE:  one", "message": "m1", "time": 0},
+             {"subject": "NOTICE:  two", "message": "m2", "time": 1},
+             {"subject": "NOTICE:  one", "message": "m3", "time": 2}]
+    subject, message = notify.coalesce(batch)
+    assert subject == "NOTICE:  one; two"
+    assert message.count("\n") == 5
+    assert notify.coalesce(batch[:1]) == ("NOTICE:  one", "m1")
@@ -0,0 +1,90 @@
+"""Tests for wanstatus.probectl.probe_controller hysteresis and check periods.
+"""
+
+from types import SimpleNamespace
+
+from wanstatus.probectl import probe_controller
+
+
+def snap(**overrides):
+    settings = dict(OutageConfirm=(2, 3), RecoveryConfirm=(2, 3), StatusRecheckPeriod=600, OutageRecheckPeriod=10,
+                    DegradedRecheckPeriod=30, DegradedRTTFactor=2.0, OutageBackoff=1.5, OutageMaxRecheckPeriod=60,
+                    RecoveryDelay=100)
+    settings.update(overrides)
+    return SimpleNamespace(**settings)
+
+
+def feed(controller, results, start=0, step=10):
+    """Update controller with each ok value of results, step seconds apart.  Returns the events.
+    """
+    return [controller.update(ok, start + i * step) for i, ok in enumerate(results)]
+
+
+def test_single_failure_is_not_an_outage():
+    controller = probe_controller(snap())
+    assert feed(controller, [True, False, True, True]) == [None] * 4
+    assert not controller.in_outage()
+
+
+def test_loss_confirmed_by_k_of_n():
+    controller = probe_controller(snap())
+    events = feed(controller, [True, False, True, False])
+    assert events == [None, None, None, 'lost']
+    assert controller.state == 'down'
+    assert controller.outage_start == 10                            # Backdated to the first failed check
+
+
+def test_suspect_checks_faster():
+    controller = probe_controller(snap())
+    controller.update(False, 0)
+    assert controller.state == 'suspect'
+    assert controller.period(0) == 10
+
+
+def test_recovery_confirmed_then_ended_after_delay():
+    controller = probe_controller(snap())
+    feed(controller, [False, False])
+    assert controller.state == 'down'
+    assert controller.update(True, 20) is None
+    assert controller.state == 'recovering'
+    assert controller.update(True, 30) == 'recovered'
+    assert controller.recovered_time == 30
+    assert controller.period(30) == 10
+    assert controller.update(True, 100) is None                    # Within the RecoveryDelay
+    assert controller.update(True, 130) == 'ended'
+    assert (controller.outage_start, controller.outage_end) == (0, 10)
+    assert not controller.in_outage()
+
+
+def test_flap_during_hold_continues_the_outage():
+    controller = probe_controller(snap())
+    feed(controller, [False, False, True, True])
+    assert controller.state == 'hold'
+    assert feed(controller, [False, False], start=40) == [None, 'flap']
+    assert controller.flaps == 1
+    assert controller.outage_start == 0
+    assert controller.state == 'down'
+
+
+def test_outage_period_backs_off():
+    controller = probe_controller(snap())
+    feed(controller, [False, False])
+    periods = []
+    for i in range(6):
+        controller.update(False, 20 + i * 10)
+        periods.append(controller.period(0))
+    assert periods == [15, 22.5, 33.75, 50.625, 60, 60]
+    controller.update(True, 100)
+    assert controller.period(100) == 10
+
+
+def test_degraded_rtt_checks_sooner():
+    controller = probe_controller(snap())
+    for i in range(5):
+        controller.update(True, i * 600, rtt=20)
+    assert controller.period(0) == 600
+    controller.update(True, 3000, rtt=100)
+    assert controller.degraded
+    assert controller.period(3000) == 30
+    controller.update(True, 3600, rtt=20, failed=1)                 # Some targets failed
+    assert controller.degraded
@@ -0,0 +1,58 @@
+"""Tests for wanstatus.wanip.token_bucket.
+"""
+
+import pytest
+
+from wanstatus import wanip
+
+
+class fake_clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = fake_clock()
+    monkeypatch.setattr(wanip.time, "monotonic", clock)
+    monkeypatch.setattr(wanip.time, "time", clock)
+    return clock
+
+
+def test_capacity_then_refill(clock):
+    bucket = wanip.token_bucket(3, 3600)
+    assert [bucket.take() for _ in range(4)] == [True, True, True, False]
+    assert bucket.wait_time() == pytest.approx(1200)
+    clock.now += 1199
+    assert not bucket.take()
+    clock.now += 1
+    assert bucket.take()
+    assert not bucket.take()
+
+
+def test_refill_capped_at_capacity(clock):
+    bucket = wanip.token_bucket(2, 60)
+    bucket.take()
+    clock.now += 3600
+    assert [bucket.take() for _ in range(3)] == [True, True, False]
+
+
+def test_drain(clock):
+    bucket = wanip.token_bucket(5, 50)
+    bucket.drain()
+    assert not bucket.take()
+    assert bucket.wait_time() == pytest.approx(10)
+
+
+def test_state_restored_with_elapsed_refill(clock):
+    bucket = wanip.token_bucket(4, 400)
+    for _ in range(4):
+        bucket.take()
+    state = bucket.get_state()
+    clock.now += 150                                                # Eg, until the next interactive run
+    restored = wanip.token_bucket(4, 400)
+    restored.set_state(state)
+    assert [restored.take() for _ in range(2)] == [True, False]
@@ -0,0 +1,38 @@
+"""Tests for wanstatus.workers.daemon_pool.
+"""
+
+import threading
+
+import pytest
+
+from wanstatus.workers import daemon_pool
+
+
+def test_bounded_daemon_workers():
+    pool = daemon_pool(2, thread_name_prefix="test")
+    release = threading.Event()
+    futures = [pool.submit(release.wait, 5) for _ in range(4)]
+    assert len(pool.threads) == 2
+    assert all(thread.daemon for thread in pool.threads)
+    release.set()
+    assert [future.result(5) for future in futures] == [True] * 4
+    assert pool.submit(lambda x: x * 2, 21).result(5) == 42
+    assert len(pool.threads) == 2                                   # Idle workers reused
+    pool.shutdown()
+
+
+def test_exception_and_shutdown_cancel():
+    pool = daemon_pool(1)
+    with pytest.raises(ZeroDivisionError):
+        pool.submit(lambda: 1 / 0).result(5)
+    started = threading.Event()
+    release = threading.Event()
+    running = pool.submit(lambda: started.set()  or  release.wait(5))
+    queued = pool.submit(lambda: "not run")
+    assert started.wait(5)
+    pool.shutdown(wait=False, cancel_futures=True)
+    assert queued.cancelled()
+    release.set()
+    assert running.result(5)
+    with pytest.raises(RuntimeError):
+        pool.submit(lambda: None)